@@ -4,24 +4,74 @@
 
 Implementations used for bot detection.
 
+The package is imported lazily: ``import botdetection`` does not import flask,
+werkzeug or redis, the submodules (e.g. ``botdetection.ip_limit``) are imported
+on first access and the schema of the configuration is loaded on first use of
+:py:obj:`Context.cfg`.
+
+Contexts
+~~~~~~~~
+
+The filter methods use the *current* context :py:obj:`ctx`: the configuration
+(:py:obj:`Context.cfg`), the redis client (:py:obj:`Context.redis_client`) and
+the per worker state of the methods (e.g. the :ref:`local tier
+<botdetection.local_tier>`) are taken from this context.  By default, this is
+one global context.  To serve multiple, isolated configurations (e.g. tenants)
+in one process, create a :py:obj:`Context` for each configuration and activate
+it (:py:obj:`Context.use`) while a request is processed:
+
+.. code:: python
+
+   tenant_a = botdetection.Context()
+   tenant_a.init(toml_cfg_a, redis.Redis.from_url(redis_url_a))
+
+   with tenant_a.use():
+       network = botdetection.get_network(real_ip, botdetection.ctx.cfg)
+       response = botdetection.ip_limit.filter_request(network, request, botdetection.ctx.cfg)
+
+The current context is a :py:obj:`contextvars.ContextVar`: it is local to a
+thread and to an :py:mod:`asyncio` task.
+
 """
 from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, TYPE_CHECKING
 
-from dataclasses import dataclass
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import importlib
+import os
 import pathlib
+import threading
 
-import redis
 from .config import Config
 
 from ._helpers import logger
 from ._helpers import dump_request
 from ._helpers import get_real_ip
+from ._helpers import resolve_real_ip
+from ._helpers import RealIP
 from ._helpers import get_network
+from ._helpers import NetworkKey
 from ._helpers import too_many_requests
 
+if TYPE_CHECKING:
+    import redis
+
 logger = logger.getChild('init')
 
-__all__ = ['dump_request', 'get_network', 'get_real_ip', 'too_many_requests']
+__all__ = [
+    'Context',
+    'ctx',
+    'current_context',
+    'dump_request',
+    'get_network',
+    'get_real_ip',
+    'resolve_real_ip',
+    'RealIP',
+    'too_many_requests',
+    'NetworkKey',
+]
 
 CFG_SCHEMA = pathlib.Path(__file__).parent / "schema.toml"
 """Base configuration (schema) of the botdetection."""
@@ -33,16 +83,128 @@ CFG_DEPRECATED = {
 
 @dataclass
 class Context:
-    """A global context of the botdetection"""
-
-    # pylint: disable=too-few-public-methods
+    """A context of the botdetection: the configuration, the redis client and
+    the per worker state of the methods."""
 
     redis_client: redis.Redis | None = None
-    cfg: Config = Config.from_toml(schema_file=CFG_SCHEMA, cfg_file=None, deprecated=CFG_DEPRECATED)
-
-    def init(self, toml_cfg: pathlib.Path, redis_client: redis.Redis | None):
+    _cfg: Config | None = field(default=None, repr=False)
+    _state: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+    _lock: threading.RLock = field(default_factory=threading.RLock, repr=False, compare=False)
+
+    @property
+    def cfg(self) -> Config:
+        """The configuration, on first use it is build from the schema
+        (:py:obj:`CFG_SCHEMA`)."""
+        cfg = self._cfg
+        if cfg is None:
+            with self._lock:
+                if self._cfg is None:
+                    self._cfg = Config.from_toml(schema_file=CFG_SCHEMA, cfg_file=None, deprecated=CFG_DEPRECATED)
+                cfg = self._cfg
+        return cfg
+
+    @cfg.setter
+    def cfg(self, cfg: Config):
+        self._cfg = cfg
+
+    def init(self, toml_cfg: pathlib.Path, redis_client: redis.Redis | None, cache_dir: pathlib.Path | None = None):
+        """Initialize the context, the configuration is updated by the
+        ``toml_cfg`` file.  With a ``cache_dir`` (default: environment
+        ``BOTDETECTION_CACHE_DIR``) the configuration is build from the schema
+        and the ``toml_cfg`` file and loaded from the :ref:`config cache
+        <botdetection.config_cache>`."""
         self.redis_client = redis_client
-        self.cfg.load_toml(toml_cfg)
-
-
-ctx = Context()
+        if cache_dir is None and os.environ.get('BOTDETECTION_CACHE_DIR'):
+            cache_dir = pathlib.Path(os.environ['BOTDETECTION_CACHE_DIR'])
+        if cache_dir is None:
+            self.cfg.load_toml(toml_cfg)
+            return
+        from . import config_cache  # pylint: disable=import-outside-toplevel
+
+        cfg, upd_cfg = config_cache.load_config(CFG_SCHEMA, toml_cfg, CFG_DEPRECATED, cache_dir)
+        if self._cfg is None:
+            self._cfg = cfg
+        else:
+            # like load_toml: the configuration of the context is updated
+            self._cfg.update(upd_cfg)
+
+    def state(self, name: str, factory: Callable[[], Any]) -> Any:
+        """Returns the state ``name`` of a method in this context, on first use
+        the state is created by ``factory``."""
+        obj = self._state.get(name)
+        if obj is None:
+            with self._lock:
+                obj = self._state.get(name)
+                if obj is None:
+                    obj = self._state[name] = factory()
+        return obj
+
+    def worker_state(self, name: str, factory: Callable[[], Any] | None = None) -> Any:
+        """Returns the state ``name`` of a method in this worker process, like
+        :py:obj:`state`, but the state is created again in a forked process
+        (e.g. a state with a background thread, a thread does not survive a
+        fork).  Without a ``factory`` ``None`` is returned if the state has not
+        been created in this process."""
+        slot = self.state(name, lambda: [None])
+        state = slot[0]
+        pid = os.getpid()
+        if state is None or state[0] != pid:
+            if factory is None:
+                return None
+            with self._lock:
+                if slot[0] is None or slot[0][0] != pid:
+                    slot[0] = (pid, factory())
+                state = slot[0]
+        return state[1]
+
+    @contextmanager
+    def use(self) -> Iterator[Context]:
+        """Activates this context (:py:obj:`current_context`) in the ``with``
+        block."""
+        token = _CURRENT.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT.reset(token)
+
+
+_DEFAULT = Context()
+_CURRENT: ContextVar[Context | None] = ContextVar('botdetection_context', default=None)
+
+
+def current_context() -> Context:
+    """Returns the current context (:py:obj:`Context.use`), the global context
+    if no context has been activated."""
+    return _CURRENT.get() or _DEFAULT
+
+
+class _ContextProxy:
+    """Forwards the access of the attributes to the :py:obj:`current_context`."""
+
+    __slots__ = ()
+
+    def __getattribute__(self, name: str):
+        # not __getattr__: the lookup in the proxy would raise an AttributeError
+        # on each access
+        return getattr(_CURRENT.get() or _DEFAULT, name)
+
+    def __setattr__(self, name: str, value):
+        setattr(_CURRENT.get() or _DEFAULT, name, value)
+
+    def __repr__(self):
+        return f"<current {current_context()!r}>"
+
+
+ctx: Context = _ContextProxy()  # type: ignore
+"""The current context of the botdetection (see :py:obj:`current_context`)."""
+
+
+def __getattr__(name: str):
+    # import submodules on first access, e.g. ``botdetection.ip_limit``
+    if not name.startswith('__'):
+        try:
+            return importlib.import_module(f"{__name__}.{name}")
+        except ModuleNotFoundError as exc:
+            if exc.name != f"{__name__}.{name}":
+                raise
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
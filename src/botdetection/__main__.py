@@ -0,0 +1,9 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+"""Command line of the botdetection, see :py:obj:`botdetection.cli`."""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -3,68 +3,308 @@
 # pylint: disable=missing-module-docstring, invalid-name
 from __future__ import annotations
 
-import logging
+from typing import Dict, NamedTuple, Tuple, TYPE_CHECKING
+from functools import lru_cache
 from ipaddress import (
     IPv4Network,
     IPv6Network,
     IPv4Address,
     IPv6Address,
-    ip_network,
+    ip_address,
 )
-import flask
-import werkzeug
+import logging
+import socket
 
 from . import config
+from .log_throttle import LogThrottle
+
+if TYPE_CHECKING:
+    import flask
+    import werkzeug
 
 logger = logging.getLogger('botdetection')
+_log = LogThrottle(logger)
+
+
+_DUMP_HEADERS = (
+    'X-Forwarded-For',
+    'X-Real-IP',
+    'form',
+    'Accept',
+    'Accept-Language',
+    'Accept-Encoding',
+    'Content-Type',
+    'Content-Length',
+    'Connection',
+    'User-Agent',
+)
 
 
-def dump_request(request: flask.Request):
-    return (
-        request.path
-        + " || X-Forwarded-For: %s" % request.headers.get('X-Forwarded-For')
-        + " || X-Real-IP: %s" % request.headers.get('X-Real-IP')
-        + " || form: %s" % request.form
-        + " || Accept: %s" % request.headers.get('Accept')
-        + " || Accept-Language: %s" % request.headers.get('Accept-Language')
-        + " || Accept-Encoding: %s" % request.headers.get('Accept-Encoding')
-        + " || Content-Type: %s" % request.headers.get('Content-Type')
-        + " || Content-Length: %s" % request.headers.get('Content-Length')
-        + " || Connection: %s" % request.headers.get('Connection')
-        + " || User-Agent: %s" % request.headers.get('User-Agent')
+def dump_request(request: flask.Request) -> str:
+    """Returns a text with the path and the headers of the request (for
+    logging).  The form is only dumped if it has already been parsed, the body
+    of the request is never read.  To record blocked requests use the
+    :ref:`decisions <botdetection.decisions>`."""
+    headers = request.headers
+    # werkzeug caches the parsed form in the __dict__ of the request
+    form = request.__dict__.get('form')
+    return " || ".join(
+        [request.path]
+        + [f"{name}: {form if name == 'form' else headers.get(name)}" for name in _DUMP_HEADERS]
     )
 
 
-def too_many_requests(network: IPv4Network | IPv6Network, log_msg: str) -> werkzeug.Response | None:
+def too_many_requests(
+    network: NetworkKey,
+    log_msg: str,
+    method: str | None = None,
+    request: flask.Request | None = None,
+    detail: str = '',
+) -> werkzeug.Response | None:
     """Returns a HTTP 429 response object and writes a ERROR message to the
     'botdetection' logger.  This function is used in part by the filter methods
     to return the default ``Too Many Requests`` response.
 
+    If the name of the ``method`` is given, the block is recorded in the
+    :py:obj:`.decisions` with the reason ``log_msg`` (a constant text), the
+    ``detail`` (e.g. the value of a header) is only appended to the logged
+    message.
     """
 
-    logger.debug("BLOCK %s: %s", network.compressed, log_msg)
+    import flask  # pylint: disable=import-outside-toplevel
+
+    if method is not None:
+        from . import decisions  # pylint: disable=import-outside-toplevel, cyclic-import
+
+        decisions.record(network, method, log_msg, request)
+    logger.debug("BLOCK %s: %s%s", network.name, log_msg, detail)
     return flask.make_response(('Too Many Requests', 429))
 
 
-def get_network(real_ip: IPv4Address | IPv6Address, cfg: config.Config) -> IPv4Network | IPv6Network:
-    """Returns the (client) network of whether the real_ip is part of."""
+class NetworkKey(NamedTuple):
+    """A compact representation of a (client) network, see
+    :py:obj:`get_network`.
+
+    The network is stored as integer, :py:obj:`key` is the precomputed name of
+    the network (bytes) that is used to build the keys in the redis DB and
+    :py:obj:`name` is the text for logs and messages.  Objects from
+    :py:obj:`ipaddress` are only needed for logging (:py:obj:`ip_network`).
+    """
+
+    version: int
+    """IP version (``4`` or ``6``)"""
+
+    value: int
+    """The network address (the masked IP) as integer."""
+
+    prefixlen: int
+    """Number of leading bits of the network."""
+
+    key: bytes
+    """The :py:obj:`name` encoded (ASCII), the part of the redis keys."""
+
+    name: str
+    """Name of the network in the compressed notation (e.g. ``2001:db8::/48``),
+    identical to :py:obj:`ipaddress.IPv6Network.compressed`."""
+
+    @property
+    def compressed(self) -> str:
+        """Alias of :py:obj:`name` (duck-typed to :py:obj:`ipaddress.IPv4Network`)."""
+        return self.name
 
-    if real_ip.version == 6:
-        prefix = cfg['real_ip.ipv6_prefix']
+    @property
+    def is_link_local(self) -> bool:
+        """``True`` if the network is in ``169.254.0.0/16`` or ``fe80::/10``."""
+        if self.version == 4:
+            return self.prefixlen >= 16 and self.value >> 16 == 0xA9FE
+        return self.prefixlen >= 10 and self.value >> 118 == 0xFE80 >> 6
+
+    def supernet(self, prefixlen: int) -> NetworkKey:
+        """Returns the network with the (shorter) prefix ``prefixlen`` that
+        contains this network."""
+        return _supernet(self, prefixlen)
+
+    def ip_network(self) -> IPv4Network | IPv6Network:
+        """Returns the :py:obj:`ipaddress` object of the network."""
+        if self.version == 4:
+            return IPv4Network((self.value, self.prefixlen))
+        return IPv6Network((self.value, self.prefixlen))
+
+    def __str__(self):
+        return self.name
+
+
+_MASK = {4: (1 << 32) - 1, 6: (1 << 128) - 1}
+
+
+def _parse_ip(real_ip: str):
+    try:
+        if ':' in real_ip:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, real_ip), 'big')
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, real_ip), 'big')
+    except OSError:
+        # e.g. IPv6 with scope ID, raises ValueError if IP is invalid
+        addr = ip_address(real_ip)
+        return addr.version, int(addr)
+
+
+def _make_key(version: int, value: int, prefix: int) -> NetworkKey:
+    if version == 4:
+        value &= _MASK[4] ^ ((1 << (32 - prefix)) - 1)
+        name = f"{socket.inet_ntoa(value.to_bytes(4, 'big'))}/{prefix}"
     else:
-        prefix = cfg['real_ip.ipv4_prefix']
-    network = ip_network(f"{real_ip}/{prefix}", strict=False)
-    # logger.debug("get_network(): %s", network.compressed)
-    return network
+        value &= _MASK[6] ^ ((1 << (128 - prefix)) - 1)
+        name = IPv6Network((value, prefix)).compressed
+    return NetworkKey(version, value, prefix, name.encode(), name)
+
 
+class RealIP(NamedTuple):
+    """The (real) IP of a client as integer, see :py:obj:`resolve_real_ip`."""
 
-_logged_errors = []
+    version: int
+    """IP version (``4`` or ``6``)"""
 
+    value: int
+    """The IP as integer."""
 
-def _log_error_only_once(err_msg):
-    if err_msg not in _logged_errors:
-        logger.error(err_msg)
-        _logged_errors.append(err_msg)
+    ip: str
+    """The IP as it has been sent by the client or the proxy."""
+
+    def __int__(self):
+        return self.value
+
+    def __str__(self):
+        return self.ip
+
+
+@lru_cache(maxsize=4096)
+def _network_key(real_ip: IPv4Address | IPv6Address | str, ipv4_prefix: int, ipv6_prefix: int) -> NetworkKey:
+    if isinstance(real_ip, str):
+        version, value = _parse_ip(real_ip)
+    else:
+        version, value = real_ip.version, int(real_ip)
+    return _make_key(version, value, ipv4_prefix if version == 4 else ipv6_prefix)
+
+
+@lru_cache(maxsize=4096)
+def _supernet(network: NetworkKey, prefixlen: int) -> NetworkKey:
+    if prefixlen >= network.prefixlen:
+        return network
+    return _make_key(network.version, network.value, prefixlen)
+
+
+def get_network(real_ip: RealIP | IPv4Address | IPv6Address | str, cfg: config.Config) -> NetworkKey:
+    """Returns the (client) network of whether the real_ip is part of.  The
+    ``real_ip`` is a :py:obj:`RealIP` (from :py:obj:`resolve_real_ip`), an
+    :py:obj:`ipaddress` object or a string (e.g. the value from
+    :py:obj:`get_real_ip`).
+
+    The (client) networks of the most recent IPs are cached.
+    """
+
+    return _network_key(real_ip, cfg['real_ip.ipv4_prefix'], cfg['real_ip.ipv6_prefix'])
+
+
+ProxyIndex = Dict[int, Tuple[Tuple[int, frozenset], ...]]
+
+
+@lru_cache(maxsize=16)
+def _compile_proxies(nets: Tuple[str, ...]) -> ProxyIndex:
+    """Compiles the trusted proxy networks to a ``{version: ((mask,
+    networks), ..)}`` index, one set of (masked) networks per prefix
+    length."""
+    by_prefix: Dict[Tuple[int, int], set] = {}
+    for net in nets:
+        network = IPv6Network(net, strict=False) if ':' in net else IPv4Network(net, strict=False)
+        by_prefix.setdefault((network.version, network.prefixlen), set()).add(int(network.network_address))
+    index: ProxyIndex = {4: (), 6: ()}
+    for (version, prefixlen), values in sorted(by_prefix.items()):
+        bits = 32 if version == 4 else 128
+        mask = _MASK[version] ^ ((1 << (bits - prefixlen)) - 1)
+        index[version] += ((mask, frozenset(values)),)
+    return index
+
+
+def _is_trusted(index: ProxyIndex, version: int, value: int) -> bool:
+    for mask, values in index[version]:
+        if value & mask in values:
+            return True
+    return False
+
+
+@lru_cache(maxsize=4096)
+def _resolve(
+    forwarded_for: str | None, real_ip: str | None, remote_addr: str | None, proxies: Tuple[str, ...]
+) -> RealIP:
+    """Returns the client IP, the hops are walked from the right (the
+    ``remote_addr``) to the left, the first hop that is not a trusted proxy is
+    the client.  The X-Real-IP header is only a hop if there is no
+    X-Forwarded-For header."""
+
+    index = _compile_proxies(proxies)
+    if forwarded_for:
+        hops = forwarded_for.split(',')
+    else:
+        hops = [real_ip] if real_ip else []
+    hops.append(remote_addr or '0.0.0.0')
+
+    client = None
+    for hop in reversed(hops):
+        hop = hop.strip()
+        try:
+            version, value = _parse_ip(hop)
+        except ValueError:
+            # a proxy has sent an invalid hop, the client is the last valid hop
+            _log.warning("invalid IP %r in X-Forwarded-For: %s", hop, forwarded_for)
+            break
+        client = RealIP(version, value, hop)
+        if not _is_trusted(index, version, value):
+            break
+
+    if client is None:
+        client = RealIP(4, 0, '0.0.0.0')
+    if forwarded_for and real_ip:
+        try:
+            if _parse_ip(real_ip.strip()) != (client.version, client.value):
+                _log.warning("IP from X-Real-IP (%s) is not equal to the client IP (%s)", real_ip, client.ip)
+        except ValueError:
+            _log.warning("invalid IP in X-Real-IP: %r", real_ip)
+    return client
+
+
+@lru_cache(maxsize=4096)
+def _real_ip(real_ip: str) -> RealIP:
+    version, value = _parse_ip(real_ip)
+    return RealIP(version, value, real_ip)
+
+
+def resolve_real_ip(request: flask.Request) -> RealIP:
+    """Returns the real IP of the request as :py:obj:`RealIP`.
+
+    If trusted proxies are configured (``real_ip.trusted_proxies``) the
+    X-Forwarded-For_ header is walked from the right and hops from the trusted
+    proxy networks are skipped, the client is the first hop that is not a
+    trusted proxy.  Without a X-Forwarded-For_ header, the X-Real-IP header is
+    used if the :py:obj:`flask.Request.remote_addr` is a trusted proxy.  The
+    results are cached by the (raw) values of the headers and the
+    ``remote_addr``, a warning (e.g. about an invalid IP) is only logged once
+    per (cached) combination.
+
+    Without trusted proxies, the IP from :py:obj:`get_real_ip` is returned
+    (raises a :py:obj:`ValueError` if the IP is invalid).
+    """
+
+    from . import ctx  # pylint: disable=import-outside-toplevel, cyclic-import
+
+    proxies = ctx.cfg.get('real_ip.trusted_proxies', default=[])
+    if not proxies:
+        return _real_ip(get_real_ip(request))
+    return _resolve(
+        request.headers.get('X-Forwarded-For'),
+        request.headers.get('X-Real-IP'),
+        request.remote_addr,
+        tuple(proxies),
+    )
 
 
 def get_real_ip(request: flask.Request) -> str:
@@ -78,7 +318,8 @@ def get_real_ip(request: flask.Request) -> str:
 
     This function tries to get the remote IP in the order listed below,
     additional some tests are done and if inconsistencies or errors are
-    detected, they are logged.
+    detected, they are logged (repeated messages are summarized, see
+    :ref:`botdetection.log_throttle`).
 
     The remote IP of the request is taken from (first match):
 
@@ -92,8 +333,15 @@ def get_real_ip(request: flask.Request) -> str:
     .. _X-Forwarded-For:
       https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/X-Forwarded-For
 
+    If trusted proxies are configured (``real_ip.trusted_proxies``), the IP is
+    determined by :py:obj:`resolve_real_ip`.
     """
 
+    from . import ctx  # pylint: disable=import-outside-toplevel, cyclic-import
+
+    if ctx.cfg.get('real_ip.trusted_proxies', default=[]):
+        return resolve_real_ip(request).ip
+
     forwarded_for = request.headers.get("X-Forwarded-For")
     real_ip = request.headers.get('X-Real-IP')
     remote_addr = request.remote_addr
@@ -102,27 +350,25 @@ def get_real_ip(request: flask.Request) -> str:
     # )
 
     if not forwarded_for:
-        _log_error_only_once("X-Forwarded-For header is not set!")
+        _log.error("X-Forwarded-For header is not set!")
     else:
-        from . import ctx  # pylint: disable=import-outside-toplevel, cyclic-import
-
         forwarded_for = [x.strip() for x in forwarded_for.split(',')]
         x_for: int = ctx.cfg['real_ip.x_for']  # type: ignore
         forwarded_for = forwarded_for[-min(len(forwarded_for), x_for)]
 
     if not real_ip:
-        _log_error_only_once("X-Real-IP header is not set!")
+        _log.error("X-Real-IP header is not set!")
 
     if forwarded_for and real_ip and forwarded_for != real_ip:
-        logger.warning("IP from X-Real-IP (%s) is not equal to IP from X-Forwarded-For (%s)", real_ip, forwarded_for)
+        _log.warning("IP from X-Real-IP (%s) is not equal to IP from X-Forwarded-For (%s)", real_ip, forwarded_for)
 
     if forwarded_for and remote_addr and forwarded_for != remote_addr:
-        logger.warning(
+        _log.warning(
             "IP from WSGI environment (%s) is not equal to IP from X-Forwarded-For (%s)", remote_addr, forwarded_for
         )
 
     if real_ip and remote_addr and real_ip != remote_addr:
-        logger.warning("IP from WSGI environment (%s) is not equal to IP from X-Real-IP (%s)", remote_addr, real_ip)
+        _log.warning("IP from WSGI environment (%s) is not equal to IP from X-Real-IP (%s)", remote_addr, real_ip)
 
     request_ip = forwarded_for or real_ip or remote_addr or '0.0.0.0'
     # logger.debug("get_real_ip() -> %s", request_ip)
@@ -0,0 +1,161 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.batch:
+
+Batch evaluation
+----------------
+
+In a gateway deployment (e.g. a sidecar of a proxy) the metadata of the
+requests is received in batches.  The :py:obj:`evaluate` function takes a list
+of lightweight request descriptors (:py:obj:`RequestInfo`) and evaluates them
+by the :py:obj:`.ip_limit` method in two roundtrips to the redis DB:
+
+1. the pings of the :py:obj:`.link_token` method are read in one MGET (only if
+   ``link_token`` is activated)
+
+2. the windows of all requests are counted in one pipeline, each request is a
+   single lua script (see :py:func:`.redislib.incr_windows`)
+
+The lua scripts in the pipeline are executed in the order of the batch, the
+verdicts are the verdicts of :py:func:`.ip_limit.evaluate` for the requests
+one by one:
+
+- A block from the :ref:`verdict propagation <botdetection.propagation>` is
+  looked up before the requests are counted and again when the counts are
+  evaluated: a request of a network that has been blocked by a previous
+  request in the batch gets the verdict of the block.  Different to the
+  evaluation one by one, the request has been counted in the windows of the
+  network.
+
+- If the :ref:`local tier <botdetection.local_tier>` or the :ref:`shadow
+  evaluation <botdetection.shadow>` is enabled, the requests of a batch are
+  evaluated one by one.
+
+Like :py:func:`.ip_limit.evaluate`, a batch does not apply the HTTP header
+methods of the :ref:`load shedding <botdetection.load_shedding>` (level 2),
+these are only applied by :py:func:`.ip_limit.filter_request`.
+
+.. code:: python
+
+   from botdetection import batch
+
+   verdicts = batch.evaluate([
+       batch.RequestInfo('192.0.2.17', '/search', args={'format': 'json'}),
+       batch.RequestInfo('2001:db8::1', '/search', headers={'User-Agent': '...'}),
+   ])
+   for v in verdicts:
+       print(v.blocked, v.status, v.reason)
+
+.. note::
+
+   In the *adaptive prefix* mode of the :py:obj:`.ip_limit` method, a request
+   can split an aggregate, which changes the counter of the following requests
+   in the batch.  In this mode the requests of a batch are evaluated one by
+   one.
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Iterable, List, Mapping, NamedTuple
+
+from types import MappingProxyType
+
+from . import ctx
+from . import config
+from . import heavy_hitters
+from . import ip_limit
+from . import link_token
+from . import propagation
+from .limiter import get_limiter
+from .local_tier import get_local_tier
+from .shadow import get_shadow
+from ._helpers import get_network
+
+_EMPTY: Mapping[str, str] = MappingProxyType({})
+
+
+class RequestInfo(NamedTuple):
+    """Lightweight descriptor of a request in a batch.  The descriptor has the
+    attributes of a :py:obj:`flask.Request` which are needed by the
+    :py:obj:`.ip_limit` method."""
+
+    real_ip: str
+    """(Real) IP of the client, see :py:func:`.get_real_ip`"""
+
+    path: str = '/'
+    """Path of the request URL (see :ref:`botdetection.policies`)"""
+
+    args: Mapping[str, str] = _EMPTY
+    """URL arguments of the request (``format``)"""
+
+    headers: Mapping[str, str] = _EMPTY
+    """HTTP headers of the request, the :py:obj:`.link_token` method needs the
+    ``Accept-Language`` and ``User-Agent`` headers."""
+
+
+def evaluate(requests: Iterable[RequestInfo], cfg: config.Config | None = None) -> List[ip_limit.Verdict]:
+    """Evaluates a batch of requests by the :py:obj:`.ip_limit` method and
+    returns the list of the verdicts (in the order of the ``requests``)."""
+
+    # pylint: disable=too-many-locals, too-many-branches
+
+    if cfg is None:
+        cfg = ctx.cfg
+    lcfg = cfg['botdetection.ip_limit']
+    client = ctx.redis_client
+    items = [(get_network(req.real_ip, cfg), req) for req in requests]
+
+    if lcfg['adaptive_prefix'] or get_local_tier() is not None or get_shadow() is not None:
+        return [ip_limit.evaluate(network, req, cfg) for network, req in items]
+
+    verdicts = [ip_limit.PASS] * len(items)
+    monitored = []
+    for i, (network, _) in enumerate(items):
+        if not ip_limit.is_monitored(network, cfg):
+            continue
+        cached = propagation.lookup(network)
+        if cached is not None:
+            verdicts[i] = ip_limit.Verdict(*cached)
+            continue
+        monitored.append(i)
+    if not monitored:
+        return _recorded(items, verdicts)
+
+    ping_keys = [None] * len(items)
+    if lcfg['link_token']:
+        keys = [link_token.get_ping_key(*items[i]) for i in monitored]
+        for i, key, ping in zip(monitored, keys, client.mget(keys)):
+            if ping:
+                ping_keys[i] = key
+
+    limiter = get_limiter(lcfg['strategy'])
+    pipe = client.pipeline(transaction=False)
+    queued = []
+    for i in monitored:
+        network, req = items[i]
+        windows = ip_limit.get_windows(network, network, req, cfg, ping_keys[i])
+        if windows:
+            limiter.incr_windows(client, windows, pipe)
+        queued.append((i, windows))
+
+    results = iter(pipe.execute())
+    for i, windows in queued:
+        counts = next(results) if windows else None
+        network = items[i][0]
+        # blocked by a previous request of the batch
+        cached = propagation.lookup(network)
+        if cached is not None:
+            verdicts[i] = ip_limit.Verdict(*cached)
+        elif counts is not None:
+            verdicts[i] = ip_limit.get_verdict(network, network, windows, counts, cfg)
+    return _recorded(items, verdicts)
+
+
+def _recorded(items, verdicts: List[ip_limit.Verdict]) -> List[ip_limit.Verdict]:
+    # the requests and the verdicts are counted by the heavy hitters (like in
+    # ip_limit.evaluate)
+    for (network, _), verdict in zip(items, verdicts):
+        heavy_hitters.record(network, verdict.blocked)
+    return verdicts
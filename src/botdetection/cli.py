@@ -0,0 +1,407 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.cli:
+
+Command line
+------------
+
+The command line tool inspects the keys which are stored by the botdetection
+in the redis DB.  The keys are streamed by SCAN_ (never KEYS_) and all commands
+to the redis DB are limited to a budget of ``--ops`` commands per second, so
+that the tool is safe to use against a production DB.
+
+.. code:: sh
+
+   $ python -m botdetection --redis-url unix:///run/redis/redis.sock COMMAND
+
+``scan [--match PATTERN]``
+  Lists the keys (type, TTL, key and a summary of the value), by default the
+  keys with the ``REDIS_KEY_PREFIX`` and the keys of the :py:obj:`.link_token`
+  method.
+
+``export [--match PATTERN] [--output FILE]``
+  Exports the keys as JSON lines.
+
+``show NETWORK``
+  Shows the windows of the :py:obj:`.ip_limit` method, the ping of the
+  :py:obj:`.link_token` method and the block of the :ref:`exporter
+  <botdetection.exporter>` of a (client) network (IP or CIDR).
+
+``memory [--samples N]``
+  Samples random keys and estimates the memory of the keys by key type and the
+  bytes per tracked client (see :py:obj:`memory_report`).
+
+``unblock NETWORK``
+  Drops the ``ip_limit.*`` counters (all strategies and policies) and the
+  recorded block of a (client) network.  A block in the caches of the
+  :ref:`verdict propagation <botdetection.propagation>` is revoked.
+
+``delta {pass_ip,block_ip} FILE [--keep N]``
+  Publishes a delta file in the log of the IP list (see
+  :py:obj:`.ip_deltas`).  With ``--keep`` the older deltas are folded into
+  one, the newest ``N`` deltas are kept.
+
+If a ``secret_hash`` is configured (see :ref:`botdetection.redislib
+<botdetection src>`), the names of the keys can't be decoded and the ping of a
+network is unknown, but the counters of a network are found by ``show`` and
+``unblock``.
+
+.. _SCAN: https://redis.io/commands/scan/
+.. _KEYS: https://redis.io/commands/keys/
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, Iterator, List
+
+import argparse
+import ipaddress
+import json
+import pathlib
+import sys
+import time
+
+import redis
+
+from . import ctx
+from . import config
+from . import exporter
+from . import ip_deltas
+from . import link_token
+from . import propagation
+from .policies import get_policy_table
+from .redislib import key_prefix, redis_key, compact_keys, KEY_TAGS
+from ._helpers import get_network, NetworkKey
+
+KEY_TYPES = ('counter', 'bucket', 'gcra', 'distinct')
+"""Types of the keys in the redis DB (see :py:obj:`.redislib`)."""
+
+LINK_TOKEN_KEYS = 'botdetection.link_token.*'
+"""Pattern of the keys of the :py:obj:`.link_token` method (without
+:py:obj:`.redislib.REDIS_KEY_PREFIX`)."""
+
+
+class OpsBudget:
+    """Limits the commands to the redis DB to ``rate`` commands per second."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._start = time.monotonic()
+        self._ops = 0
+
+    def spend(self, ops: int = 1):
+        """Spends ``ops`` commands, sleeps if the budget is exhausted."""
+        self._ops += ops
+        if self.rate <= 0:
+            return
+        delay = self._ops / self.rate - (time.monotonic() - self._start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='backslashreplace')
+    return value
+
+
+def parse_key(key: bytes | str) -> dict:
+    """Splits a ``key`` of the botdetection into the key type and the name
+    (see :py:func:`.redislib.redis_key`), the name of a compact key is the hex
+    digest."""
+    if isinstance(key, str):
+        key = key.encode()
+    prefix = key_prefix().encode()
+    name = key[len(prefix) :] if key.startswith(prefix) else key
+    if compact_keys() and key.startswith(prefix):
+        key_type = next((t for t, tag in KEY_TAGS.items() if name.startswith(tag.encode())), None)
+        if key_type:
+            return {'key_type': key_type, 'name': name[1:].hex()}
+    key_type, sep, rest = _decode(name).partition('_')
+    if sep and key_type in KEY_TYPES:
+        return {'key_type': key_type, 'name': rest}
+    return {'key_type': None, 'name': _decode(name)}
+
+
+def describe(client, keys: List[bytes], budget: OpsBudget) -> List[dict]:
+    """Returns type, TTL (sec) and a summary of the value of the ``keys``, the
+    commands are send in two pipelines."""
+
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        pipe.ttl(key)
+    budget.spend(2 * len(keys))
+    meta = pipe.execute()
+
+    types = [_decode(t) for t in meta[0::2]]
+    for key, key_type in zip(keys, types):
+        if key_type == 'zset':
+            pipe.zcard(key)
+        elif key_type == 'hash':
+            pipe.hgetall(key)
+        elif key_type == 'string':
+            pipe.get(key)
+        elif key_type == 'set':
+            pipe.scard(key)
+        else:
+            pipe.exists(key)
+    budget.spend(len(keys))
+    values = pipe.execute()
+
+    items = []
+    for key, key_type, ttl, value in zip(keys, types, meta[1::2], values):
+        if key_type == 'hash':
+            value = {_decode(k): _decode(v) for k, v in value.items()}
+        elif isinstance(value, bytes) and value.startswith(b'HYLL'):
+            budget.spend()
+            value = client.pfcount(key)
+        else:
+            value = _decode(value)
+        items.append({'key': _decode(key), 'type': key_type, 'ttl': ttl, 'value': value, **parse_key(key)})
+    return items
+
+
+def scan(client, match: str | None, budget: OpsBudget, count: int = 100) -> Iterator[dict]:
+    """Streams the keys which match the glob-style pattern ``match`` (default:
+    the keys with prefix :py:obj:`.redislib.REDIS_KEY_PREFIX` and the keys of
+    the :py:obj:`.link_token` method)."""
+    patterns = [match] if match else [key_prefix() + '*', LINK_TOKEN_KEYS]
+    for pattern in patterns:
+        cursor = 0
+        while True:
+            budget.spend()
+            cursor, keys = client.scan(cursor, match=pattern, count=count)
+            if keys:
+                yield from describe(client, keys, budget)
+            if not cursor:
+                break
+
+
+def parse_network(value: str, cfg: config.Config) -> NetworkKey:
+    """Returns the (client) network of an IP or the network of a CIDR."""
+    net = ipaddress.ip_network(value, strict=False)
+    network = get_network(net.network_address, cfg)
+    if net.prefixlen < network.prefixlen:
+        network = network.supernet(net.prefixlen)
+    return network
+
+
+def counter_names(network: NetworkKey, cfg: config.Config) -> List[bytes]:
+    """Returns the names of the ``ip_limit.*`` counters of a (client)
+    network (windows of all policies)."""
+    table = get_policy_table(cfg)
+    counters = {b'ip_limit.'}
+    counters.update(p.counter for p in table.exact.values())
+    counters.update(p.counter for _, p in table.prefixes)
+    names = [b'ip_limit.API_WINDOW:' + network.key, b'ip_limit.SUSPICIOUS_IP_WINDOW' + network.key]
+    for counter in sorted(counters):
+        names.extend(counter + window + network.key for window in (b'BURST_WINDOW', b'LONG_WINDOW'))
+    return names
+
+
+def counter_keys(network: NetworkKey, cfg: config.Config) -> List[bytes]:
+    """Returns the keys of the ``ip_limit.*`` counters of a (client) network
+    (all strategies)."""
+    return [
+        redis_key(key_type, name) for name in counter_names(network, cfg) for key_type in ('counter', 'bucket', 'gcra')
+    ]
+
+
+def _glob_escape(value: str) -> str:
+    return ''.join('\\' + c if c in '*?[]\\' else c for c in value)
+
+
+def show(client, network: NetworkKey, cfg: config.Config, budget: OpsBudget) -> dict:
+    """Returns the counters, the pings and the recorded block of a network."""
+    keys = counter_keys(network, cfg)
+    budget.spend(len(keys))
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.exists(key)
+    existing = [key for key, exists in zip(keys, pipe.execute()) if exists]
+
+    result = {'network': network.name, 'counters': describe(client, existing, budget) if existing else []}
+
+    if cfg.get('botdetection.redis.secret_hash', default=None):
+        result['pings'] = None
+    else:
+        match = _glob_escape(link_token.PING_KEY + '[' + network.name) + '*'
+        pings, cursor = 0, 0
+        while True:
+            budget.spend()
+            cursor, found = client.scan(cursor, match=match, count=1000)
+            pings += len(found)
+            if not cursor:
+                break
+        result['pings'] = pings
+
+    budget.spend()
+    until = client.zscore(exporter.blocked_key(), network.name)
+    result['blocked_until'] = until
+    return result
+
+
+def unblock(client, network: NetworkKey, cfg: config.Config, budget: OpsBudget) -> int:
+    """Drops the ``ip_limit.*`` counters and the recorded block of a network,
+    returns the number of dropped keys."""
+    keys = counter_keys(network, cfg)
+    budget.spend(2)
+    pipe = client.pipeline(transaction=False)
+    pipe.delete(*keys)
+    pipe.zrem(exporter.blocked_key(), network.name)
+    dropped, _ = pipe.execute()
+    budget.spend()
+    propagation.revoke(network)
+    return dropped
+
+
+def memory_report(client, cfg: config.Config, budget: OpsBudget, samples: int = 1000) -> dict:
+    """Samples ``samples`` random keys (RANDOMKEY_) and their memory
+    (`MEMORY USAGE`_) and estimates the memory of the botdetection keys by key
+    type and the bytes per tracked client (network).
+
+    The number of tracked clients is estimated from the keys of the
+    ``ip_limit.LONG_WINDOW`` windows.  If the names of the keys can't be
+    decoded (``compact_keys`` or ``secret_hash``), the number is estimated from
+    the counters of the windows (two windows per client: BURST and LONG).
+
+    .. _RANDOMKEY: https://redis.io/commands/randomkey/
+    .. _MEMORY USAGE: https://redis.io/commands/memory-usage/
+    """
+    # pylint: disable=too-many-locals
+
+    budget.spend()
+    dbsize = client.dbsize()
+    pipe = client.pipeline(transaction=False)
+    for _ in range(samples):
+        pipe.randomkey()
+    budget.spend(samples)
+    prefixes = (key_prefix().encode(), LINK_TOKEN_KEYS[:-1].encode())
+    keys = [k for k in pipe.execute() if k is not None and k.startswith(prefixes)]
+
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+    budget.spend(len(keys))
+    usage = pipe.execute()
+
+    by_type: Dict[str, List[int]] = {}
+    long_windows = 0
+    windows = 0
+    for key, size in zip(keys, usage):
+        item = parse_key(key)
+        key_type = item['key_type'] or ('ping' if key.startswith(link_token.PING_KEY.encode()) else 'other')
+        by_type.setdefault(key_type, []).append(int(size or 0))
+        if key_type in ('counter', 'bucket', 'gcra'):
+            windows += 1
+            long_windows += item['name'].startswith('ip_limit.LONG_WINDOW')
+
+    scale = dbsize / samples if samples else 0
+    readable = not compact_keys() and not cfg.get('botdetection.redis.secret_hash', default=None)
+    clients = (long_windows if readable else windows / 2) * scale
+    total = sum(sum(sizes) for sizes in by_type.values()) * scale
+    return {
+        'dbsize': dbsize,
+        'samples': samples,
+        'keys': len(keys) * scale,
+        'bytes': total,
+        'clients': clients,
+        'bytes_per_client': total / clients if clients else None,
+        'types': {
+            key_type: {'keys': len(sizes) * scale, 'bytes': sum(sizes) * scale, 'avg': sum(sizes) / len(sizes)}
+            for key_type, sizes in sorted(by_type.items())
+        },
+    }
+
+
+def _format(item: dict) -> str:
+    value = item['value']
+    if isinstance(value, dict):
+        value = ' '.join(f"{k}={v}" for k, v in value.items())
+    return f"{item['type']:<7} {item['ttl']:>8} {item['key']}  {value}"
+
+
+def main(argv=None):  # pylint: disable=too-many-branches, too-many-statements, too-many-locals
+    """Command line to inspect the keys of the botdetection redis DB."""
+    parser = argparse.ArgumentParser(prog='python -m botdetection', description="Inspect the botdetection redis DB")
+    parser.add_argument('--config', type=pathlib.Path, default=None, help="botdetection TOML config")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0', help="URL of the redis DB")
+    parser.add_argument('--ops', type=float, default=1000, help="max. commands per second (default: 1000)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('scan', help="list the keys")
+    p.add_argument('--match', default=None, help="glob-style pattern of the keys")
+    p = sub.add_parser('export', help="export the keys as JSON lines")
+    p.add_argument('--match', default=None, help="glob-style pattern of the keys")
+    p.add_argument('--output', type=pathlib.Path, default=None, help="output file (default: stdout)")
+    p = sub.add_parser('show', help="show the counters of a network")
+    p.add_argument('network', help="IP or CIDR")
+    p = sub.add_parser('memory', help="estimate the memory of the keys")
+    p.add_argument('--samples', type=int, default=1000, help="number of sampled keys (default: 1000)")
+    p = sub.add_parser('unblock', help="drop the ip_limit counters of a network")
+    p.add_argument('network', help="IP or CIDR")
+    p = sub.add_parser('delta', help="publish a delta of a IP list")
+    p.add_argument('list', choices=('pass_ip', 'block_ip'), help="name of the IP list")
+    p.add_argument('file', type=pathlib.Path, help="delta file")
+    p.add_argument('--keep', type=int, default=None, help="fold the deltas except the newest KEEP deltas")
+    args = parser.parse_args(argv)
+
+    client = redis.Redis.from_url(args.redis_url)
+    if args.config is not None:
+        ctx.init(args.config, client)
+    ctx.redis_client = client
+    cfg = ctx.cfg
+    budget = OpsBudget(args.ops)
+
+    if args.command == 'scan':
+        for item in scan(client, args.match, budget):
+            print(_format(item))
+
+    elif args.command == 'export':
+        out = args.output.open('w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            for item in scan(client, args.match, budget):
+                out.write(json.dumps(item) + '\n')
+        finally:
+            if args.output:
+                out.close()
+
+    elif args.command == 'show':
+        result = show(client, parse_network(args.network, cfg), cfg, budget)
+        print(f"network: {result['network']}")
+        for item in result['counters']:
+            print("  " + _format(item))
+        print(f"pings: {'unknown (secret_hash)' if result['pings'] is None else result['pings']}")
+        if result['blocked_until']:
+            print(f"blocked until: {time.ctime(result['blocked_until'])}")
+
+    elif args.command == 'memory':
+        report = memory_report(client, cfg, budget, args.samples)
+        print(f"sampled {report['samples']} of {report['dbsize']} keys (estimated values)")
+        for key_type, item in report['types'].items():
+            print(
+                f"  {key_type:<9} {item['keys']:>12.0f} keys {item['bytes']:>14.0f} bytes"
+                f"  {item['avg']:>8.1f} bytes/key"
+            )
+        print(f"total: {report['keys']:.0f} keys, {report['bytes']:.0f} bytes")
+        if report['bytes_per_client']:
+            print(f"tracked clients: {report['clients']:.0f}, {report['bytes_per_client']:.1f} bytes/client")
+
+    elif args.command == 'unblock':
+        network = parse_network(args.network, cfg)
+        print(f"{network.name}: {unblock(client, network, cfg, budget)} keys dropped")
+
+    elif args.command == 'delta':
+        list_name = f"botdetection.ip_lists.{args.list}"
+        try:
+            delta = ip_deltas.load_delta(args.file)
+        except ValueError as exc:
+            parser.error(f"{args.file}: {exc}")
+        version = ip_deltas.publish(client, list_name, delta)
+        print(f"{list_name}: +{len(delta.add)} -{len(delta.remove)}, version {version}")
+        if args.keep is not None:
+            print(f"{ip_deltas.compact(client, list_name, args.keep)} deltas folded")
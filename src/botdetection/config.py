@@ -11,6 +11,7 @@ from __future__ import annotations
 from typing import Any
 
 import copy
+import itertools
 import typing
 import logging
 import pathlib
@@ -20,6 +21,8 @@ __all__ = ['Config', 'UNSET', 'SchemaIssue']
 
 log = logging.getLogger(__name__)
 
+_VERSIONS = itertools.count(1)
+
 
 class FALSE:
     """Class of ``False`` singelton"""
@@ -70,7 +73,9 @@ class Config:
         cfg.load_toml(cfg_file)
         return cfg
 
-    def load_toml(self, cfg_file: pathlib.Path):
+    def load_toml(self, cfg_file: pathlib.Path) -> dict:
+        """Updates this configuration by the ``cfg_file`` and returns the
+        (validated) update."""
         log.debug("load config file: %s", cfg_file)
         try:
             upd_cfg = toml.load(cfg_file)
@@ -84,7 +89,8 @@ class Config:
             log.error(str(msg))
         if not is_valid:
             raise TypeError(f"schema of {cfg_file} is invalid!")
-        self.update(upd_cfg)
+        self.update(copy_value(upd_cfg))
+        return upd_cfg
 
     def __init__(self, cfg_schema: typing.Dict, deprecated: typing.Dict[str, str]):
         """Construtor of class Config.
@@ -97,21 +103,36 @@ class Config:
         """
         self.cfg_schema = cfg_schema
         self.deprecated = deprecated
-        self.cfg = copy.deepcopy(cfg_schema)
+        self.cfg = copy_value(cfg_schema)
+        self._schema_table: typing.Dict[str, type] | None = None
+        self.version = next(_VERSIONS)
+        """A number that changes when the configuration is changed by
+        :py:obj:`update` or :py:obj:`set`, unique among all configurations of
+        the process.  Values derived from the configuration can be cached by
+        the version."""
+
+    def __setstate__(self, state: dict):
+        # an unpickled (or copied) configuration gets an own version
+        self.__dict__.update(state)
+        self.version = next(_VERSIONS)
 
     def __getitem__(self, key: str) -> Any:
         return self.get(key)
 
     def validate(self, cfg: dict):
         """Validation of dictionary ``cfg`` on :py:obj:`Config.SCHEMA`.
-        Validation is done by :py:obj:`validate`."""
+        Validation is done by :py:obj:`validate`, the schema is compiled once
+        (see :py:obj:`compile_schema`)."""
 
-        return validate(self.cfg_schema, cfg, self.deprecated)
+        if self._schema_table is None:
+            self._schema_table = compile_schema(self.cfg_schema)
+        return validate(self.cfg_schema, cfg, self.deprecated, schema_table=self._schema_table)
 
     def update(self, upd_cfg: dict):
         """Update this configuration by ``upd_cfg``."""
 
         dict_deepupdate(self.cfg, upd_cfg)
+        self.version = next(_VERSIONS)
 
     def default(self, name: str):
         """Returns default value of field ``name`` in ``self.cfg_schema``."""
@@ -143,6 +164,7 @@ class Config:
         """
         parent = self._get_parent_dict(name)
         parent[name.split('.')[-1]] = val
+        self.version = next(_VERSIONS)
 
     def _get_parent_dict(self, name):
         parent_name = '.'.join(name.split('.')[:-1])
@@ -209,8 +231,34 @@ def value(name: str, data_dict: dict):
     return ret_val
 
 
+def compile_schema(schema_dict: typing.Dict) -> typing.Dict[str, type]:
+    """Compiles the ``schema_dict`` into a flat validator table: a dictionary
+    that maps the (dotted) names of all values in the schema to the type of
+    the value.
+
+    .. code: python
+
+        >>> compile_schema({"foo": {"bar": 1 }, "foobar": [1, 2, 3]})
+        {'foo': <class 'dict'>, 'foo.bar': <class 'int'>, 'foobar': <class 'list'>}
+
+    """
+    table = {}
+    stack = [('', schema_dict)]
+    while stack:
+        prefix, schema = stack.pop()
+        for key, schema_value in schema.items():
+            name = prefix + key
+            table[name] = type(schema_value)
+            if isinstance(schema_value, dict):
+                stack.append((name + '.', schema_value))
+    return table
+
+
 def validate(
-    schema_dict: typing.Dict, data_dict: typing.Dict, deprecated: typing.Dict[str, str]
+    schema_dict: typing.Dict,
+    data_dict: typing.Dict,
+    deprecated: typing.Dict[str, str],
+    schema_table: typing.Dict[str, type] | None = None,
 ) -> typing.Tuple[bool, list]:
 
     """Deep validation of dictionary in ``data_dict`` against dictionary in
@@ -235,64 +283,81 @@ def validate(
           [schema invalid] data_dict: type mismatch 'fontlib.foo': expected ..., is ...
 
     If ``schema_dict`` or ``data_dict`` is not a dictionary type a
-    :py:obj:`SchemaIssue` is raised.
+    :py:obj:`SchemaIssue` is raised.  The ``schema_table`` is the compiled
+    ``schema_dict`` (see :py:obj:`compile_schema`), if it is not given the
+    ``schema_dict`` is compiled.
 
     """
-    names = []
-    is_valid = True
-    issue_list = []
+    issue_list: typing.List[SchemaIssue] = []
 
     if not isinstance(schema_dict, dict):
         raise SchemaIssue('invalid', "schema_dict is not a dict type")
     if not isinstance(data_dict, dict):
-        raise SchemaIssue('invalid', f"data_dict issue{'.'.join(names)} is not a dict type")
+        raise SchemaIssue('invalid', "data_dict issue is not a dict type")
 
-    is_valid, issue_list = _validate(names, issue_list, schema_dict, data_dict, deprecated)
+    if schema_table is None:
+        schema_table = compile_schema(schema_dict)
+    is_valid = _validate('', issue_list, schema_table, data_dict, deprecated)
     return is_valid, issue_list
 
 
 def _validate(
-    names: typing.List,
+    prefix: str,
     issue_list: typing.List,
-    schema_dict: typing.Dict,
+    schema_table: typing.Dict[str, type],
     data_dict: typing.Dict,
     deprecated: typing.Dict[str, str],
-) -> typing.Tuple[bool, typing.List]:
+) -> bool:
 
     is_valid = True
 
     for key, data_value in data_dict.items():
 
-        names.append(key)
-        name = '.'.join(names)
+        name = prefix + key
 
         deprecated_msg = deprecated.get(name)
-        # print("XXX %s: key %s //   data_value: %s" % (name, key, data_value))
         if deprecated_msg:
             issue_list.append(SchemaIssue('warn', f"data_dict '{name}': deprecated - {deprecated_msg}"))
 
-        schema_value = value(name, schema_dict)
-        # print("YYY %s: key %s // schema_value: %s" % (name, key, schema_value))
-        if schema_value is UNSET:
+        schema_type = schema_table.get(name)
+        if schema_type is None:
             if not deprecated_msg:
                 issue_list.append(SchemaIssue('invalid', f"data_dict '{name}': key unknown in schema_dict"))
                 is_valid = False
 
-        elif type(schema_value) != type(data_value):  # pylint: disable=unidiomatic-typecheck
+        elif schema_type is not type(data_value):  # pylint: disable=unidiomatic-typecheck
             issue_list.append(
                 SchemaIssue(
                     'invalid',
-                    (f"data_dict: type mismatch '{name}':" f" expected {type(schema_value)}, is: {type(data_value)}"),
+                    (f"data_dict: type mismatch '{name}':" f" expected {schema_type}, is: {type(data_value)}"),
                 )
             )
             is_valid = False
 
-        elif isinstance(data_value, dict):
-            _valid, _ = _validate(names, issue_list, schema_dict, data_value, deprecated)
-            is_valid = is_valid and _valid
-        names.pop()
+        elif schema_type is dict:
+            is_valid = _validate(name + '.', issue_list, schema_table, data_value, deprecated) and is_valid
 
-    return is_valid, issue_list
+    return is_valid
+
+
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+
+def copy_value(val: Any) -> Any:
+    """Returns a deep copy of a configuration value.  The values of a TOML
+    file are dictionaries, lists and immutable scalars, only the containers
+    are copied (:py:obj:`copy.deepcopy` is used for all other types)."""
+    if isinstance(val, _IMMUTABLE):
+        return val
+    if isinstance(val, dict):
+        return {k: copy_value(v) for k, v in val.items()}
+    if isinstance(val, list):
+        if all(isinstance(v, _IMMUTABLE) for v in val):
+            return val.copy()
+        return [copy_value(v) for v in val]
+    if isinstance(val, set):
+        return val.copy()
+    return copy.deepcopy(val)
 
 
 def dict_deepupdate(base_dict: dict, upd_dict: dict, names=None):
@@ -343,7 +408,7 @@ def dict_deepupdate(base_dict: dict, upd_dict: dict, names=None):
 
             else:
                 # if base_dict[upd_key] not exist, set base_dict[upd_key] from deepcopy of upd_val
-                base_dict[upd_key] = copy.deepcopy(upd_val)
+                base_dict[upd_key] = copy_value(upd_val)
 
         elif isinstance(upd_val, list):
 
@@ -357,7 +422,7 @@ def dict_deepupdate(base_dict: dict, upd_dict: dict, names=None):
             else:
                 # if base_dict[upd_key] doesn't exists, set base_dict[key] from a deepcopy of the
                 # list in upd_val.
-                base_dict[upd_key] = copy.deepcopy(upd_val)
+                base_dict[upd_key] = copy_value(upd_val)
 
         elif isinstance(upd_val, set):
 
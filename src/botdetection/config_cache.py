@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.config_cache:
+
+Config cache
+------------
+
+On start, each worker parses the TOML files (schema and config), validates the
+config and compiles the indexes of the IP lists (:py:obj:`.ip_arrays`).  With
+a cache directory, these *artifacts* are stored in a file on the first start
+and the following starts (the other workers, a restart) load the file and
+skip parsing and compiling entirely:
+
+.. code:: python
+
+   ctx.init(toml_cfg, redis_client, cache_dir=pathlib.Path('/var/cache/botdetection'))
+
+The cache directory can also be set by the environment
+:py:obj:`ENV_CACHE_DIR`.  An artifact is keyed by a content hash (SHA-256) of
+the TOML files, the version of the botdetection and :py:obj:`CACHE_VERSION`:
+a change of a file creates a new artifact, the newest :py:obj:`MAX_ARTIFACTS`
+are kept in the directory.  The indexes of the IP lists are only compiled if
+NumPy is installed, they are loaded on first use by :py:obj:`.ip_arrays`.
+
+.. warning::
+
+   The artifacts are python pickles, the cache directory must only be
+   writable by the user of the service.
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Tuple
+
+import hashlib
+import importlib
+import os
+import pathlib
+import pickle
+import tempfile
+
+from .__pkginfo__ import VERSION
+from .config import Config
+from ._helpers import logger
+
+logger = logger.getChild('config_cache')
+
+CACHE_VERSION = 2
+"""Version of the artifacts, incremented when the content of an artifact
+changes."""
+
+ENV_CACHE_DIR = 'BOTDETECTION_CACHE_DIR'
+"""Name of the environment variable with the default cache directory."""
+
+MAX_ARTIFACTS = 8
+"""Maximum number of artifacts kept in the cache directory."""
+
+IP_LISTS = ('botdetection.ip_lists.pass_ip', 'botdetection.ip_lists.block_ip')
+"""The IP lists whose indexes are stored in an artifact."""
+
+_INDEXES: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+_INDEXES_BLOBS: List[bytes] = []
+
+
+def cache_key(schema_file: pathlib.Path, cfg_file: pathlib.Path | None, deprecated: dict) -> str:
+    """Returns the key of the artifact: a hash of the content of the files,
+    the ``deprecated`` names and the versions."""
+    h = hashlib.sha256(f"{VERSION}:{CACHE_VERSION}:{sorted(deprecated.items())}".encode())
+    for fname in (schema_file, cfg_file):
+        h.update(b'\0')
+        if fname is not None and fname.exists():
+            h.update(fname.read_bytes())
+    return h.hexdigest()
+
+
+def load_config(
+    schema_file: pathlib.Path, cfg_file: pathlib.Path | None, deprecated: dict, cache_dir: pathlib.Path
+) -> Tuple[Config, dict]:
+    """Returns the :py:obj:`.config.Config` from the artifact in the
+    ``cache_dir`` and the (validated) update of the ``cfg_file`` (see
+    :py:obj:`.config.Config.load_toml`).  If there is no artifact, the config
+    and the indexes are built and stored in a new artifact.  The indexes of all
+    loaded artifacts are kept (e.g. the configurations of multiple
+    :py:obj:`botdetection.Context`), the indexes are keyed by the content of
+    the IP lists."""
+
+    key = cache_key(schema_file, cfg_file, deprecated)
+    path = cache_dir / f"botdetection-{key}.pickle"
+    artifact = _load(path, key)
+    if artifact is None:
+        cfg = Config.from_toml(schema_file=schema_file, cfg_file=None, deprecated=deprecated)
+        # like Context.init without a cache: a missing cfg_file raises
+        upd_cfg = cfg.load_toml(cfg_file) if cfg_file is not None else {}
+        artifact = {'key': key, 'cfg': cfg, 'update': upd_cfg, 'indexes': compile_indexes(cfg)}
+        _store(path, artifact)
+    if artifact['indexes'] is not None:
+        _INDEXES_BLOBS.append(artifact['indexes'])
+    return artifact['cfg'], artifact['update']
+
+
+def compile_indexes(cfg: Config) -> bytes | None:
+    """Returns the pickled indexes of the :py:obj:`IP_LISTS` (``None`` if
+    NumPy is not installed)."""
+    try:
+        # ip_arrays requires NumPy and uses the indexes of this module
+        ip_arrays = importlib.import_module('.ip_arrays', __package__)
+    except ImportError:
+        return None
+    indexes = {}
+    for list_name in IP_LISTS:
+        nets = tuple(cfg.get(list_name, default=[]))
+        indexes[(list_name, nets)] = ip_arrays.compile_list(list_name, cfg)
+    return pickle.dumps(indexes, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def get_index(list_name: str, nets: Tuple[str, ...]):
+    """Returns the index (:py:obj:`.ip_arrays.IPRanges`) of the IP list
+    ``list_name`` from the artifact (``None`` if the index is not in the
+    artifact or the list has been changed)."""
+    while _INDEXES_BLOBS:
+        _INDEXES.update(pickle.loads(_INDEXES_BLOBS.pop()))
+    return _INDEXES.get((list_name, nets))
+
+
+def _load(path: pathlib.Path, key: str) -> dict | None:
+    try:
+        with path.open('rb') as f:
+            artifact = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.warning("can't load config artifact %s: %s", path, exc)
+        return None
+    if not isinstance(artifact, dict) or artifact.get('key') != key:
+        logger.warning("invalid config artifact %s", path)
+        return None
+    logger.debug("config loaded from artifact %s", path)
+    return artifact
+
+
+def _store(path: pathlib.Path, artifact: dict):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.botdetection-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError as exc:
+        logger.warning("can't store config artifact %s: %s", path, exc)
+        return
+    logger.debug("config stored in artifact %s", path)
+    _prune(path.parent)
+
+
+def _prune(cache_dir: pathlib.Path):
+    # the workers may prune concurrently, files can disappear
+    artifacts = []
+    for fname in cache_dir.glob('botdetection-*.pickle'):
+        try:
+            artifacts.append((fname.stat().st_mtime, fname))
+        except OSError:
+            continue
+    for _, fname in sorted(artifacts)[:-MAX_ARTIFACTS]:
+        try:
+            fname.unlink()
+        except OSError:
+            pass
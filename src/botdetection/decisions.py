@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.decisions:
+
+Decisions
+---------
+
+The methods record each request they have blocked in a ring buffer of a fixed
+size (per worker).  A record is written without any string formatting: the
+time, the (client) network, the method, a reason code and the id of the header
+fingerprint (:py:obj:`header_fingerprint`) of the request.  The records are
+only rendered on demand, e.g. by an admin page of the WEB application:
+
+.. code:: python
+
+   @app.route('/admin/botdetection')
+   def botdetection_decisions():
+       return flask.Response(decisions.render(100), mimetype='text/plain')
+
+.. code:: text
+
+   2026-10-19T09:12:01.518 192.0.2.0/24 ip_limit fp=5a1c09e2 too many request in BURST_WINDOW (BURST_MAX)
+   2026-10-19T09:12:01.733 198.51.100.7/32 http_accept fp=0b77e1f3 HTTP header Accept did not contain text/html
+
+The reasons are interned to codes (:py:obj:`reason_code`), the number of
+distinct reasons is limited by :py:obj:`MAX_REASONS`.  The records are not
+locked, a record read while it is written may be inconsistent.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.decisions]
+
+   # number of decisions in the ring buffer of a worker (0: no records)
+   size = 1024
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, TYPE_CHECKING
+
+import datetime
+import itertools
+import threading
+import time
+
+from . import ctx
+from ._helpers import NetworkKey
+
+if TYPE_CHECKING:
+    import flask
+
+MAX_REASONS = 1024
+"""Maximum number of distinct reasons, further reasons are recorded as
+``other``."""
+
+FINGERPRINT_HEADERS = ('User-Agent', 'Accept', 'Accept-Language', 'Accept-Encoding', 'Connection')
+"""HTTP headers of the header fingerprint (:py:obj:`header_fingerprint`)."""
+
+_FINGERPRINT_ENVIRON = tuple('HTTP_' + name.upper().replace('-', '_') for name in FINGERPRINT_HEADERS)
+
+_REASONS: List[str] = ['other']
+_CODES: Dict[str, int] = {'other': 0}
+_REASONS_LOCK = threading.Lock()
+
+
+class Decision(NamedTuple):
+    """A rendered record of the :py:obj:`DecisionLog`."""
+
+    time: float
+    """Time of the decision (seconds since the epoch)."""
+
+    network: str
+    """Name of the (client) network (:py:obj:`.NetworkKey.name`)."""
+
+    method: str
+    """Name of the method (e.g. ``ip_limit``)."""
+
+    reason: str
+    """Reason of the decision."""
+
+    fingerprint: int
+    """Id of the header fingerprint of the request (``0``: unknown)."""
+
+    def __str__(self):
+        ts = datetime.datetime.fromtimestamp(self.time).isoformat(timespec='milliseconds')
+        return f"{ts} {self.network} {self.method} fp={self.fingerprint:08x} {self.reason}"
+
+
+def reason_code(reason: str) -> int:
+    """Returns the code of the ``reason`` (the code of ``other`` if there are
+    already :py:obj:`MAX_REASONS` reasons)."""
+    code = _CODES.get(reason)
+    if code is None:
+        with _REASONS_LOCK:
+            code = _CODES.get(reason)
+            if code is None:
+                if len(_REASONS) >= MAX_REASONS:
+                    return 0
+                code = _CODES[reason] = len(_REASONS)
+                _REASONS.append(reason)
+    return code
+
+
+def header_fingerprint(request: flask.Request) -> int:
+    """Returns the id (32 bit) of the fingerprint of the request headers
+    :py:obj:`FINGERPRINT_HEADERS`.  The ids are only comparable within a
+    worker (the hash of a string is salted per process)."""
+    environ = getattr(request, 'environ', None)
+    if environ is not None:
+        # WSGI environment: faster than the lookups in request.headers
+        values = tuple(environ.get(name) for name in _FINGERPRINT_ENVIRON)
+    else:
+        values = tuple(request.headers.get(name) for name in FINGERPRINT_HEADERS)
+    return hash(values) & 0xFFFFFFFF
+
+
+class DecisionLog:
+    """A preallocated ring buffer of the last ``size`` decisions."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, size: int):
+        self.size = size
+        self._time = [0.0] * size
+        self._network = [''] * size
+        self._method = [''] * size
+        self._reason = [0] * size
+        self._fingerprint = [0] * size
+        self._count = itertools.count()
+        self._next = 0
+
+    def add(self, network: str, method: str, reason: int, fingerprint: int):
+        """Writes a record to the next slot of the ring (the oldest record is
+        overwritten)."""
+        n = next(self._count)
+        i = n % self.size
+        self._time[i] = time.time()
+        self._network[i] = network
+        self._method[i] = method
+        self._reason[i] = reason
+        self._fingerprint[i] = fingerprint
+        self._next = n + 1
+
+    def __len__(self):
+        return min(self._next, self.size)
+
+    def records(self, n: int | None = None) -> List[Decision]:
+        """Returns the last ``n`` (default: all) decisions, the oldest
+        first."""
+        end = self._next
+        count = min(end, self.size) if n is None else min(n, end, self.size)
+        decisions = []
+        for k in range(end - count, end):
+            i = k % self.size
+            decisions.append(
+                Decision(
+                    self._time[i],
+                    self._network[i],
+                    self._method[i],
+                    _REASONS[self._reason[i]],
+                    self._fingerprint[i],
+                )
+            )
+        return decisions
+
+
+def get_log() -> DecisionLog | None:
+    """Returns the :py:obj:`DecisionLog` of this worker in the current context
+    (``None`` if the size of the ring buffer is ``0``)."""
+    size = ctx.cfg.get('botdetection.decisions.size', default=0)
+    if not size:
+        return None
+    return ctx.state('decisions', lambda: DecisionLog(size))
+
+
+def record(network: NetworkKey, method: str, reason: str, request: flask.Request | None = None):
+    """Records the decision of the ``method`` to block a request from
+    ``network``, the ``reason`` should be a constant text (see
+    :py:obj:`reason_code`)."""
+    log = get_log()
+    if log is None:
+        return
+    log.add(network.name, method, reason_code(reason), header_fingerprint(request) if request is not None else 0)
+
+
+def recent(n: int | None = None) -> List[Decision]:
+    """Returns the last ``n`` (default: all) decisions of this worker, the
+    oldest first."""
+    log = get_log()
+    if log is None:
+        return []
+    return log.records(n)
+
+
+def render(n: int | None = None) -> str:
+    """Returns the last ``n`` (default: all) decisions of this worker as text,
+    one decision per line."""
+    return '\n'.join(str(d) for d in recent(n))
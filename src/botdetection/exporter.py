@@ -0,0 +1,316 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.exporter:
+
+Blocklist exporter
+------------------
+
+Blocking a request in Python is the most expensive place to block.  The
+exporter writes the networks which are currently blocked to files of the
+reverse proxy or the packet filter, so that repeat offenders are dropped before
+they reach the WEB application:
+
+``nginx-geo``
+  Include file of a nginx geo_ block (``<network> 1;``).
+
+``nginx-map``
+  Include file of a nginx map_ block on ``$remote_addr`` (``"<ip>" 1;``), a map
+  can only match addresses, networks with more than one address are not
+  exported to a map.
+
+``ipset``
+  Restore file of ipset_ (``ipset restore -f <file>``), the sets
+  ``<name>`` (IPv4) and ``<name>6`` (IPv6) are replaced atomically (swap).
+
+``nft``
+  Script of nftables_ (``nft -f <file>``), the sets ``<name>4`` and
+  ``<name>6`` of the table ``inet <table>`` are replaced.
+
+The networks are taken from the ``block_ip`` list of the :py:obj:`.ip_lists`
+method and from the networks blocked by the :py:obj:`.ip_limit` and
+:py:obj:`.ip_rotation` methods.  The blocked networks are recorded in a sorted
+set in the redis DB (:py:obj:`record_block`) as long as the window which has
+blocked the network is active.  The networks of the ``pass_ip`` list are never
+exported, they are cut out of the blocked networks (:py:obj:`subtract`).  The
+networks are collapsed before they are written (:py:obj:`collapse`).
+
+The files are written atomically (temporary file and rename in the same
+folder), a file is only replaced if its content has been changed.  The
+exporter runs once or periodically:
+
+.. code:: sh
+
+   $ python -m botdetection.exporter --config botdetection.toml \\
+         --redis-url unix:///run/redis/redis.sock \\
+         --format nginx-geo --output /etc/nginx/botdetection.geo \\
+         --interval 30 --on-change 'nginx -s reload'
+
+.. code:: nginx
+
+   geo $botdetection_block {
+       default 0;
+       include /etc/nginx/botdetection.geo;
+   }
+   if ($botdetection_block) {
+       return 429;
+   }
+
+.. attention::
+
+   The networks of the exporter are stored in the redis DB in plain text, the
+   ``secret_hash`` (see :ref:`botdetection.redislib <botdetection src>`) is not
+   applied.  The recording has to be activated in the config.
+
+.. _geo: https://nginx.org/en/docs/http/ngx_http_geo_module.html
+.. _map: https://nginx.org/en/docs/http/ngx_http_map_module.html
+.. _ipset: https://ipset.netfilter.org/ipset.man.html
+.. _nftables: https://wiki.nftables.org/
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.exporter]
+
+   # record the networks blocked by the ip_limit and ip_rotation methods (in
+   # plain text) in the redis DB
+   record_blocks = false
+
+   # maximum time (sec) a network is exported after it has been blocked
+   max_block_time = 3600
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Union
+
+import argparse
+import ipaddress
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+import redis
+
+from . import ctx
+from .redislib import key_prefix
+from ._helpers import logger, NetworkKey
+
+logger = logger.getChild('exporter')
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+RECORD_INTERVAL = 0.5
+"""A block of a network is recorded again, when half (``0.5``) of its recorded
+block time has been expired (reduces the writes of a repeat offender)."""
+
+_RECORDED_MAX = 65536
+
+
+def blocked_key() -> str:
+    """Returns the key of the sorted set with the recorded blocks."""
+    return key_prefix() + "exporter.blocked"
+
+
+def record_block(network: NetworkKey, duration: int):
+    """Records the block of a ``network`` for ``duration`` seconds (limited to
+    ``max_block_time``) in the redis DB, if ``record_blocks`` is activated."""
+
+    if not ctx.redis_client or not ctx.cfg.get('botdetection.exporter.record_blocks', default=False):
+        return
+    duration = min(duration, ctx.cfg['botdetection.exporter.max_block_time'])
+    now = time.time()
+    recorded: Dict[str, float] = ctx.state('exporter.recorded', dict)
+    until = recorded.get(network.name, 0)
+    if until - now > duration * RECORD_INTERVAL:
+        return
+    if len(recorded) >= _RECORDED_MAX:
+        recorded.clear()
+    recorded[network.name] = now + duration
+    ctx.redis_client.zadd(blocked_key(), {network.name: now + duration}, gt=True)
+
+
+def recorded_blocks(client) -> List[Network]:
+    """Returns the networks with an active block from the redis DB, expired
+    blocks are removed."""
+    now = time.time()
+    name = blocked_key()
+    pipe = client.pipeline(transaction=False)
+    pipe.zremrangebyscore(name, '-inf', now)
+    pipe.zrangebyscore(name, now, '+inf')
+    _, members = pipe.execute()
+    return list(_parse_networks((m.decode() if isinstance(m, bytes) else m for m in members), name))
+
+
+def _parse_networks(items: Iterable[str], source: str) -> Iterable[Network]:
+    for item in items:
+        try:
+            yield ipaddress.ip_network(item, strict=False)
+        except ValueError:
+            logger.error("invalid IP %s in %s", item, source)
+
+
+def blocked_networks(client) -> List[Network]:
+    """Returns the networks from the ``block_ip`` list and the networks with an
+    active block in the redis DB (if a ``client`` is given), without the
+    networks of the ``pass_ip`` list."""
+    networks = list(_parse_networks(ctx.cfg.get('botdetection.ip_lists.block_ip', default=[]), 'block_ip'))
+    if client:
+        networks.extend(recorded_blocks(client))
+    passed = list(_parse_networks(ctx.cfg.get('botdetection.ip_lists.pass_ip', default=[]), 'pass_ip'))
+    return subtract(networks, passed)
+
+
+def subtract(networks: Iterable[Network], excluded: List[Network]) -> List[Network]:
+    """Removes the ``excluded`` networks from the ``networks``: a network in an
+    excluded network is dropped, a network that contains an excluded network
+    is split into the networks around it."""
+    result = []
+    for net in networks:
+        parts = [net]
+        for exc in excluded:
+            if exc.version != net.version:
+                continue
+            remaining = []
+            for part in parts:
+                if part.subnet_of(exc):  # type: ignore
+                    continue
+                if exc.subnet_of(part):  # type: ignore
+                    remaining.extend(part.address_exclude(exc))  # type: ignore
+                else:
+                    remaining.append(part)
+            parts = remaining
+        result.extend(parts)
+    return result
+
+
+def collapse(networks: Iterable[Network]) -> List[Network]:
+    """Collapses the (overlapping and adjacent) ``networks``, IPv4 networks
+    first."""
+    v4 = [n for n in networks if n.version == 4]
+    v6 = [n for n in networks if n.version == 6]
+    return list(ipaddress.collapse_addresses(v4)) + list(ipaddress.collapse_addresses(v6))
+
+
+HEADER = "# blocked networks, generated by botdetection.exporter -- do not edit\n"
+
+
+def nginx_geo(networks: List[Network], name: str) -> str:
+    """Content of a nginx geo include file."""
+    # pylint: disable=unused-argument
+    return HEADER + "".join(f"{n.compressed} 1;\n" for n in networks)
+
+
+def nginx_map(networks: List[Network], name: str) -> str:
+    """Content of a nginx map include file (addresses only)."""
+    # pylint: disable=unused-argument
+    return HEADER + "".join(f'"{n.network_address.compressed}" 1;\n' for n in networks if n.num_addresses == 1)
+
+
+def ipset(networks: List[Network], name: str) -> str:
+    """Content of an ipset restore file."""
+    lines = [HEADER]
+    for suffix, family, version in (('', 'inet', 4), ('6', 'inet6', 6)):
+        set_name = name + suffix
+        lines.append(f"create {set_name} hash:net family {family} -exist\n")
+        lines.append(f"create {set_name}-tmp hash:net family {family} -exist\n")
+        lines.append(f"flush {set_name}-tmp\n")
+        lines.extend(f"add {set_name}-tmp {n.compressed}\n" for n in networks if n.version == version)
+        lines.append(f"swap {set_name}-tmp {set_name}\n")
+        lines.append(f"destroy {set_name}-tmp\n")
+    return "".join(lines)
+
+
+def nft(networks: List[Network], name: str, table: str = 'botdetection') -> str:
+    """Content of a nftables script."""
+    lines = [HEADER, f"table inet {table} {{\n"]
+    lines.extend(f"    set {name}{v} {{ type ipv{v}_addr; flags interval; }}\n" for v in (4, 6))
+    lines.append("}\n")
+    for v in (4, 6):
+        lines.append(f"flush set inet {table} {name}{v}\n")
+        elements = ", ".join(n.compressed for n in networks if n.version == v)
+        if elements:
+            lines.append(f"add element inet {table} {name}{v} {{ {elements} }}\n")
+    return "".join(lines)
+
+
+FORMATS: Dict[str, Callable[[List[Network], str], str]] = {
+    'nginx-geo': nginx_geo,
+    'nginx-map': nginx_map,
+    'ipset': ipset,
+    'nft': nft,
+}
+"""Output formats of the exporter."""
+
+
+def write_atomic(path: pathlib.Path, content: str) -> bool:
+    """Writes the ``content`` atomically to ``path`` (temporary file in the same
+    folder and rename), the file is not touched if the content has not been
+    changed.  Returns ``True`` if the file has been written."""
+
+    try:
+        if path.read_text(encoding='utf-8') == content:
+            return False
+    except FileNotFoundError:
+        pass
+
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+def export(client, fmt: str, output: pathlib.Path, name: str = 'botdetection') -> bool:
+    """Writes the blocked networks in the format ``fmt`` (see
+    :py:obj:`FORMATS`) to the file ``output``.  Returns ``True`` if the file
+    has been changed."""
+    networks = collapse(blocked_networks(client))
+    changed = write_atomic(output, FORMATS[fmt](networks, name))
+    logger.debug("export %s networks to %s (changed: %s)", len(networks), output, changed)
+    return changed
+
+
+def main(argv=None):
+    """Command line of the exporter, exports once or every ``--interval``
+    seconds."""
+    parser = argparse.ArgumentParser(prog='python -m botdetection.exporter', description="Export blocked networks")
+    parser.add_argument('--config', type=pathlib.Path, default=None, help="botdetection TOML config")
+    parser.add_argument('--redis-url', default=None, help="URL of the redis DB (default: block_ip list only)")
+    parser.add_argument('--format', choices=list(FORMATS), default='nginx-geo', help="output format")
+    parser.add_argument('--output', type=pathlib.Path, required=True, help="output file")
+    parser.add_argument('--name', default='botdetection', help="name of the ipset / nft sets")
+    parser.add_argument('--interval', type=int, default=0, help="export every INTERVAL sec (default: once)")
+    parser.add_argument('--on-change', default=None, help="shell command to run when the file has been changed")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    client = redis.Redis.from_url(args.redis_url) if args.redis_url else None
+    if args.config is not None:
+        ctx.init(args.config, client)
+    ctx.redis_client = client
+
+    while True:
+        if export(client, args.format, args.output, args.name) and args.on_change:
+            subprocess.run(args.on_change, shell=True, check=False)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
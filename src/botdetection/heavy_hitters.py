@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.heavy_hitters:
+
+Heavy hitters
+-------------
+
+The ``heavy_hitters`` module tracks the (client) networks with the most
+requests and the most blocked requests in real time, without scanning the keys
+in the redis DB.  Each worker counts the requests in a :py:obj:`.CountMinSketch`
+and keeps the networks with the highest counts in a :py:obj:`.TopK` structure,
+both with a fixed size.  In an interval of ``flush_interval`` seconds a
+background thread of the worker (:py:obj:`Flusher`) merges the local top-K
+counts into the redis DB (sorted sets) and resets the local counts, a request
+is only counted in the local sketches.  The heavy hitters are not tracked
+unless ``enabled`` is set.
+
+The :py:obj:`.ip_limit` method feeds the network and the verdict of each
+request by calling :py:obj:`record` (see :py:func:`.ip_limit.evaluate`):
+
+.. code:: python
+
+   verdict = _evaluate(network, request, cfg)
+   heavy_hitters.record(network, verdict.blocked)
+
+The current top-N networks (merged from all workers) are queried by
+:py:obj:`top`:
+
+.. code:: python
+
+   >>> heavy_hitters.top(5, kind='blocks')
+   [('192.0.2.17/32', 1730.0, 5.7), ...]
+
+If a ``secret_hash`` is configured (see :ref:`botdetection.redislib
+<botdetection src>`), the names of the networks are anonymized in the redis DB.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.heavy_hitters]
+
+   # track the networks with the most requests and blocks
+   enabled = false
+
+   # Width (counters per row) and depth (rows) of the Count-Min Sketch
+   cms_width = 2048
+   cms_depth = 4
+
+   # Number of networks tracked in the local top-K
+   top_k = 64
+
+   # Interval (sec) in which the local counts are merged into the redis DB
+   flush_interval = 10
+
+   # Time window (sec) of the top-N lists in the redis DB
+   window = 300
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import List, Tuple
+
+import threading
+import time
+
+from . import ctx
+from .redislib import secret_hash, key_prefix
+from ._helpers import logger, NetworkKey
+from .sketches import CountMinSketch, TopK
+
+logger = logger.getChild('heavy_hitters')
+
+KINDS = ('requests', 'blocks')
+"""Kinds of the counts: all requests and blocked requests."""
+
+
+class HeavyHitters:
+    """Per worker counts of requests and blocked requests by (client) network,
+    the memory is bounded by the size of the sketches and the top-K."""
+
+    def __init__(self, cms_width: int, cms_depth: int, top_k: int, flush_interval: int, window: int):
+        self.flush_interval = flush_interval
+        self.window = window
+        self.sketches = {kind: CountMinSketch(cms_width, cms_depth) for kind in KINDS}
+        self.top_k = {kind: TopK(top_k) for kind in KINDS}
+        self._lock = threading.Lock()
+
+    def record(self, network: NetworkKey, blocked: bool):
+        """Counts a request from ``network`` in the local sketches."""
+        with self._lock:
+            for kind in ('requests', 'blocks') if blocked else ('requests',):
+                self.top_k[kind].offer(network.name, self.sketches[kind].add(network.name))
+
+    def flush(self, client):
+        """Merges the local counts into the sorted sets of the current time
+        window and resets the local counts."""
+        with self._lock:
+            items = {kind: self.top_k[kind].items() for kind in KINDS}
+            for kind in KINDS:
+                self.sketches[kind].clear()
+                self.top_k[kind].clear()
+        bucket = int(time.time() // self.window)
+        pipe = client.pipeline(transaction=False)
+        for kind, counts in items.items():
+            name = _zset_name(kind, bucket)
+            for key, count in counts:
+                pipe.zincrby(name, count, secret_hash(key))
+            pipe.expire(name, 2 * self.window)
+        pipe.execute()
+
+
+class Flusher(threading.Thread):
+    """Background thread which merges the counts of the ``heavy_hitters`` into
+    the redis DB every ``flush_interval`` seconds."""
+
+    def __init__(self, client, heavy_hitters: HeavyHitters):
+        super().__init__(name='botdetection.heavy_hitters', daemon=True)
+        self.client = client
+        self.heavy_hitters = heavy_hitters
+        self._stop_event = threading.Event()
+
+    def run(self):
+        import redis  # pylint: disable=import-outside-toplevel
+
+        # the interval is at least one second
+        while not self._stop_event.wait(max(1, self.heavy_hitters.flush_interval)):
+            try:
+                self.heavy_hitters.flush(self.client)
+            except redis.RedisError as exc:
+                logger.warning("can't merge the heavy hitters into the redis DB (%s)", exc)
+
+    def stop(self):
+        """Stops the thread (the counts since the last flush are not merged)."""
+        self._stop_event.set()
+
+
+def _zset_name(kind: str, bucket: int) -> str:
+    return f"{key_prefix()}heavy_hitters.{kind}:{bucket}"
+
+
+def _cfg(name):
+    return ctx.cfg.get(f'botdetection.heavy_hitters.{name}')
+
+
+def _start() -> Tuple[HeavyHitters, Flusher | None]:
+    heavy_hitters = HeavyHitters(
+        cms_width=_cfg('cms_width'),
+        cms_depth=_cfg('cms_depth'),
+        top_k=_cfg('top_k'),
+        flush_interval=_cfg('flush_interval'),
+        window=_cfg('window'),
+    )
+    flusher = None
+    if ctx.redis_client:
+        flusher = Flusher(ctx.redis_client, heavy_hitters)
+        flusher.start()
+    return heavy_hitters, flusher
+
+
+def get_heavy_hitters() -> HeavyHitters | None:
+    """Returns the :py:obj:`HeavyHitters` of this worker in the current context
+    (``None`` if the heavy hitters are not enabled), initialized from the
+    configuration on first use.  The :py:obj:`Flusher` is started on first use
+    (after a fork of the worker processes a new flusher is started)."""
+
+    if not _cfg('enabled'):
+        return None
+    return ctx.worker_state('heavy_hitters', _start)[0]
+
+
+def record(network: NetworkKey, blocked: bool = False):
+    """Counts a request from ``network``, ``blocked`` is the verdict of the
+    limiter."""
+    heavy_hitters = get_heavy_hitters()
+    if heavy_hitters is not None:
+        heavy_hitters.record(network, blocked)
+
+
+def top(n: int = 10, kind: str = 'requests') -> List[Tuple[str, float, float]]:
+    """Returns the top-``n`` networks by ``kind`` (``requests`` or ``blocks``)
+    merged from all workers.  The items of the list are ``(network, count,
+    rate)`` where *rate* is the count per second in the current and previous
+    time window."""
+
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    if not ctx.redis_client:
+        return []
+
+    window = _cfg('window')
+    now = time.time()
+    bucket = int(now // window)
+    elapsed = window + now % window
+    items = ctx.redis_client.zunion([_zset_name(kind, bucket - 1), _zset_name(kind, bucket)], withscores=True)
+    items = sorted(items, key=lambda x: x[1], reverse=True)[:n]
+    # the names are str if the client decodes the responses
+    return [
+        (name.decode() if isinstance(name, bytes) else name, count, count / elapsed) for name, count in items
+    ]
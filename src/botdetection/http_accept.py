@@ -16,24 +16,20 @@ Accept_ header ..
 # pylint: disable=unused-argument
 
 from __future__ import annotations
-from ipaddress import (
-    IPv4Network,
-    IPv6Network,
-)
 
 import flask
 import werkzeug
 
 from . import config
-from ._helpers import too_many_requests
+from ._helpers import too_many_requests, NetworkKey
 
 
 def filter_request(
-    network: IPv4Network | IPv6Network,
+    network: NetworkKey,
     request: flask.Request,
     cfg: config.Config,
 ) -> werkzeug.Response | None:
 
     if 'text/html' not in request.accept_mimetypes:
-        return too_many_requests(network, "HTTP header Accept did not contain text/html")
+        return too_many_requests(network, "HTTP header Accept did not contain text/html", 'http_accept', request)
     return None
@@ -17,25 +17,23 @@ bot if the Accept-Encoding_ header ..
 # pylint: disable=unused-argument
 
 from __future__ import annotations
-from ipaddress import (
-    IPv4Network,
-    IPv6Network,
-)
 
 import flask
 import werkzeug
 
 from . import config
-from ._helpers import too_many_requests
+from ._helpers import too_many_requests, NetworkKey
 
 
 def filter_request(
-    network: IPv4Network | IPv6Network,
+    network: NetworkKey,
     request: flask.Request,
     cfg: config.Config,
 ) -> werkzeug.Response | None:
 
     accept_list = [l.strip() for l in request.headers.get('Accept-Encoding', '').split(',')]
     if not ('gzip' in accept_list or 'deflate' in accept_list):
-        return too_many_requests(network, "HTTP header Accept-Encoding did not contain gzip nor deflate")
+        return too_many_requests(
+            network, "HTTP header Accept-Encoding did not contain gzip nor deflate", 'http_accept_encoding', request
+        )
     return None
@@ -13,23 +13,19 @@ if the Accept-Language_ header is unset.
 """
 # pylint: disable=unused-argument
 from __future__ import annotations
-from ipaddress import (
-    IPv4Network,
-    IPv6Network,
-)
 
 import flask
 import werkzeug
 
 from . import config
-from ._helpers import too_many_requests
+from ._helpers import too_many_requests, NetworkKey
 
 
 def filter_request(
-    network: IPv4Network | IPv6Network,
+    network: NetworkKey,
     request: flask.Request,
     cfg: config.Config,
 ) -> werkzeug.Response | None:
     if request.headers.get('Accept-Language', '').strip() == '':
-        return too_many_requests(network, "missing HTTP header Accept-Language")
+        return too_many_requests(network, "missing HTTP header Accept-Language", 'http_accept_language', request)
     return None
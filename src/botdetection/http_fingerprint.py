@@ -0,0 +1,269 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.http_fingerprint:
+
+Method ``http_fingerprint``
+---------------------------
+
+The ``http_fingerprint`` method intercepts distributed bots: a botnet sends
+the same combination of HTTP headers (the *fingerprint*, see
+:py:obj:`fingerprint`) from thousands of IPs and each IP stays below the
+limits of the :py:obj:`.ip_limit` method.
+
+Each worker counts the requests per fingerprint in a :py:obj:`.CountMinSketch`
+and keeps the fingerprints with the most requests in a :py:obj:`.TopK`, the
+(client) networks of these fingerprints are collected in small sets.  In an
+interval of ``flush_interval`` seconds the local counts are merged into the
+redis DB: the requests per fingerprint in a sorted set and the networks in a
+HyperLogLog per fingerprint (see :py:func:`.redislib.incr_distinct`), both in
+buckets of ``window`` seconds.
+
+A fingerprint *spikes* if in the current bucket it has at least
+``requests_min`` requests from at least ``distinct_min`` networks and its
+request rate is ``spike_ratio`` times the rate in the previous bucket (the
+steady fingerprints of common browsers do not spike).  On a cold start (the
+fingerprints have not been counted in a full bucket), no fingerprint spikes.
+A spiking fingerprint is announced to all workers by the redis DB
+(:py:obj:`spikes`) for one ``window``: all requests with this fingerprint are
+counted in one sliding window and a maximum of ``burst_max`` requests in
+``burst_window`` is allowed (from all networks together).
+
+A request costs a hash of the headers and an update of the local sketches,
+only the requests with a spiking fingerprint need a roundtrip to the redis DB.
+
+.. note::
+
+   This method requires a redis DB.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.http_fingerprint]
+
+   # time (sec) of the buckets in which the requests and the distinct networks
+   # of a fingerprint are counted
+   window = 600
+
+   # a fingerprint spikes if in the current bucket it has at least
+   # requests_min requests from at least distinct_min networks and the rate is
+   # spike_ratio times the rate of the previous bucket
+   requests_min = 1000
+   distinct_min = 50
+   spike_ratio = 4.0
+
+   # limit of a spiking fingerprint: maximum requests from all networks in the
+   # burst_window (sec)
+   burst_window = 20
+   burst_max = 200
+
+   # local sketches of a worker: width and depth of the Count-Min Sketch,
+   # number of tracked fingerprints, max. networks collected per fingerprint
+   # and interval (sec) in which the counts are merged into the redis DB
+   cms_width = 2048
+   cms_depth = 4
+   top_k = 64
+   networks_max = 256
+   flush_interval = 10
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, List, Set, Tuple
+
+import hashlib
+import threading
+import time
+
+import flask
+import werkzeug
+
+from . import ctx
+from . import config
+from .redislib import incr_sliding_window, distinct_keys, key_prefix
+from .sketches import CountMinSketch, TopK
+from ._helpers import too_many_requests, logger, NetworkKey
+
+logger = logger.getChild('http_fingerprint')
+
+HEADERS = ('User-Agent', 'Accept-Language', 'Accept', 'Accept-Encoding')
+"""HTTP headers of the fingerprint."""
+
+_ENVIRON = tuple('HTTP_' + name.upper().replace('-', '_') for name in HEADERS)
+
+
+def fingerprint(request: flask.Request) -> str:
+    """Returns the fingerprint of the :py:obj:`HEADERS` of a request, a hash
+    that is identical in all workers."""
+    environ = getattr(request, 'environ', None)
+    if environ is not None:
+        values = [environ.get(name, '') for name in _ENVIRON]
+    else:
+        values = [request.headers.get(name, '') for name in HEADERS]
+    return hashlib.blake2b('\n'.join(values).encode(), digest_size=8).hexdigest()
+
+
+class Fingerprints:
+    """Per worker counts of the requests and the networks by fingerprint, the
+    memory is bounded by the size of the sketches."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, cms_width: int, cms_depth: int, top_k: int, networks_max: int, flush_interval: int):
+        self.sketch = CountMinSketch(cms_width, cms_depth)
+        self.top_k = TopK(top_k)
+        self.networks_max = networks_max
+        self.flush_interval = flush_interval
+        self.networks: Dict[str, Set[str]] = {}
+        self.spiking: Set[str] = set()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, fp: str, network: NetworkKey) -> bool:
+        """Counts a request with the fingerprint ``fp`` from ``network``,
+        returns ``True`` if the fingerprint spikes.  The counts are merged into
+        the redis DB when the ``flush_interval`` has been expired."""
+        with self._lock:
+            self.top_k.offer(fp, self.sketch.add(fp))
+            if fp in self.top_k.counts:
+                nets = self.networks.get(fp)
+                if nets is None:
+                    if len(self.networks) >= 2 * self.top_k.k:
+                        self.networks = {k: v for k, v in self.networks.items() if k in self.top_k.counts}
+                    nets = self.networks[fp] = set()
+                if len(nets) < self.networks_max:
+                    nets.add(network.key)
+            spiking = fp in self.spiking
+            if time.monotonic() - self._last_flush < self.flush_interval:
+                return spiking
+            self._last_flush = time.monotonic()
+            items = self.top_k.items()
+            networks = self.networks
+            self.networks = {}
+            self.sketch.clear()
+            self.top_k.clear()
+        if ctx.redis_client:
+            self.flush(ctx.redis_client, items, networks)
+        return spiking
+
+    def flush(self, client, items: List[Tuple[str, int]], networks: Dict[str, Set[str]]):
+        """Merges the counts of the ``items`` and the ``networks`` into the
+        redis DB, evaluates the spikes of the fingerprints and loads the
+        spiking fingerprints of all workers."""
+
+        # pylint: disable=too-many-locals
+        cfg = ctx.cfg['botdetection.http_fingerprint']
+        window = cfg['window']
+        now = time.time()
+        bucket = int(now // window)
+        requests_key = _requests_key(bucket)
+        pipe = client.pipeline(transaction=False)
+        for fp, count in items:
+            keys = distinct_keys('http_fingerprint.' + fp, window)
+            nets = networks.get(fp)
+            if nets:
+                pipe.pfadd(keys[0], *nets)
+                pipe.expire(keys[0], 2 * window)
+            pipe.zincrby(requests_key, count, fp)
+            pipe.zscore(_requests_key(bucket - 1), fp)
+            pipe.pfcount(*keys)
+        pipe.expire(requests_key, 2 * window)
+        # a fingerprint can't spike before the fingerprints have been counted
+        # in a full bucket (cold start)
+        pipe.set(_since_key(), now, nx=True)
+        pipe.get(_since_key())
+        results = pipe.execute()
+        warm = now - float(results[-1]) >= window
+        results = iter(results)
+
+        elapsed = max(now - bucket * window, self.flush_interval)
+        new_spikes = {}
+        for fp, _ in items:
+            if networks.get(fp):
+                next(results)  # PFADD
+                next(results)  # EXPIRE
+            current, previous, distinct = next(results), next(results), next(results)
+            current, previous = float(current), float(previous or 0)
+            if not warm or current < cfg['requests_min'] or distinct < cfg['distinct_min']:
+                continue
+            if current / elapsed > cfg['spike_ratio'] * previous / window:
+                if fp not in self.spiking:
+                    logger.warning("fingerprint %s spikes: %d requests from %d networks", fp, current, distinct)
+                new_spikes[fp] = now + window
+
+        spikes_key = _spikes_key()
+        pipe = client.pipeline(transaction=False)
+        if new_spikes:
+            pipe.zadd(spikes_key, new_spikes, gt=True)
+            pipe.expire(spikes_key, window)
+        pipe.zremrangebyscore(spikes_key, '-inf', now)
+        pipe.zrangebyscore(spikes_key, now, '+inf')
+        spiking = {fp.decode() if isinstance(fp, bytes) else fp for fp in pipe.execute()[-1]}
+        with self._lock:
+            self.spiking = spiking
+
+
+def _requests_key(bucket: int) -> str:
+    return f"{key_prefix()}http_fingerprint.requests:{bucket}"
+
+
+def _spikes_key() -> str:
+    return f"{key_prefix()}http_fingerprint.spikes"
+
+
+def _since_key() -> str:
+    return f"{key_prefix()}http_fingerprint.since"
+
+
+def _cfg(name):
+    return ctx.cfg.get(f'botdetection.http_fingerprint.{name}')
+
+
+def get_fingerprints() -> Fingerprints:
+    """Returns the :py:obj:`Fingerprints` of this worker, initialized from the
+    configuration on first use (one per context)."""
+    return ctx.state(
+        'http_fingerprint',
+        lambda: Fingerprints(
+            cms_width=_cfg('cms_width'),
+            cms_depth=_cfg('cms_depth'),
+            top_k=_cfg('top_k'),
+            networks_max=_cfg('networks_max'),
+            flush_interval=_cfg('flush_interval'),
+        ),
+    )
+
+
+def spikes() -> List[str]:
+    """Returns the spiking fingerprints of all workers (from the last flush of
+    this worker)."""
+    return sorted(get_fingerprints().spiking)
+
+
+def filter_request(
+    network: NetworkKey,
+    request: flask.Request,
+    cfg: config.Config,
+) -> werkzeug.Response | None:
+    """Blocks the request if its fingerprint spikes and exceeds the burst window."""
+
+    if not ctx.redis_client:
+        return None
+    if network.is_link_local and not cfg['botdetection.ip_limit.filter_link_local']:
+        return None
+
+    fp = fingerprint(request)
+    if not get_fingerprints().record(fp, network):
+        return None
+
+    c = incr_sliding_window(
+        ctx.redis_client, 'http_fingerprint.BURST_WINDOW' + fp, cfg['botdetection.http_fingerprint.burst_window']
+    )
+    if c > cfg['botdetection.http_fingerprint.burst_max']:
+        return too_many_requests(
+            network, "too many request with a spiking header fingerprint", 'http_fingerprint', request, detail=f" {fp}"
+        )
+    return None
@@ -16,16 +16,12 @@ the User-Agent_ header is unset or matches the regular expression
 
 from __future__ import annotations
 import re
-from ipaddress import (
-    IPv4Network,
-    IPv6Network,
-)
 
 import flask
 import werkzeug
 
 from . import config
-from ._helpers import too_many_requests
+from ._helpers import too_many_requests, NetworkKey
 
 
 USER_AGENT = (
@@ -56,12 +52,14 @@ def regexp_user_agent():
 
 
 def filter_request(
-    network: IPv4Network | IPv6Network,
+    network: NetworkKey,
     request: flask.Request,
     cfg: config.Config,
 ) -> werkzeug.Response | None:
 
     user_agent = request.headers.get('User-Agent', 'unknown')
     if regexp_user_agent().match(user_agent):
-        return too_many_requests(network, f"bot detected, HTTP header User-Agent: {user_agent}")
+        return too_many_requests(
+            network, "bot detected, HTTP header User-Agent", 'http_user_agent', request, detail=f": {user_agent}"
+        )
     return None
@@ -0,0 +1,249 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.ip_arrays:
+
+Batch classification of IP arrays
+---------------------------------
+
+The functions :py:obj:`pass_ip`, :py:obj:`block_ip` and :py:obj:`get_network`
+are the vectorized counterparts of :py:obj:`.ip_lists.pass_ip`,
+:py:obj:`.ip_lists.block_ip` and :py:obj:`.get_network`.  They classify NumPy_
+arrays of IPs at once (e.g. for offline analysis of logs or to generate a
+pre-filter for the edge) and return boolean masks and network IDs.
+
+.. note::
+
+   This module requires NumPy_ (``pip install botdetection[numpy]``).
+
+The addresses are passed as arrays of integers:
+
+- IPv4: array of ``uint32`` with shape ``(n,)``
+- IPv6: array of ``uint64`` with shape ``(n, 2)``, the high and the low 64 bits
+  of the address (*uint128-pair*)
+
+.. code:: python
+
+   >>> addrs = ip_arrays.v4_array(['93.184.216.34', '10.1.2.3'])
+   >>> ip_arrays.block_ip(addrs, ctx.cfg)
+   array([ True, False])
+
+The networks of a IP list are compiled once into sorted arrays of merged
+(non-overlapping) ranges, a lookup of the IPs is a :py:obj:`numpy.searchsorted`
+over the start addresses of the ranges.  With the :ref:`delta updates
+<botdetection.ip_deltas>` the indexes are compiled from the
+:py:obj:`.ip_lists.IPListIndex` (see :py:obj:`get_index`).
+
+.. _NumPy: https://numpy.org
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Tuple
+from functools import lru_cache
+from ipaddress import ip_address
+
+import numpy as np
+
+from . import ctx
+from . import config
+from . import config_cache
+from . import ip_lists
+from ._helpers import logger
+
+logger = logger.getChild('ip_arrays')
+
+_MASK64 = (1 << 64) - 1
+
+
+class IPRanges:
+    """Sorted and merged ranges of the networks in a IP list, the IPv4 ranges
+    are stored in ``uint64`` arrays, the IPv6 ranges in arrays of 16 bytes
+    (big-endian) which sort like the 128 bit integers."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, v4: List[Tuple[int, int]], v6: List[Tuple[int, int]]):
+        self.v4_start, self.v4_end = _arrays(4, v4)
+        self.v6_start, self.v6_end = _arrays(6, v6)
+
+    @classmethod
+    def concatenate(cls, v4: List[Tuple[np.ndarray, np.ndarray]], v6: List[Tuple[np.ndarray, np.ndarray]]) -> IPRanges:
+        """Returns the ranges of the sorted parts ``v4`` and ``v6``, a part is
+        a tuple of the start and the end addresses (see :py:obj:`_arrays`).
+        The ranges of the parts must not overlap and the parts must be in the
+        order of their addresses."""
+        ranges = cls([], [])
+        if v4:
+            ranges.v4_start = np.concatenate([part[0] for part in v4])
+            ranges.v4_end = np.concatenate([part[1] for part in v4])
+        if v6:
+            ranges.v6_start = np.concatenate([part[0] for part in v6])
+            ranges.v6_end = np.concatenate([part[1] for part in v6])
+        return ranges
+
+    def contains(self, addrs: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of the ``addrs`` (IPv4 or IPv6 array) that
+        are in one of the ranges."""
+        if _is_v6(addrs):
+            return _lookup(self.v6_start, self.v6_end, _v6_keys(addrs))
+        return _lookup(self.v4_start, self.v4_end, addrs.astype(np.uint64))
+
+
+def _is_v6(addrs: np.ndarray) -> bool:
+    return addrs.ndim == 2
+
+
+def _arrays(version: int, ranges: Iterable[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    # the start and the end addresses of the merged ranges
+    merged = _merge(ranges)
+    if version == 4:
+        return (
+            np.array([r[0] for r in merged], dtype=np.uint64),
+            np.array([r[1] for r in merged], dtype=np.uint64),
+        )
+    return (
+        _v6_keys(np.array([[r[0] >> 64, r[0] & _MASK64] for r in merged], dtype=np.uint64).reshape(-1, 2)),
+        _v6_keys(np.array([[r[1] >> 64, r[1] & _MASK64] for r in merged], dtype=np.uint64).reshape(-1, 2)),
+    )
+
+
+def _merge(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _v6_keys(addrs: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(addrs, dtype='>u8').view('S16').ravel()
+
+
+def _lookup(starts: np.ndarray, ends: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    if not len(starts):  # pylint: disable=use-implicit-booleaness-not-len
+        return np.zeros(len(keys), dtype=bool)
+    idx = np.searchsorted(starts, keys, side='right') - 1
+    found = idx >= 0
+    idx[~found] = 0
+    return found & (keys <= ends[idx])
+
+
+@lru_cache(maxsize=16)
+def _compile(list_name: str, nets: Tuple[str, ...]) -> IPRanges:
+    v4, v6 = [], []
+    for version, start, end in ip_lists.network_ranges(list_name, nets):
+        (v6 if version == 6 else v4).append((start, end))
+    return IPRanges(v4, v6)
+
+
+def compile_list(list_name: str, cfg: config.Config) -> IPRanges:
+    """Returns the compiled :py:obj:`IPRanges` of the IP list ``list_name``.
+    The ranges are cached as long as the list in the configuration is
+    unchanged (and loaded from the :ref:`config cache
+    <botdetection.config_cache>`)."""
+    nets = tuple(cfg.get(list_name, default=[]))
+    ranges = config_cache.get_index(list_name, nets)
+    if ranges is None:
+        ranges = _compile(list_name, nets)
+    return ranges
+
+
+class CompiledIndex:
+    """The compiled ranges of a :py:obj:`.ip_lists.IPListIndex`.  The ranges of
+    each subtree are compiled separately, the compiled index of a new version
+    of the :py:obj:`.ip_lists.IPListIndex` only compiles the subtrees changed
+    by the deltas and shares the other subtrees with the ``previous`` compiled
+    index (copy-on-write)."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, index: ip_lists.IPListIndex, previous: CompiledIndex | None = None):
+        self.index = index
+        self._parts: Dict[ip_lists.Subtree, Tuple[tuple, Tuple[np.ndarray, np.ndarray]]] = {}
+        prev_parts = previous._parts if previous is not None else {}  # pylint: disable=protected-access
+        for key, members in index.subtrees.items():
+            part = prev_parts.get(key)
+            if part is None or part[0] is not members:
+                part = (members, _arrays(key[0], members))
+            self._parts[key] = part
+        keys = sorted(self._parts)
+        self._ranges = IPRanges.concatenate(
+            [self._parts[key][1] for key in keys if key[0] == 4], [self._parts[key][1] for key in keys if key[0] == 6]
+        )
+        if previous is not None and previous.index.large is index.large:
+            self._large = previous._large  # pylint: disable=protected-access
+        else:
+            self._large = IPRanges(
+                [rng[1:] for rng in index.large if rng[0] == 4], [rng[1:] for rng in index.large if rng[0] == 6]
+            )
+
+    def contains(self, addrs: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of the ``addrs`` (IPv4 or IPv6 array) that
+        are in one of the networks of the list."""
+        mask = self._ranges.contains(addrs)
+        if self.index.large:
+            mask |= self._large.contains(addrs)
+        return mask
+
+
+def get_index(list_name: str, cfg: config.Config) -> IPRanges | CompiledIndex:
+    """Returns the index of the IP list ``list_name``.  If the :ref:`delta
+    updates <botdetection.ip_deltas>` are enabled, the index is the
+    :py:obj:`CompiledIndex` of the :py:obj:`.ip_lists.get_index` (with the
+    deltas of the log applied), otherwise the compiled list
+    (:py:obj:`compile_list`)."""
+    if not ctx.redis_client or not cfg.get('botdetection.ip_deltas.enabled', default=False):
+        return compile_list(list_name, cfg)
+    index = ip_lists.get_index(list_name, cfg)
+    compiled: Dict[str, CompiledIndex] = ctx.state('ip_arrays.indexes', dict)
+    current = compiled.get(list_name)
+    if current is None or current.index is not index:
+        current = compiled[list_name] = CompiledIndex(index, current)
+    return current
+
+
+def pass_ip(addrs: np.ndarray, cfg: config.Config) -> np.ndarray:
+    """Boolean mask of the ``addrs`` which are a member of an item in the
+    ``botdetection.ip_lists.pass_ip`` list."""
+    return get_index('botdetection.ip_lists.pass_ip', cfg).contains(addrs)
+
+
+def block_ip(addrs: np.ndarray, cfg: config.Config) -> np.ndarray:
+    """Boolean mask of the ``addrs`` which are a member of an item in the
+    ``botdetection.ip_lists.block_ip`` list."""
+    return get_index('botdetection.ip_lists.block_ip', cfg).contains(addrs)
+
+
+def get_network(addrs: np.ndarray, cfg: config.Config) -> np.ndarray:
+    """Returns the IDs of the (client) networks of the ``addrs``.  The ID of a
+    network is its (masked) network address, the prefix is taken from
+    ``real_ip.ipv4_prefix`` / ``real_ip.ipv6_prefix`` (see
+    :py:obj:`.get_network`)."""
+
+    if not _is_v6(addrs):
+        prefix = cfg['real_ip.ipv4_prefix']
+        mask = ((1 << 32) - 1) ^ ((1 << (32 - prefix)) - 1)
+        return addrs & np.uint32(mask)
+
+    prefix = cfg['real_ip.ipv6_prefix']
+    hi_bits, lo_bits = min(prefix, 64), max(prefix - 64, 0)
+    mask = np.array(
+        [_MASK64 ^ ((1 << (64 - hi_bits)) - 1), _MASK64 ^ ((1 << (64 - lo_bits)) - 1)],
+        dtype=np.uint64,
+    )
+    return addrs & mask
+
+
+def v4_array(ips: Iterable[str]) -> np.ndarray:
+    """Converts IPv4 strings into an ``uint32`` array."""
+    return np.array([int(ip_address(ip)) for ip in ips], dtype=np.uint32)
+
+
+def v6_array(ips: Iterable[str]) -> np.ndarray:
+    """Converts IPv6 strings into an ``uint64`` array of shape ``(n, 2)``."""
+    ints = [int(ip_address(ip)) for ip in ips]
+    return np.array([[i >> 64, i & _MASK64] for i in ints], dtype=np.uint64).reshape(-1, 2)
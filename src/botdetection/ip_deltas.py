@@ -0,0 +1,202 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.ip_deltas:
+
+Delta updates of the IP lists
+-----------------------------
+
+The entries of a block feed in the ``block_ip`` list (or of the ``pass_ip``
+list) change by a few hundred entries every few minutes.  Instead of a new
+configuration (a compile of the whole index and a reload of all workers), the
+changes are published as *deltas* in a log in the redis DB and the workers
+apply the deltas to the index of the list
+(:py:obj:`.ip_lists.IPListIndex`).
+
+Delta file
+  A delta is a text file with one network per line, ``+`` adds the network to
+  the list and ``-`` removes it, comments start with ``#``.  If a network is
+  listed more than once, the last line wins (see :py:obj:`parse_delta`):
+
+  .. code:: text
+
+     # block feed 2026-10-19T09:10
+     + 192.0.2.0/24
+     + 2001:db8::/32
+     - 198.51.100.7
+
+Delta log
+  A delta is appended to the log of the list by :py:obj:`publish` (or by the
+  ``delta`` command of the :ref:`command line <botdetection.cli>`) and gets
+  the next *version* of the log (see :py:func:`.redislib.append_log`).  Every
+  ``interval`` seconds a worker reads the deltas that are newer than the
+  version of its index, folds them into one delta (:py:obj:`fold`) and applies
+  it.  The index of a worker is identified by the *snapshot ID*
+  ``<base>:<version>``, the ``base`` is a hash of the list in the
+  configuration (:py:obj:`base_id`): workers with the same snapshot ID have
+  the same index.
+
+  .. code:: python
+
+     delta = ip_deltas.load_delta(pathlib.Path('feed.delta'))
+     ip_deltas.publish(ctx.redis_client, 'botdetection.ip_lists.block_ip', delta)
+
+  If the log has more than ``max_deltas`` deltas, :py:obj:`publish` folds the
+  older deltas into one (:py:obj:`compact`), the newest ``max_deltas / 2``
+  deltas are kept.  A worker of any older version catches up by the folded
+  delta.  The folded delta keeps the removed networks, the size of the log is
+  limited by the number of the networks changed by the deltas.
+
+The deltas are applied to the list of the configuration, e.g. a network of the
+configuration can be removed by a delta.  The index of the :py:obj:`.ip_lists`
+method and the compiled indexes of the :py:obj:`.ip_arrays` are updated.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.ip_deltas]
+
+   # apply the deltas of the log in the redis DB to the indexes of the IP lists
+   enabled = false
+
+   # time (sec) in which a worker reads the new deltas from the log
+   interval = 10
+
+   # maximum number of deltas in the log, older deltas are folded into one
+   max_deltas = 100
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, NamedTuple, Tuple
+
+import hashlib
+import pathlib
+from functools import lru_cache
+from ipaddress import ip_network
+
+from . import ctx
+from .redislib import append_log, read_log, log_keys
+
+
+class Delta(NamedTuple):
+    """The networks added to and removed from a IP list (the networks are
+    normalized, see :py:obj:`parse_delta`).  A delta is applied by removing
+    the networks in ``remove`` and adding the networks in ``add``."""
+
+    add: Tuple[str, ...]
+    """Networks added to the list."""
+
+    remove: Tuple[str, ...]
+    """Networks removed from the list."""
+
+
+def _delta(ops: Dict[str, bool]) -> Delta:
+    return Delta(
+        add=tuple(net for net, add in ops.items() if add),
+        remove=tuple(net for net, add in ops.items() if not add),
+    )
+
+
+def parse_delta(text: str) -> Delta:
+    """Parses the ``text`` of a delta file, the networks are normalized
+    (:py:obj:`ipaddress.IPv4Network.compressed`).  Raises a
+    :py:obj:`ValueError` with the number of an invalid line."""
+    ops: Dict[str, bool] = {}
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        op, net = line[0], line[1:].strip()
+        if op not in '+-' or not net:
+            raise ValueError(f"line {lineno}: expected '+ NETWORK' or '- NETWORK'")
+        try:
+            net = ip_network(net, strict=False).compressed
+        except ValueError as exc:
+            raise ValueError(f"line {lineno}: {exc}") from exc
+        # the last line of a network wins
+        ops.pop(net, None)
+        ops[net] = op == '+'
+    return _delta(ops)
+
+
+def load_delta(path: pathlib.Path) -> Delta:
+    """Loads a delta file (see :py:obj:`parse_delta`)."""
+    return parse_delta(path.read_text(encoding='utf-8'))
+
+
+def dump_delta(delta: Delta) -> str:
+    """Returns the text of a delta file, the removed networks first."""
+    lines = [f"- {net}" for net in delta.remove] + [f"+ {net}" for net in delta.add]
+    return '\n'.join(lines)
+
+
+def fold(deltas: Iterable[Delta]) -> Delta:
+    """Folds the ``deltas`` into one delta, the last change of a network wins.
+    The folded delta has the same effect as the ``deltas`` one after the
+    other, also on a list to which some of the ``deltas`` have already been
+    applied."""
+    ops: Dict[str, bool] = {}
+    for delta in deltas:
+        for net in delta.remove:
+            ops.pop(net, None)
+            ops[net] = False
+        for net in delta.add:
+            ops.pop(net, None)
+            ops[net] = True
+    return _delta(ops)
+
+
+@lru_cache(maxsize=16)
+def base_id(nets: Tuple[str, ...]) -> str:
+    """Returns the ID of the list ``nets`` from the configuration, the first
+    part of the snapshot ID ``<base>:<version>``."""
+    return hashlib.blake2b('\n'.join(nets).encode(), digest_size=6).hexdigest()
+
+
+def _log_name(list_name: str) -> str:
+    return f"ip_deltas.{list_name}"
+
+
+def publish(client, list_name: str, delta: Delta, max_deltas: int | None = None) -> int:
+    """Appends the ``delta`` to the log of the IP list ``list_name`` and
+    returns the version of the delta.  If the log has more than
+    ``max_deltas`` (default: ``botdetection.ip_deltas.max_deltas``) deltas,
+    the log is compacted (see :py:obj:`compact`)."""
+    if max_deltas is None:
+        max_deltas = ctx.cfg['botdetection.ip_deltas.max_deltas']
+    version = append_log(client, _log_name(list_name), dump_delta(delta))
+    if max_deltas and client.zcard(log_keys(_log_name(list_name))[1]) > max_deltas:
+        compact(client, list_name, keep=max_deltas // 2)
+    return version
+
+
+def read(client, list_name: str, version: int) -> Tuple[int, Delta | None]:
+    """Returns the last version of the log of the IP list ``list_name`` and
+    the deltas newer than ``version`` folded into one delta (``None`` if there
+    is no newer delta)."""
+    items = read_log(client, _log_name(list_name), version)
+    if not items:
+        return version, None
+    return items[-1][0], fold(parse_delta(text) for _, text in items)
+
+
+def compact(client, list_name: str, keep: int = 0) -> int:
+    """Folds the deltas in the log of the IP list ``list_name`` into one delta,
+    the newest ``keep`` deltas are kept.  Returns the number of folded
+    deltas."""
+    items = read_log(client, _log_name(list_name))
+    items = items[: len(items) - keep] if keep else items
+    if len(items) < 2:
+        return 0
+    version = items[-1][0]
+    delta = fold(parse_delta(text) for _, text in items)
+    key = log_keys(_log_name(list_name))[1]
+    pipe = client.pipeline(transaction=True)
+    pipe.zremrangebyscore(key, '-inf', version)
+    pipe.zadd(key, {f"{version}:{dump_delta(delta)}": version})
+    pipe.execute()
+    return len(items)
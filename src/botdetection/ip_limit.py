@@ -11,6 +11,10 @@ bot request.  This method requires a redis DB and needs a HTTP X-Forwarded-For_
 header.  To take privacy only the hash value of an IP is stored in the redis DB
 and at least for a maximum of 10 minutes.
 
+The windows are counted by a :ref:`limiter strategy <botdetection.limiter>`
+(``strategy``).  The sizes of the windows and the maxima are set in the config,
+the defaults are the constants :py:obj:`BURST_WINDOW`, :py:obj:`BURST_MAX`, ..
+
 The :py:obj:`.link_token` method can be used to investigate whether a request is
 *suspicious*.  To activate the :py:obj:`.link_token` method in the
 :py:obj:`.ip_limit` method add the following configuration:
@@ -33,6 +37,41 @@ for a longer time.  IPs stored in this sliding window have a maximum of
 makes a request that is not suspicious, the sliding window for this IP is
 dropped.
 
+In the *adaptive prefix* mode (``adaptive_prefix = true``) the requests are
+not counted per (client) network, they are counted in the coarsest aggregate
+network from ``adaptive_ipv4_prefixes`` / ``adaptive_ipv6_prefixes`` which has
+not been split.  If a counter of an aggregate exceeds the
+``adaptive_split_ratio`` of its maximum, the aggregate is split (for
+:py:obj:`LONG_WINDOW`) and the requests are counted in the next finer prefix,
+down to the (client) network.  This is similar to *hierarchical heavy
+hitters*: benign ranges (e.g. a carrier NAT) need one counter per aggregate,
+only ranges with many requests are split into counters per (client) network.
+The :py:obj:`SUSPICIOUS_IP_WINDOW` is always counted per (client) network.
+
+The maxima of the (client) network are applied to the network, an aggregate
+has the ``adaptive_aggregate_ratio`` multiple of the maxima.  A split
+aggregate is still counted: the requests of a distributed flood from an
+aggregate (e.g. from all IPs of a /24) are blocked, even if each (client)
+network stays below its limits.  With ``adaptive_aggregate_ratio = 0`` an
+aggregate is never blocked and a split aggregate is no longer counted.
+
+The windows of a request are counted in a chain (:py:obj:`get_windows`) which
+is evaluated in one roundtrip to the redis DB, the evaluation stops at the
+first window that blocks the request.  A batch of requests can be evaluated in
+one pipeline, see :ref:`botdetection.batch`.
+
+The blocks can be propagated to the workers of all nodes, see
+:ref:`botdetection.propagation`.
+
+With :ref:`route policies <botdetection.policies>` the requests to a route are
+counted with a *weight* and/or in own windows of the route.  The weight applies
+to the BURST and LONG windows, the :py:obj:`API_WINDOW` and the
+:py:obj:`SUSPICIOUS_IP_WINDOW` count each request once.
+
+If the worker is overloaded, the maxima of the windows are tightened, see
+:ref:`botdetection.load_shedding`.  Other limiter strategies can be evaluated
+next to the active strategy, see :ref:`botdetection.shadow`.
+
 .. _X-Forwarded-For:
    https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/X-Forwarded-For
 
@@ -51,30 +90,79 @@ Config
    # activate link_token method in the ip_limit method
    link_token = false
 
+   # limiter strategy of the windows: 'sliding_log', 'token_bucket' or 'gcra'
+   strategy = 'sliding_log'
+
+   # time (sec) of the windows and maximum requests in the windows
+   BURST_WINDOW = 20
+   BURST_MAX = 15
+   BURST_MAX_SUSPICIOUS = 2
+   LONG_WINDOW = 600
+   LONG_MAX = 150
+   LONG_MAX_SUSPICIOUS = 10
+   API_WINDOW = 3600
+   API_MAX = 4
+   SUSPICIOUS_IP_WINDOW = 2592000
+   SUSPICIOUS_IP_MAX = 3
+
+   # adaptive prefix mode: count requests in aggregates and split an aggregate
+   # into finer prefixes when it nears a limit
+   adaptive_prefix = false
+
+   # prefixes of the aggregates (the lists are extended by the config, the
+   # prefixes are used from coarse to fine)
+   adaptive_ipv4_prefixes = [24]
+   adaptive_ipv6_prefixes = [32]
+
+   # split an aggregate when a counter exceeds this fraction of its maximum
+   adaptive_split_ratio = 0.5
+
+   # block the requests from an aggregate when a counter exceeds this multiple
+   # of its maximum (0: an aggregate is never blocked)
+   adaptive_aggregate_ratio = 8
+
+   # route policies: weight and windows of the requests to a route (see
+   # botdetection.policies)
+   policies = [
+     # { name = 'search', routes = ['/search'], weight = 10 },
+   ]
+
 Implementations
 ~~~~~~~~~~~~~~~
 
 """
 from __future__ import annotations
-from ipaddress import (
-    IPv4Network,
-    IPv6Network,
-)
+from typing import Dict, List, NamedTuple, Tuple
+
+import time
 
 import flask
 import werkzeug
 
 from . import ctx
-from .redislib import incr_sliding_window, drop_counter
+from .redislib import incr_counter, get_counter, WINDOW_BLOCK, WINDOW_COUNT, WINDOW_DROP, WINDOW_EXPIRE
+from .limiter import get_limiter
+from .local_tier import get_local_tier
+from .policies import get_policy
+from .exporter import record_block
 from . import link_token
+from . import propagation
 from . import config
+from . import decisions
+from . import heavy_hitters
+from . import load_shedding
+from . import shadow
+from . import http_accept, http_accept_encoding, http_accept_language, http_connection, http_user_agent
+from .log_throttle import LogThrottle
 from ._helpers import (
     too_many_requests,
     logger,
+    NetworkKey,
 )
 
 
 logger = logger.getChild('ip_limit')
+_log = LogThrottle(logger)
 
 BURST_WINDOW = 20
 """Time (sec) before sliding window for *burst* requests expires."""
@@ -107,57 +195,336 @@ SUSPICIOUS_IP_MAX = 3
 """Maximum requests from one suspicious IP in the :py:obj:`SUSPICIOUS_IP_WINDOW`."""
 
 
+class Window(NamedTuple):
+    """A window of a request in the chain of windows which is evaluated by
+    :py:func:`.redislib.incr_windows`."""
+
+    mode: int
+    name: bytes
+    duration: int
+    maximum: int
+    weight: int = 1
+    reason: str = ''
+    status: int = 429
+    """HTTP status of the verdict if the window blocks the request."""
+    split: float = 0
+    """Count at which the aggregate of the window is split (``0``: the window
+    is not counted in the aggregate of the request)."""
+
+
+class Verdict(NamedTuple):
+    """Verdict of the ip_limit method for a request."""
+
+    status: int = 200
+    """``200``: pass, ``429``: too many requests, ``302``: redirect to the
+    index page (too many requests from a suspicious IP)"""
+    reason: str = ''
+
+    @property
+    def blocked(self) -> bool:
+        """``True`` if the request is blocked."""
+        return self.status != 200
+
+
+PASS = Verdict()
+
+HEADER_METHODS = (http_accept, http_accept_encoding, http_accept_language, http_connection, http_user_agent)
+"""Header methods evaluated in level 2 of the :ref:`load shedding
+<botdetection.load_shedding>`."""
+
+_WINDOW_NAMES = {'BURST': b'BURST_WINDOW', 'LONG': b'LONG_WINDOW'}
+
+_REASONS = {
+    f"{window}{suffix}": f"too many request in {window}_WINDOW ({window}_MAX{suffix})"
+    for window in ('BURST', 'LONG')
+    for suffix in ('', '_SUSPICIOUS')
+}
+
+
+def is_monitored(network: NetworkKey, cfg: config.Config) -> bool:
+    """Returns ``False`` if the (client) network is not monitored by the
+    ip_limit method (link-local networks, see ``filter_link_local``)."""
+    if network.is_link_local and not cfg['botdetection.ip_limit.filter_link_local']:
+        logger.debug("network %s is link-local -> not monitored by ip_limit method", network.name)
+        return False
+    return True
+
+
+def get_windows(
+    network: NetworkKey,
+    counted: NetworkKey,
+    request: flask.Request,
+    cfg: config.Config,
+    ping_key: str | None = None,
+) -> List[Window]:
+    """Returns the chain of windows in which a request is counted.  The
+    requests are counted in the ``counted`` network (see
+    :py:obj:`adaptive_network`).  The ``ping_key`` is the key of a valid ping
+    of the :py:obj:`.link_token` method (``None``: the request is
+    suspicious).  In the *adaptive prefix* mode the windows of the aggregates
+    are counted before the windows of the (client) network."""
+
+    # pylint: disable=too-many-locals
+
+    lcfg = cfg['botdetection.ip_limit']
+    policy = get_policy(request.path, cfg)
+    limits = policy.limits
+    aggregates = _aggregates(network, counted, cfg)
+    ratio = lcfg['adaptive_aggregate_ratio']
+    windows = []
+    level = load_shedding.get_level()
+    tighten = cfg['botdetection.load_shedding.tighten'] ** level if level else 1
+
+    def limited(name: bytes, duration: int, maximum: int, weight: int = 1, reason: str = '') -> List[Window]:
+        chain = [
+            Window(
+                WINDOW_BLOCK if ratio else WINDOW_COUNT,
+                name + aggregate.key,
+                duration,
+                max(1, int(ratio * maximum)) if ratio else maximum,
+                weight,
+                reason=reason + " (aggregate)",
+                split=lcfg['adaptive_split_ratio'] * maximum if aggregate is counted else 0,
+            )
+            for aggregate in aggregates
+        ]
+        if counted is network:
+            chain.append(Window(WINDOW_BLOCK, name + network.key, duration, maximum, weight, reason=reason))
+        return chain
+
+    if request.args.get('format', 'html') != 'html':
+        windows.extend(
+            limited(
+                b'ip_limit.API_WINDOW:',
+                lcfg['API_WINDOW'],
+                _tightened(lcfg['API_MAX'], tighten),
+                reason="too many request in API_WINDOW",
+            )
+        )
+
+    suffix = ''
+    if lcfg['link_token']:
+        if ping_key:
+            if level:
+                # overload: skip the renewal of the ping
+                return windows
+            # this IP is no longer suspicious: renew the ping and release ip
+            # again / delete the counter of this IP
+            windows.append(Window(WINDOW_EXPIRE, ping_key, cfg['botdetection.link_token.PING_LIVE_TIME'], 0, 0))
+            windows.append(Window(WINDOW_DROP, b'ip_limit.SUSPICIOUS_IP_WINDOW' + network.key, 0, 0, 0))
+            return windows
+
+        # this IP is suspicious: count requests from this IP
+        windows.append(
+            Window(
+                WINDOW_BLOCK,
+                b'ip_limit.SUSPICIOUS_IP_WINDOW' + network.key,
+                lcfg['SUSPICIOUS_IP_WINDOW'],
+                lcfg['SUSPICIOUS_IP_MAX'],
+                reason="too many request in SUSPICIOUS_IP_WINDOW (redirect to /)",
+                status=302,
+            )
+        )
+        suffix = '_SUSPICIOUS'
+
+    if not policy.weight:
+        return windows
+
+    for window in ('BURST', 'LONG'):
+        windows.extend(
+            limited(
+                policy.counter + _WINDOW_NAMES[window],
+                limits[window + '_WINDOW'],
+                _tightened(limits[window + '_MAX' + suffix], tighten),
+                policy.weight,
+                reason=_REASONS[window + suffix],
+            )
+        )
+    return windows
+
+
+def _aggregates(network: NetworkKey, counted: NetworkKey, cfg: config.Config) -> List[NetworkKey]:
+    """Returns the aggregates in which the requests from the (client)
+    ``network`` are counted: the split aggregates and the ``counted``
+    aggregate (see :py:obj:`adaptive_network`)."""
+
+    lcfg = cfg['botdetection.ip_limit']
+    if not lcfg['adaptive_prefix']:
+        return []
+    aggregates = []
+    if lcfg['adaptive_aggregate_ratio']:
+        # the aggregates coarser than the counted network have been split
+        prefixes = lcfg[f'adaptive_ipv{network.version}_prefixes']
+        aggregates = [network.supernet(prefix) for prefix in sorted(set(prefixes)) if prefix < counted.prefixlen]
+    if counted is not network:
+        aggregates.append(counted)
+    return aggregates
+
+
+def _tightened(maximum: int, tighten: float) -> int:
+    if tighten == 1:
+        return maximum
+    return max(1, int(maximum * tighten))
+
+
+def get_verdict(
+    network: NetworkKey,
+    counted: NetworkKey,
+    windows: List[Window],
+    counts: List[int],
+    cfg: config.Config,
+) -> Verdict:
+    """Returns the verdict from the ``counts`` of the ``windows`` (see
+    :py:obj:`get_windows`)."""
+    for window, c in zip(windows, counts):
+        if window.split and c > window.split:
+            _split(counted, c, cfg)
+        if window.mode == WINDOW_BLOCK and c > window.maximum:
+            if window.status == 429:
+                record_block(network, window.duration)
+                propagation.publish(network, window.status, window.reason)
+            return Verdict(window.status, window.reason)
+    return PASS
+
+
+def evaluate(network: NetworkKey, request: flask.Request, cfg: config.Config) -> Verdict:
+    """Evaluates a request, the windows of the request are counted in one
+    roundtrip to the redis DB (see :py:func:`.redislib.incr_windows`) or in
+    the :ref:`local tier <botdetection.local_tier>`.  The request and the
+    verdict are counted by the :py:obj:`.heavy_hitters`."""
+
+    verdict = _evaluate(network, request, cfg)
+    heavy_hitters.record(network, verdict.blocked)
+    return verdict
+
+
+def _evaluate(network: NetworkKey, request: flask.Request, cfg: config.Config) -> Verdict:
+
+    if not is_monitored(network, cfg):
+        return PASS
+
+    cached = propagation.lookup(network)
+    if cached is not None:
+        return Verdict(*cached)
+
+    lcfg = cfg['botdetection.ip_limit']
+    counted = adaptive_network(network, cfg)
+    ping_key = None
+    if lcfg['link_token'] and not link_token.is_suspicious(network, request):
+        ping_key = link_token.get_ping_key(network, request)
+
+    windows = get_windows(network, counted, request, cfg, ping_key)
+    if not windows:
+        return PASS
+    limiter = get_limiter(lcfg['strategy'])
+    tier = get_local_tier()
+    sampled = shadow.get_shadow()
+    if sampled is not None and not sampled.sampled(network):
+        sampled = None
+    start = time.perf_counter() if sampled else 0
+    if tier is not None:
+        counts = tier.incr_windows(limiter, ctx.redis_client, windows)
+    else:
+        counts = limiter.incr_windows(ctx.redis_client, windows)
+    verdict = get_verdict(network, counted, windows, counts, cfg)
+    if sampled:
+        _shadow_strategies(sampled, windows, verdict, time.perf_counter() - start, cfg)
+    return verdict
+
+
+def _blocked(windows: List[Window], counts: List[int]) -> bool:
+    return any(w.mode == WINDOW_BLOCK and c > w.maximum for w, c in zip(windows, counts))
+
+
+def _shadow_strategies(
+    sampled: shadow.Shadow, windows: List[Window], verdict: Verdict, latency: float, cfg: config.Config
+):
+    """Evaluates the windows by the candidate strategies of the :ref:`shadow
+    evaluation <botdetection.shadow>`, the windows of a candidate are counted
+    in own keys."""
+    client = ctx.redis_client
+    for strategy in cfg['botdetection.shadow.strategies']:
+        prefix = f'shadow.{strategy}.'.encode()
+        # a ping (WINDOW_EXPIRE) is not renewed by the shadow
+        candidate = [w._replace(name=prefix + w.name) for w in windows if w.mode != WINDOW_EXPIRE]
+
+        def evaluate_candidate(limiter=get_limiter(strategy), candidate=candidate):
+            return _blocked(candidate, limiter.incr_windows(client, candidate))
+
+        sampled.submit('ip_limit:' + strategy, verdict.blocked, latency, evaluate_candidate)
+
+
 def filter_request(
-    network: IPv4Network | IPv6Network,
+    network: NetworkKey,
     request: flask.Request,
     cfg: config.Config,
 ) -> werkzeug.Response | None:
+    """Blocks the request if a window of the (client) network is exceeded."""
+
+    if load_shedding.get_level() >= 2 and cfg['botdetection.load_shedding.strict_headers']:
+        for method in HEADER_METHODS:
+            response = method.filter_request(network, request, cfg)
+            if response is not None:
+                heavy_hitters.record(network, True)
+                return response
+
+    verdict = evaluate(network, request, cfg)
+    if verdict.status == 302:
+        decisions.record(network, 'ip_limit', verdict.reason, request)
+        _log.error("BLOCK %s: %s", network.name, verdict.reason, key=(network.key, verdict.reason))
+        return flask.redirect(flask.url_for('index'), code=302)
+    if verdict.blocked:
+        return too_many_requests(network, verdict.reason, 'ip_limit', request)
+    return None
 
-    # pylint: disable=too-many-return-statements
 
-    if network.is_link_local and not cfg['botdetection.ip_limit.filter_link_local']:
-        logger.debug("network %s is link-local -> not monitored by ip_limit method", network.compressed)
-        return None
+SPLIT_CACHE_TTL = 5
+"""Time (sec) the split state of an aggregate is cached in the worker."""
 
-    if request.args.get('format', 'html') != 'html':
-        c = incr_sliding_window(ctx.redis_client, 'ip_limit.API_WINDOW:' + network.compressed, API_WINDOW)
-        if c > API_MAX:
-            return too_many_requests(network, "too many request in API_WINDOW")
+_SPLIT_CACHE_MAX = 65536
 
-    if cfg['botdetection.ip_limit.link_token']:
 
-        suspicious = link_token.is_suspicious(network, request, True)
+def _split_cache() -> Dict[str, Tuple[bool, float]]:
+    return ctx.state('ip_limit.split_cache', dict)
 
-        if not suspicious:
-            # this IP is no longer suspicious: release ip again / delete the counter of this IP
-            drop_counter(ctx.redis_client, 'ip_limit.SUSPICIOUS_IP_WINDOW' + network.compressed)
-            return None
 
-        # this IP is suspicious: count requests from this IP
-        c = incr_sliding_window(
-            ctx.redis_client, 'ip_limit.SUSPICIOUS_IP_WINDOW' + network.compressed, SUSPICIOUS_IP_WINDOW
-        )
-        if c > SUSPICIOUS_IP_MAX:
-            logger.error("BLOCK: too many request from %s in SUSPICIOUS_IP_WINDOW (redirect to /)", network)
-            return flask.redirect(flask.url_for('index'), code=302)
+def adaptive_network(network: NetworkKey, cfg: config.Config) -> NetworkKey:
+    """Returns the network in which the requests from the (client) ``network``
+    are counted.  Without ``adaptive_prefix`` this is the (client) network,
+    otherwise it is the coarsest aggregate that has not been split."""
 
-        c = incr_sliding_window(ctx.redis_client, 'ip_limit.BURST_WINDOW' + network.compressed, BURST_WINDOW)
-        if c > BURST_MAX_SUSPICIOUS:
-            return too_many_requests(network, "too many request in BURST_WINDOW (BURST_MAX_SUSPICIOUS)")
+    lcfg = cfg['botdetection.ip_limit']
+    if not lcfg['adaptive_prefix']:
+        return network
+    prefixes = lcfg[f'adaptive_ipv{network.version}_prefixes']
+    for prefix in sorted(set(prefixes)):
+        if prefix >= network.prefixlen:
+            break
+        aggregate = network.supernet(prefix)
+        if not _is_split(aggregate):
+            return aggregate
+    return network
 
-        c = incr_sliding_window(ctx.redis_client, 'ip_limit.LONG_WINDOW' + network.compressed, LONG_WINDOW)
-        if c > LONG_MAX_SUSPICIOUS:
-            return too_many_requests(network, "too many request in LONG_WINDOW (LONG_MAX_SUSPICIOUS)")
 
-        return None
+def _is_split(aggregate: NetworkKey) -> bool:
+    now = time.time()
+    split_cache = _split_cache()
+    cached = split_cache.get(aggregate.key)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    split = get_counter(ctx.redis_client, b'ip_limit.SPLIT' + aggregate.key) > 0
+    if len(split_cache) >= _SPLIT_CACHE_MAX:
+        split_cache.clear()
+    split_cache[aggregate.key] = (split, now + SPLIT_CACHE_TTL)
+    return split
 
-    # vanilla limiter without extensions counts BURST_MAX and LONG_MAX
-    c = incr_sliding_window(ctx.redis_client, 'ip_limit.BURST_WINDOW' + network.compressed, BURST_WINDOW)
-    if c > BURST_MAX:
-        return too_many_requests(network, "too many request in BURST_WINDOW (BURST_MAX)")
 
-    c = incr_sliding_window(ctx.redis_client, 'ip_limit.LONG_WINDOW' + network.compressed, LONG_WINDOW)
-    if c > LONG_MAX:
-        return too_many_requests(network, "too many request in LONG_WINDOW (LONG_MAX)")
+def _split(aggregate: NetworkKey, c: int, cfg: config.Config):
+    """Splits the ``aggregate``, the count ``c`` of a window exceeds the
+    ``adaptive_split_ratio`` of its maximum.  The requests are counted in the
+    next finer prefix for :py:obj:`LONG_WINDOW`."""
 
-    return None
+    lcfg = cfg['botdetection.ip_limit']
+    logger.debug("split aggregate %s (count %s)", aggregate.name, c)
+    incr_counter(ctx.redis_client, b'ip_limit.SPLIT' + aggregate.key, limit=1, expire=lcfg['LONG_WINDOW'])
+    _split_cache()[aggregate.key] = (True, time.time() + lcfg['LONG_WINDOW'])
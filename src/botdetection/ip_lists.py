@@ -8,6 +8,12 @@ Method ``ip_lists``
 The ``ip_lists`` method implements IP :py:obj:`block- <block_ip>` and
 :py:obj:`pass-lists <pass_ip>`.
 
+The networks of a list are indexed once per worker (:py:obj:`IPListIndex`), a
+lookup only checks the networks in the subtree of the IP.  The index is
+rebuild when the list in the configuration is replaced or its length changes.
+With the :ref:`delta updates <botdetection.ip_deltas>` the deltas of the log
+in the redis DB are applied to the index (see :py:obj:`get_index`).
+
 
 Config
 ~~~~~~
@@ -34,18 +40,46 @@ Implementations
 # pylint: disable=unused-argument
 
 from __future__ import annotations
-from typing import Tuple
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Sequence, Tuple
 from ipaddress import (
     ip_network,
     IPv4Address,
     IPv6Address,
+    IPv4Network,
+    IPv6Network,
 )
 
+import copy
+import itertools
+import time
+
+from . import ctx
 from . import config
+from . import ip_deltas
 from ._helpers import logger
 
 logger = logger.getChild('ip_limit')
 
+V4_SUBTREE_PREFIX = 16
+"""Prefix of the IPv4 subtrees of a :py:obj:`IPListIndex`."""
+
+V6_SUBTREE_PREFIX = 32
+"""Prefix of the IPv6 subtrees of a :py:obj:`IPListIndex`."""
+
+MAX_INDEXES = 16
+"""Maximum number of indexes in a context (the lists of different
+configurations)."""
+
+Subtree = Tuple[int, int]
+"""Key of a subtree: the IP version and the network address of the subtree
+(shifted by the host bits)."""
+
+Range = Tuple[int, int, int]
+"""A network: the IP version, the first and the last address."""
+
+_SHIFT = {4: 32 - V4_SUBTREE_PREFIX, 6: 128 - V6_SUBTREE_PREFIX}
+_BITS = {4: 32, 6: 128}
+
 
 def pass_ip(real_ip: IPv4Address | IPv6Address, cfg: config.Config) -> Tuple[bool, str]:
     """Checks if the IP on the subnet is in one of the members of the
@@ -65,16 +99,167 @@ def block_ip(real_ip: IPv4Address | IPv6Address, cfg: config.Config) -> Tuple[bo
     return block, msg
 
 
+def parse_networks(list_name: str, nets: Iterable[str]) -> Iterator[IPv4Network | IPv6Network]:
+    """Returns the networks of the items ``nets`` of the IP list
+    ``list_name``, invalid items are logged and skipped."""
+    for net in nets:
+        try:
+            yield ip_network(net, strict=False)
+        except ValueError:
+            logger.error("invalid IP %s in %s", net, list_name)
+
+
+def network_ranges(list_name: str, nets: Iterable[str]) -> Iterator[Range]:
+    """Returns the :py:obj:`Range` of the items ``nets`` of the IP list
+    ``list_name`` (see :py:obj:`parse_networks`)."""
+    for net in parse_networks(list_name, nets):
+        yield net.version, int(net.network_address), int(net.broadcast_address)
+
+
 def ip_is_subnet_of_member_in_list(
     real_ip: IPv4Address | IPv6Address, list_name: str, cfg: config.Config
 ) -> Tuple[bool, str]:
 
-    for net in cfg.get(list_name, default=[]):
-        try:
-            net = ip_network(net, strict=False)
-        except ValueError:
-            logger.error("invalid IP %s in %s", net, list_name)
-            continue
-        if real_ip.version == net.version and real_ip in net:
-            return True, f"IP matches {net.compressed} in {list_name}."
+    net = get_index(list_name, cfg).lookup(real_ip)
+    if net is not None:
+        return True, f"IP matches {net.compressed} in {list_name}."
     return False, f"IP is not a member of an item in the f{list_name} list"
+
+
+def _subtree(rng: Range) -> Subtree | None:
+    version, start, end = rng
+    shift = _SHIFT[version]
+    if start >> shift != end >> shift:
+        # the network is larger than a subtree
+        return None
+    return version, start >> shift
+
+
+class IPListIndex:
+    """A version of the index of a IP list.  The networks are grouped into
+    subtrees (the networks of :py:obj:`V4_SUBTREE_PREFIX` and
+    :py:obj:`V6_SUBTREE_PREFIX`), the networks larger than a subtree are kept
+    in an extra (usually small) set.  The version ``0`` is the list of the
+    configuration.
+
+    A delta creates a new version of the index (:py:obj:`apply`) which shares
+    the subtrees not changed by the delta with the previous version
+    (copy-on-write), the previous version is not changed and can still be
+    used by other threads."""
+
+    def __init__(self, list_name: str, nets: Sequence[str]):
+        self.list_name = list_name
+        self.base = ip_deltas.base_id(tuple(nets))
+        self.version = 0
+        self.subtrees: Dict[Subtree, Tuple[Tuple[int, int], ...]] = {}
+        """The ranges (first and last address) of the networks in a subtree."""
+        self.large: FrozenSet[Range] = frozenset()
+        """The networks larger than a subtree."""
+        self._update((rng, True) for rng in network_ranges(list_name, nets))
+
+    @property
+    def snapshot(self) -> str:
+        """The snapshot ID ``<base>:<version>`` of the index."""
+        return f"{self.base}:{self.version}"
+
+    def lookup(self, real_ip: IPv4Address | IPv6Address) -> IPv4Network | IPv6Network | None:
+        """Returns a network of the list that contains ``real_ip`` (``None``
+        if there is no such network)."""
+        version = real_ip.version
+        addr = int(real_ip)
+        for start, end in self.subtrees.get((version, addr >> _SHIFT[version]), ()):
+            if start <= addr <= end:
+                return _network(version, start, end)
+        for rng in self.large:
+            if rng[0] == version and rng[1] <= addr <= rng[2]:
+                return _network(*rng)
+        return None
+
+    def apply(self, delta: ip_deltas.Delta, version: int) -> IPListIndex:
+        """Returns the new ``version`` of the index with the ``delta``
+        applied."""
+        index = copy.copy(self)
+        index.version = version
+        index._update(  # pylint: disable=protected-access
+            itertools.chain(
+                ((rng, False) for rng in network_ranges(self.list_name, delta.remove)),
+                ((rng, True) for rng in network_ranges(self.list_name, delta.add)),
+            )
+        )
+        return index
+
+    def _update(self, changes: Iterable[Tuple[Range, bool]]):
+        # copy-on-write: the dictionary of the subtrees is copied, only the
+        # changed subtrees are replaced
+        subtrees = dict(self.subtrees)
+        large = set(self.large)
+        changed: Dict[Subtree, List[Tuple[int, int]]] = {}
+        for rng, add in changes:
+            key = _subtree(rng)
+            if key is None:
+                if add:
+                    large.add(rng)
+                else:
+                    large.discard(rng)
+                continue
+            members = changed.get(key)
+            if members is None:
+                members = changed[key] = list(subtrees.get(key, ()))
+            if rng[1:] in members:
+                if not add:
+                    members.remove(rng[1:])
+            elif add:
+                members.append(rng[1:])
+        for key, members in changed.items():
+            if members:
+                subtrees[key] = tuple(members)
+            else:
+                subtrees.pop(key, None)
+        self.subtrees = subtrees
+        if large != self.large:
+            self.large = frozenset(large)
+
+
+def _network(version: int, start: int, end: int) -> IPv4Network | IPv6Network:
+    prefix = _BITS[version] - (end - start).bit_length()
+    return (IPv4Network if version == 4 else IPv6Network)((start, prefix))
+
+
+class _Tracker:
+    """The index of a IP list in a context and the time of the last read of
+    the delta log."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, nets: Sequence[str], index: IPListIndex):
+        self.nets = nets
+        self.size = len(nets)
+        self.index = index
+        self.checked = 0.0
+
+
+def get_index(list_name: str, cfg: config.Config) -> IPListIndex:
+    """Returns the :py:obj:`IPListIndex` of the IP list ``list_name`` in the
+    current context.  The index is build on first use and rebuild if the list
+    in the ``cfg`` is replaced or its length changes.  If the :ref:`delta
+    updates <botdetection.ip_deltas>` are enabled, the new deltas of the log
+    are applied every ``interval`` seconds."""
+    nets = cfg.get(list_name, default=[])
+    trackers: Dict[Tuple[str, int], _Tracker] = ctx.state('ip_lists.indexes', dict)
+    # the tracker holds the list, the id of the list is not reused
+    key = (list_name, id(nets))
+    tracker = trackers.get(key)
+    if tracker is None or tracker.nets is not nets or tracker.size != len(nets):
+        if len(trackers) >= MAX_INDEXES:
+            trackers.clear()
+        tracker = trackers[key] = _Tracker(nets, IPListIndex(list_name, nets))
+
+    if ctx.redis_client and cfg.get('botdetection.ip_deltas.enabled', default=False):
+        now = time.monotonic()
+        if now - tracker.checked >= cfg['botdetection.ip_deltas.interval']:
+            tracker.checked = now
+            version, delta = ip_deltas.read(ctx.redis_client, list_name, tracker.index.version)
+            if delta is not None:
+                tracker.index = tracker.index.apply(delta, version)
+                logger.debug("index of %s updated to snapshot %s", list_name, tracker.index.snapshot)
+    return tracker.index
@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.ip_rotation:
+
+Method ``ip_rotation``
+----------------------
+
+The ``ip_rotation`` method intercepts bots which rotate their IPs through a
+range of addresses (e.g. a ``/16`` or a cloud range).  Each IP stays below the
+limits of the :py:obj:`.ip_limit` method, but the number of distinct (client)
+networks in the wider *aggregate* network is high.
+
+The (client) networks (see :py:obj:`.get_network`) are counted per aggregate
+network (prefix ``ipv4_prefix`` / ``ipv6_prefix``) in a HyperLogLog in the
+redis DB (:py:obj:`.redislib.incr_distinct`), the memory per aggregate is
+constant.  If there are more than ``distinct_max`` distinct networks in an
+aggregate in the time ``window``, the limiting is escalated to the aggregate:
+all requests from the aggregate are counted in one sliding window and a
+maximum of ``burst_max`` requests in ``burst_window`` is allowed.
+
+A local :py:obj:`.HyperLogLog` per aggregate (4 KiB) remembers the networks
+that were already counted by this worker, only a new network (a register of the
+local HyperLogLog has changed) needs a roundtrip to the redis DB.  A new network
+that does not change a local register is not counted, in the range of
+``distinct_max`` the distinct count is underestimated by ~2%.  The distinct
+count of an aggregate is cached and refreshed after :py:obj:`REFRESH_INTERVAL`
+seconds.
+
+.. note::
+
+   This method requires a redis DB.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.ip_rotation]
+
+   # prefix of the aggregate networks in which the distinct (client) networks
+   # are counted
+   ipv4_prefix = 16
+   ipv6_prefix = 32
+
+   # time (sec) in which the distinct networks of an aggregate are counted
+   window = 3600
+
+   # maximum of distinct (client) networks in an aggregate in the window
+   distinct_max = 256
+
+   # limit of an escalated aggregate: maximum requests from all networks of the
+   # aggregate in the burst_window (sec)
+   burst_window = 20
+   burst_max = 30
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict
+
+import time
+
+import flask
+import werkzeug
+
+from . import ctx
+from . import config
+from .redislib import incr_distinct, count_distinct, incr_sliding_window
+from .sketches import HyperLogLog
+from .exporter import record_block
+from ._helpers import (
+    too_many_requests,
+    logger,
+    NetworkKey,
+)
+
+logger = logger.getChild('ip_rotation')
+
+REFRESH_INTERVAL = 10
+"""Time (sec) after which the cached distinct count of an aggregate is
+refreshed from the redis DB."""
+
+LOCAL_MAX = 1024
+"""Maximum number of aggregates with a local state in a worker (the oldest state
+is dropped first)."""
+
+
+class _Aggregate:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('bucket', 'hll', 'distinct', 'checked')
+
+    def __init__(self, bucket: int):
+        self.bucket = bucket
+        self.hll = HyperLogLog(12)
+        self.distinct = 0
+        self.checked = 0.0
+
+
+def _get_aggregate(name: str, bucket: int) -> _Aggregate:
+    aggregates: Dict[str, _Aggregate] = ctx.state('ip_rotation.aggregates', dict)
+    agg = aggregates.get(name)
+    if agg is None:
+        if len(aggregates) >= LOCAL_MAX:
+            del aggregates[next(iter(aggregates))]
+        agg = aggregates[name] = _Aggregate(bucket)
+    elif agg.bucket != bucket:
+        agg.bucket = bucket
+        agg.hll.clear()
+    return agg
+
+
+def get_aggregate(network: NetworkKey, cfg: config.Config) -> NetworkKey:
+    """Returns the aggregate network of a (client) network."""
+    if network.version == 6:
+        return network.supernet(cfg['botdetection.ip_rotation.ipv6_prefix'])
+    return network.supernet(cfg['botdetection.ip_rotation.ipv4_prefix'])
+
+
+def filter_request(
+    network: NetworkKey,
+    request: flask.Request,
+    cfg: config.Config,
+) -> werkzeug.Response | None:
+    """Blocks the request if its aggregate network exceeds the burst window."""
+
+    if not ctx.redis_client:
+        return None
+    if network.is_link_local and not cfg['botdetection.ip_limit.filter_link_local']:
+        return None
+
+    aggregate = get_aggregate(network, cfg)
+    window = cfg['botdetection.ip_rotation.window']
+    name = b'ip_rotation.DISTINCT' + aggregate.key
+    now = time.time()
+
+    agg = _get_aggregate(aggregate.key, int(now // window))
+    if agg.hll.add(network.key):
+        # network not yet counted by this worker
+        agg.distinct = incr_distinct(ctx.redis_client, name, network.key, window)
+        agg.checked = now
+    elif now - agg.checked > REFRESH_INTERVAL:
+        agg.distinct = count_distinct(ctx.redis_client, name, window)
+        agg.checked = now
+
+    if agg.distinct <= cfg['botdetection.ip_rotation.distinct_max']:
+        return None
+
+    c = incr_sliding_window(
+        ctx.redis_client, b'ip_rotation.BURST_WINDOW' + aggregate.key, cfg['botdetection.ip_rotation.burst_window']
+    )
+    if c > cfg['botdetection.ip_rotation.burst_max']:
+        record_block(aggregate, cfg['botdetection.ip_rotation.burst_window'])
+        return too_many_requests(
+            aggregate,
+            "too many distinct networks in aggregate (BURST_WINDOW)",
+            'ip_rotation',
+            request,
+            detail=f": {agg.distinct} networks",
+        )
+    return None
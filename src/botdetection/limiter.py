@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.limiter:
+
+Limiter strategies
+------------------
+
+The windows of the :py:obj:`.ip_limit` method are counted by a limiter
+*strategy*.  Each strategy is a single roundtrip (lua script) to the redis DB
+and returns the number of requests in the window, which is compared to the
+maximum of the window.  A request can be counted with a *weight* (see
+:ref:`botdetection.policies`).
+
+``sliding_log`` (:py:obj:`SlidingLog`)
+  A sorted set of the request times in the window (the classic behavior of the
+  ``ip_limit`` method).  The memory of a key grows with the maximum of the
+  window and a request that exceeds the maximum is counted, a request costs
+  O(log N).  A request with a weight is one item ``<item>:<weight>``, the
+  extra weights are summed up in a companion counter of the set.
+
+``token_bucket`` (:py:obj:`TokenBucket`)
+  A bucket of ``maximum`` tokens which is refilled in ``window`` seconds.  The
+  key is a hash with two fields, a request on an empty bucket is not counted.
+
+``gcra`` (:py:obj:`GCRA`)
+  The generic cell rate algorithm, equivalent to the token bucket but the state
+  is a single integer per key.  A non conforming request is not counted.
+
+The strategy is selected in the config:
+
+.. code:: toml
+
+   [botdetection.ip_limit]
+   strategy = 'gcra'
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict
+
+import abc
+
+from . import redislib
+
+__all__ = ['Limiter', 'SlidingLog', 'TokenBucket', 'GCRA', 'STRATEGIES', 'get_limiter']
+
+
+class Limiter(abc.ABC):
+    """Base class of a limiter strategy."""
+
+    name = ''
+    """Name of the strategy in :py:obj:`STRATEGIES`."""
+
+    key_type = 'counter'
+    """Type name in the redis key (see :py:func:`.redislib.drop_counter`)."""
+
+    @abc.abstractmethod
+    def incr(self, client, name: str, window: int, maximum: int, weight: int = 1) -> int:
+        """Counts a request ``weight`` times in the window ``name`` and returns
+        the number of requests in the window (a value greater than ``maximum``
+        means: the limit is exceeded)."""
+
+    def incr_windows(self, client, windows, pipe=None):
+        """Evaluates a chain of windows in one roundtrip, see
+        :py:func:`.redislib.incr_windows`."""
+        return redislib.incr_windows(client, self.name, self.key_type, windows, pipe)
+
+    def drop(self, client, name: str):
+        """Drops the window ``name`` from the redis DB."""
+        redislib.drop_counter(client, name, self.key_type)
+
+
+class SlidingLog(Limiter):
+    """Sliding log in a sorted set, see :py:func:`.redislib.incr_sliding_window`."""
+
+    name = 'sliding_log'
+
+    def incr(self, client, name: str, window: int, maximum: int, weight: int = 1) -> int:
+        return redislib.incr_sliding_window(client, name, window, weight)
+
+
+class TokenBucket(Limiter):
+    """Token bucket, see :py:func:`.redislib.incr_token_bucket`."""
+
+    name = 'token_bucket'
+    key_type = 'bucket'
+
+    def incr(self, client, name: str, window: int, maximum: int, weight: int = 1) -> int:
+        return redislib.incr_token_bucket(client, name, window, maximum, weight)
+
+
+class GCRA(Limiter):
+    """Generic cell rate algorithm, see :py:func:`.redislib.incr_gcra`."""
+
+    name = 'gcra'
+    key_type = 'gcra'
+
+    def incr(self, client, name: str, window: int, maximum: int, weight: int = 1) -> int:
+        return redislib.incr_gcra(client, name, window, maximum, weight)
+
+
+STRATEGIES: Dict[str, Limiter] = {limiter.name: limiter for limiter in (SlidingLog(), TokenBucket(), GCRA())}
+"""Limiter strategies by name."""
+
+
+def get_limiter(name: str) -> Limiter:
+    """Returns the limiter strategy ``name`` from :py:obj:`STRATEGIES`."""
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"unknown limiter strategy '{name}', expected one of {list(STRATEGIES)}") from None
@@ -60,27 +60,25 @@ Implementations
 """
 
 from __future__ import annotations
-from ipaddress import (
-    IPv4Network,
-    IPv6Network,
-    ip_address,
-)
 
 import string
 import random
 import flask
 
 from . import ctx
-from .redislib import secret_hash
+from .redislib import secret_hash, compact_keys, redis_key
+from .log_throttle import LogThrottle
 
 from ._helpers import (
     logger,
     get_network,
-    get_real_ip,
+    resolve_real_ip,
+    NetworkKey,
 )
 
 
 logger = logger.getChild('link_token')
+_log = LogThrottle(logger)
 
 
 PING_KEY = 'botdetection.link_token.PING_KEY'
@@ -94,7 +92,7 @@ def _cfg(name):
     return ctx.cfg.get(f'botdetection.link_token.{name}')
 
 
-def is_suspicious(network: IPv4Network | IPv6Network, request: flask.Request, renew: bool = False):
+def is_suspicious(network: NetworkKey, request: flask.Request, renew: bool = False):
     """Checks whether a valid ping is exists for this (client) network, if not
     this request is rated as *suspicious*.  If a valid ping exists and argument
     ``renew`` is ``True`` the expire time of this ping is reset to
@@ -106,13 +104,13 @@ def is_suspicious(network: IPv4Network | IPv6Network, request: flask.Request, re
 
     ping_key = get_ping_key(network, request)
     if not ctx.redis_client.get(ping_key):
-        logger.info("missing ping (IP: %s) / request: %s", network.compressed, ping_key)
+        _log.info("missing ping (IP: %s) / request: %s", network.name, ping_key, key=('missing ping', network.key))
         return True
 
     if renew:
         ctx.redis_client.set(ping_key, 1, ex=_cfg('PING_LIVE_TIME'))
 
-    logger.debug("found ping for (client) network %s -> %s", network.compressed, ping_key)
+    logger.debug("found ping for (client) network %s -> %s", network.name, ping_key)
     return False
 
 
@@ -127,26 +125,22 @@ def ping(request: flask.Request, token: str):
     if not token_is_valid(token):
         return
 
-    real_ip = ip_address(get_real_ip(request))
+    real_ip = resolve_real_ip(request)
     network = get_network(real_ip, ctx.cfg)
 
     ping_key = get_ping_key(network, request)
-    logger.debug("store ping_key for (client) network %s (IP %s) -> %s", network.compressed, real_ip, ping_key)
+    logger.debug("store ping_key for (client) network %s (IP %s) -> %s", network.name, real_ip, ping_key)
 
     ctx.redis_client.set(ping_key, 1, ex=_cfg('PING_LIVE_TIME'))
 
 
-def get_ping_key(network: IPv4Network | IPv6Network, request: flask.Request) -> str:
+def get_ping_key(network: NetworkKey, request: flask.Request) -> str | bytes:
     """Generates a hashed key that fits (more or less) to a *WEB-browser
     session* in a network."""
-    return (
-        PING_KEY
-        + "["
-        + secret_hash(
-            network.compressed + request.headers.get('Accept-Language', '') + request.headers.get('User-Agent', '')
-        )
-        + "]"
-    )
+    session = network.name + request.headers.get('Accept-Language', '') + request.headers.get('User-Agent', '')
+    if compact_keys():
+        return redis_key('ping', session)
+    return PING_KEY + "[" + secret_hash(session) + "]"
 
 
 def token_is_valid(token) -> bool:
@@ -0,0 +1,231 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.load_shedding:
+
+Load shedding
+-------------
+
+When the WEB application is saturated, the botdetection gets more aggressive
+and cheaper to run.  Each worker measures its request rate and the latency of
+its requests.  The application reports each request by :py:obj:`observe`
+(or :py:obj:`track`):
+
+.. code:: python
+
+   @app.before_request
+   def before():
+       flask.g.start = time.perf_counter()
+
+   @app.teardown_request
+   def teardown(exc):
+       load_shedding.observe(time.perf_counter() - flask.g.start)
+
+Every ``interval`` seconds the *load* is measured: the maximum of the ratios
+``rate / max_rate`` and ``latency / max_latency`` (the latency is the mean
+latency in the interval, both are smoothed).  The *shedding level* is raised
+if the load exceeds the threshold of the next level (``level1_load``,
+``level2_load``) and lowered if the load drops below ``hysteresis`` times the
+threshold of the current level.  A level is hold at least ``hold`` seconds.
+The levels are:
+
+``0``
+  Normal operation.
+
+``1``
+  The maxima of the ``BURST``, ``LONG`` and ``API`` windows of the
+  :py:obj:`.ip_limit` method are multiplied by ``tighten`` and the renewal of
+  a ping of the :py:obj:`.link_token` method (a roundtrip to the redis DB) is
+  skipped.
+
+``2``
+  The maxima are multiplied by ``tighten ** 2`` and, if ``strict_headers`` is
+  set, the header methods (``http_accept``, ``http_accept_encoding``,
+  ``http_accept_language``, ``http_connection`` and ``http_user_agent``) are
+  evaluated by the :py:obj:`.ip_limit` method before the request is counted
+  in the redis DB.
+
+The current level (and the measured load) is returned by :py:obj:`status`,
+e.g. for the metrics of the application.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.load_shedding]
+
+   # activate the load shedding
+   enabled = false
+
+   # budget of a worker: requests per second and mean latency (sec)
+   max_rate = 50
+   max_latency = 0.5
+
+   # load at which the levels 1 and 2 are entered
+   level1_load = 1.0
+   level2_load = 1.5
+
+   # a level is left when the load drops below this fraction of its threshold
+   hysteresis = 0.7
+
+   # time (sec) in which the load is measured and min. time (sec) of a level
+   interval = 1
+   hold = 10
+
+   # factor of the maxima of the ip_limit windows (per level)
+   tighten = 0.5
+
+   # evaluate the header methods in level 2
+   strict_headers = true
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Iterator, List
+
+from contextlib import contextmanager
+import threading
+import time
+
+from . import ctx
+from ._helpers import logger
+
+logger = logger.getChild('load_shedding')
+
+SMOOTHING = 0.5
+"""Weight of the last interval in the smoothed rate and latency."""
+
+
+class LoadShedder:
+    """Measures the load of a worker and determines the shedding level."""
+
+    # pylint: disable=too-many-instance-attributes, too-many-arguments, too-many-positional-arguments
+
+    def __init__(
+        self, max_rate: float, max_latency: float, levels: List[float], hysteresis: float, interval: float, hold: float
+    ):
+        self.max_rate = max_rate
+        self.max_latency = max_latency
+        self.levels = sorted(levels)
+        self.hysteresis = hysteresis
+        self.interval = interval
+        self.hold = hold
+        self.rate = 0.0
+        self.latency = 0.0
+        self.load = 0.0
+        self._level = 0
+        self._changed = 0.0
+        self._start = time.monotonic()
+        self._count = 0
+        self._latency_sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float):
+        """Counts a request with the ``latency`` (sec)."""
+        now = time.monotonic()
+        with self._lock:
+            self._count += 1
+            self._latency_sum += latency
+            if now - self._start >= self.interval:
+                self._update(now)
+
+    @property
+    def level(self) -> int:
+        """The current shedding level (``0``: normal operation)."""
+        now = time.monotonic()
+        if now - self._start >= self.interval:
+            with self._lock:
+                if now - self._start >= self.interval:
+                    self._update(now)
+        return self._level
+
+    def _update(self, now: float):
+        elapsed = now - self._start
+        rate = self._count / elapsed
+        latency = self._latency_sum / self._count if self._count else 0.0
+        self.rate = SMOOTHING * rate + (1 - SMOOTHING) * self.rate
+        self.latency = SMOOTHING * latency + (1 - SMOOTHING) * self.latency
+        self.load = max(self.rate / self.max_rate, self.latency / self.max_latency)
+        self._start = now
+        self._count = 0
+        self._latency_sum = 0.0
+
+        level = self._level
+        if now - self._changed < self.hold:
+            return
+        while level < len(self.levels) and self.load >= self.levels[level]:
+            level += 1
+        if level == self._level:
+            while level > 0 and self.load < self.hysteresis * self.levels[level - 1]:
+                level -= 1
+        if level != self._level:
+            logger.warning(
+                "shedding level %s -> %s (rate %.1f/s, latency %.3fs)", self._level, level, self.rate, self.latency
+            )
+            self._level = level
+            self._changed = now
+
+
+def _cfg(name):
+    return ctx.cfg.get(f'botdetection.load_shedding.{name}')
+
+
+def get_shedder() -> LoadShedder | None:
+    """Returns the :py:obj:`LoadShedder` of this worker in the current context
+    (``None`` if the load shedding is not enabled)."""
+    if not _cfg('enabled'):
+        return None
+    return ctx.state(
+        'load_shedding',
+        lambda: LoadShedder(
+            _cfg('max_rate'),
+            _cfg('max_latency'),
+            [_cfg('level1_load'), _cfg('level2_load')],
+            _cfg('hysteresis'),
+            _cfg('interval'),
+            _cfg('hold'),
+        ),
+    )
+
+
+def get_level() -> int:
+    """Returns the current shedding level of this worker (``0`` if the load
+    shedding is not enabled)."""
+    shedder = get_shedder()
+    if shedder is None:
+        return 0
+    return shedder.level
+
+
+def observe(latency: float):
+    """Counts a request of the application with the ``latency`` (sec)."""
+    shedder = get_shedder()
+    if shedder is not None:
+        shedder.observe(latency)
+
+
+@contextmanager
+def track() -> Iterator[None]:
+    """Measures the latency of the ``with`` block and counts it as a request
+    (see :py:obj:`observe`)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(time.perf_counter() - start)
+
+
+def status() -> dict:
+    """Returns the shedding level and the measured load of this worker."""
+    shedder = get_shedder()
+    if shedder is None:
+        return {'enabled': False, 'level': 0}
+    return {
+        'enabled': True,
+        'level': shedder.level,
+        'load': shedder.load,
+        'rate': shedder.rate,
+        'latency': shedder.latency,
+    }
@@ -0,0 +1,165 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.local_tier:
+
+Local tier
+----------
+
+The local tier is a per worker, in-memory first tier in front of the windows
+of the :py:obj:`.ip_limit` method in the redis DB.  Each worker has a small
+*quota* per network and window: ``share`` of the maximum of the window.  A
+request is counted locally (no roundtrip to the redis DB) if
+
+- the requests counted locally since the last sync are within the quota of
+  each window of the request and
+
+- the count of each window from the last sync plus the local requests is
+  below the maximum of the window and
+
+- the last sync is not older than ``sync_interval`` seconds (and not older
+  than the window).
+
+Otherwise the request and the locally counted requests are counted in the
+redis DB in one roundtrip and the counts from the redis DB are the new base of
+the local tier.  The locally counted requests have already been passed, they
+are charged to the windows on their own (:py:obj:`.redislib.WINDOW_CHARGE`),
+also if a window is exceeded (the token bucket and the GCRA take the tokens on
+credit) and the request is counted after them.  When the cache of the windows
+is full, the windows are dropped and their locally counted requests are
+charged in the same roundtrip.  The local tier never blocks a request, a
+request that might exceed a maximum is always evaluated by the redis DB.
+Windows with a quota below one request (e.g. the ``SUSPICIOUS`` windows) and
+the windows of the :py:obj:`.link_token` method always need a roundtrip.
+
+Error bound
+  The counts in the redis DB are behind by the locally counted requests, at
+  most ``share * maximum`` requests per worker and window.  With ``N`` workers
+  the global maximum of a window can be exceeded by ``(N - 1) * share *
+  maximum`` requests in the worst case (all workers count the requests of one
+  network at the same time).  A smaller ``share`` reduces the error and the
+  number of requests without a roundtrip.
+
+.. note::
+
+   The local tier is used by :py:func:`.ip_limit.evaluate`, a :ref:`batch
+   <botdetection.batch>` is always counted in the redis DB.
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.local_tier]
+
+   # activate the local tier
+   enabled = false
+
+   # quota of a worker: share of the maximum of a window
+   share = 0.2
+
+   # max. time (sec) between two syncs of a window with the redis DB
+   sync_interval = 10
+
+   # maximum number of windows in the local tier of a worker
+   cache_size = 65536
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, List
+
+import threading
+import time
+
+from . import ctx
+from .limiter import Limiter
+from .redislib import WINDOW_BLOCK, WINDOW_CHARGE, WINDOW_COUNT
+
+
+class _State:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('window', 'count', 'pending', 'synced')
+
+    def __init__(self, window, count: int, synced: float, pending: int = 0):
+        self.window = window
+        self.count = count
+        self.pending = pending
+        self.synced = synced
+
+
+class LocalTier:
+    """Local counts of the windows in a worker."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, share: float, sync_interval: float, cache_size: int):
+        self.share = share
+        self.sync_interval = sync_interval
+        self.cache_size = cache_size
+        self._states: Dict[str, _State] = {}
+        self._lock = threading.Lock()
+
+    def _count_local(self, windows, now: float) -> List[int] | None:
+        states = []
+        for window in windows:
+            if window.mode not in (WINDOW_BLOCK, WINDOW_COUNT):
+                return None
+            state = self._states.get(window.name)
+            if state is None or now - state.synced > min(self.sync_interval, window.duration):
+                return None
+            if state.pending + window.weight > self.share * window.maximum:
+                return None
+            if state.count + state.pending + window.weight > window.maximum:
+                return None
+            states.append(state)
+        counts = []
+        for window, state in zip(windows, states):
+            state.pending += window.weight
+            counts.append(state.count + state.pending)
+        return counts
+
+    def incr_windows(self, limiter: Limiter, client, windows) -> List[int]:
+        """Counts a request in the ``windows`` (see :py:obj:`.ip_limit.Window`),
+        locally or in the redis DB."""
+
+        now = time.monotonic()
+        with self._lock:
+            counts = self._count_local(windows, now)
+            if counts is not None:
+                return counts
+            charges = []
+            for window in windows:
+                state = self._states.get(window.name)
+                if state is not None and state.pending:
+                    charges.append(window._replace(mode=WINDOW_CHARGE, weight=state.pending))
+                    state.pending = 0
+            if len(self._states) + len(windows) > self.cache_size:
+                # the local requests of the dropped windows are charged
+                for state in self._states.values():
+                    if state.pending:
+                        charges.append(state.window._replace(mode=WINDOW_CHARGE, weight=state.pending))
+                self._states.clear()
+
+        counts = limiter.incr_windows(client, charges + list(windows))[len(charges) :]
+
+        with self._lock:
+            for window, count in zip(windows, counts):
+                # requests counted locally by other threads in the meantime are
+                # not in the count from the redis DB
+                state = self._states.get(window.name)
+                self._states[window.name] = _State(window, count, now, state.pending if state else 0)
+        return counts
+
+def _cfg(name):
+    return ctx.cfg.get(f'botdetection.local_tier.{name}')
+
+
+def get_local_tier() -> LocalTier | None:
+    """Returns the :py:obj:`LocalTier` of this worker in the current context
+    (``None`` if the local tier is not enabled)."""
+
+    if not _cfg('enabled'):
+        return None
+    return ctx.state('local_tier', lambda: LocalTier(_cfg('share'), _cfg('sync_interval'), _cfg('cache_size')))
@@ -0,0 +1,159 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.log_throttle:
+
+Log throttle
+------------
+
+Diagnostic messages on the hot paths (e.g. inconsistent proxy headers in
+:py:obj:`.get_real_ip` or a missing ping in :py:obj:`.link_token`) can occur
+on every request.  A :py:obj:`LogThrottle` logs the first occurrence of a
+message and aggregates the repeated occurrences into a periodic summary:
+
+.. code:: text
+
+   X-Real-IP header is not set!
+   ...
+   X-Real-IP header is not set! (1234 more occurrences in last 60s)
+
+Messages are aggregated by their format string (not by the arguments), the
+summary shows the arguments of the last occurrence.  A message whose arguments
+matter (e.g. the network of a block) is aggregated by a ``key`` which contains
+these arguments.  The number of aggregated messages is limited
+(:py:obj:`MAX_KEYS`), the message that has been logged first is summarized and
+dropped if the limit is reached.  The summaries of the last interval are
+logged at exit of the interpreter (:py:obj:`LogThrottle.flush`).  If the level
+of a message is not enabled in the logger, the message costs a single
+:py:obj:`logging.Logger.isEnabledFor` call.
+
+.. code:: python
+
+   from .log_throttle import LogThrottle
+
+   log = LogThrottle(logger)
+   log.warning("IP from X-Real-IP (%s) is not equal to the client IP (%s)", real_ip, client_ip)
+   log.error("BLOCK %s: %s", network.name, reason, key=(network.key, reason))
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, Hashable, List, Tuple
+
+import atexit
+import logging
+import threading
+import time
+
+INTERVAL = 60
+"""Time (sec) in which repeated messages are aggregated into one summary."""
+
+MAX_KEYS = 1024
+"""Maximum number of messages aggregated by a :py:obj:`LogThrottle`."""
+
+
+class _Entry:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('level', 'msg', 'args', 'start', 'count')
+
+    def __init__(self, level: int, msg: str, args: tuple, start: float):
+        self.level = level
+        self.msg = msg
+        self.args = args
+        self.start = start
+        self.count = 0
+
+
+class LogThrottle:
+    """Logs the first occurrence of a message to the ``logger`` and the number
+    of the repeated occurrences in a summary every ``interval`` seconds (and at
+    exit of the interpreter)."""
+
+    def __init__(self, logger: logging.Logger, interval: float = INTERVAL, max_keys: int = MAX_KEYS):
+        self.logger = logger
+        self.interval = interval
+        self.max_keys = max_keys
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def debug(self, msg: str, *args, key: Hashable | None = None):
+        """Logs ``msg % args`` with level DEBUG, see :py:obj:`log`."""
+        self._log(logging.DEBUG, msg, args, key)
+
+    def info(self, msg: str, *args, key: Hashable | None = None):
+        """Logs ``msg % args`` with level INFO, see :py:obj:`log`."""
+        self._log(logging.INFO, msg, args, key)
+
+    def warning(self, msg: str, *args, key: Hashable | None = None):
+        """Logs ``msg % args`` with level WARNING, see :py:obj:`log`."""
+        self._log(logging.WARNING, msg, args, key)
+
+    def error(self, msg: str, *args, key: Hashable | None = None):
+        """Logs ``msg % args`` with level ERROR, see :py:obj:`log`."""
+        self._log(logging.ERROR, msg, args, key)
+
+    def log(self, level: int, msg: str, *args, key: Hashable | None = None):
+        """Logs ``msg % args`` if it is the first occurrence of the message in
+        the interval, otherwise the occurrence is counted.  The message is
+        identified by the ``key`` (default: the level and the format string
+        ``msg``)."""
+        self._log(level, msg, args, key)
+
+    def flush(self):
+        """Logs the summaries of all messages with repeated occurrences and
+        resets the throttle."""
+        now = time.monotonic()
+        with self._lock:
+            summaries = [self._summary(entry, now) for entry in self._entries.values() if entry.count]
+            self._entries.clear()
+        self._emit(summaries)
+
+    def _log(self, level: int, msg: str, args: tuple, key: Hashable | None):
+        if not self.logger.isEnabledFor(level):
+            return
+        if key is None:
+            key = (level, msg)
+        now = time.monotonic()
+        summaries = []
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now, summaries)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.count += 1
+                entry.args = args
+            else:
+                if len(self._entries) >= self.max_keys:
+                    oldest = self._entries.pop(next(iter(self._entries)))
+                    if oldest.count:
+                        summaries.append(self._summary(oldest, now))
+                self._entries[key] = _Entry(level, msg, args, now)
+        self._emit(summaries)
+        if entry is None:
+            self.logger.log(level, msg, *args, stacklevel=3)
+
+    def _sweep(self, now: float, summaries: List[Tuple[int, str, tuple]]):
+        # summarize the messages of the last interval, drop messages that have
+        # not been repeated
+        self._next_sweep = now + self.interval
+        for key, entry in list(self._entries.items()):
+            if now - entry.start < self.interval:
+                continue
+            if entry.count:
+                summaries.append(self._summary(entry, now))
+                entry.start = now
+                entry.count = 0
+            else:
+                del self._entries[key]
+
+    @staticmethod
+    def _summary(entry: _Entry, now: float) -> Tuple[int, str, tuple]:
+        text = entry.msg % entry.args if entry.args else entry.msg
+        return (entry.level, "%s (%d more occurrences in last %ds)", (text, entry.count, now - entry.start))
+
+    def _emit(self, summaries: List[Tuple[int, str, tuple]]):
+        for level, msg, args in summaries:
+            self.logger.log(level, msg, *args)
@@ -0,0 +1,995 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.memredis:
+
+In-memory redis
+---------------
+
+:py:obj:`MemRedis` is an in-process stand-in of the :py:obj:`redis.Redis`
+client for tests, benchmarks and a single process setup (development), no
+redis server is needed:
+
+.. code:: python
+
+   from botdetection import ctx
+   from botdetection.memredis import MemRedis
+
+   ctx.init(toml_cfg, MemRedis())
+
+The lua scripts of the :py:obj:`.redislib` (:py:obj:`.redislib.INCR_COUNTER`,
+:py:obj:`.redislib.INCR_SLIDING_WINDOW`, :py:obj:`.redislib.INCR_TOKEN_BUCKET`,
+:py:obj:`.redislib.INCR_GCRA`, :py:obj:`.redislib.INCR_WINDOWS`,
+:py:obj:`.redislib.INCR_DISTINCT`, :py:obj:`.redislib.APPEND_LOG` and
+:py:obj:`.redislib.PURGE_BY_PREFIX`) are implemented in python with the same
+semantic as the lua scripts (:py:obj:`SCRIPTS`), the other commands are the
+subset of the redis commands used by the botdetection (strings, hashes, sets,
+sorted sets, HyperLogLogs, expire times, SCAN, pipelines and PUBLISH /
+SUBSCRIBE).  The values are
+returned as in redis-py (``bytes``, no ``decode_responses``) and an operation
+on a key of the wrong type raises a :py:obj:`redis.ResponseError`.
+
+The clock of the stand-in (TIME, expire times) is injectable, e.g. a
+:py:obj:`ManualClock` that is set to the time of a log line in the
+:ref:`replay <botdetection.replay>`:
+
+.. code:: python
+
+   clock = ManualClock()
+   client = MemRedis(clock=clock)
+   clock.set(1700000000)
+
+Differences to a redis server:
+
+- A HyperLogLog counts exact (a set of the values), redis estimates the count
+  with a standard error of 0.81%.
+
+- Patterns (SCAN, KEYS and :py:obj:`.redislib.PURGE_BY_PREFIX`) are matched
+  by :py:obj:`fnmatch.fnmatchcase`.
+
+- MEMORY USAGE is a rough estimate of the size of the python objects.
+
+- There is only one database in a process, the clients do not share their
+  data (not even in a fork of the process).
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import bisect
+import datetime
+import fnmatch
+import functools
+import math
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+import redis
+
+from . import redislib
+
+_WEIGHT = re.compile(rb':(\d+)$')
+
+_WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+class ManualClock:
+    """A clock that is set (or advanced) by the caller."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def set(self, now: float):
+        """Sets the clock to timestamp ``now``."""
+        self.now = now
+
+    def advance(self, seconds: float):
+        """Advances the clock by ``seconds``."""
+        self.now += seconds
+
+
+class _Top:
+    """Sentinel that is greater than any member of a sorted set."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_TOP = _Top()
+
+
+class _ZSet:
+    """Sorted set: the score of the members and a list of the ``(score,
+    member)`` items in the order of redis (score, then member)."""
+
+    __slots__ = ('scores', 'items')
+
+    def __init__(self):
+        self.scores: Dict[bytes, float] = {}
+        self.items: List[Tuple[float, bytes]] = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self, member: bytes, score: float) -> bool:
+        """Adds ``member`` or updates its score, returns ``True`` if the member
+        is new."""
+        old = self.scores.get(member)
+        if old == score:
+            return False
+        if old is not None:
+            del self.items[bisect.bisect_left(self.items, (old, member))]
+        self.scores[member] = score
+        item = (score, member)
+        if not self.items or item > self.items[-1]:
+            # items of a sliding window are added in the order of the time
+            self.items.append(item)
+        else:
+            bisect.insort(self.items, item)
+        return old is None
+
+    def remove(self, member: bytes) -> bool:
+        """Removes ``member``, returns ``True`` if the member existed."""
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        del self.items[bisect.bisect_left(self.items, (score, member))]
+        return True
+
+    def index(self, lo, hi) -> Tuple[int, int]:
+        """Returns the slice of the items in the score range ``lo`` to ``hi``
+        (``(score, exclusive)`` tuples, see :py:func:`_score_bound`)."""
+        (lo, lo_excl), (hi, hi_excl) = lo, hi
+        i = bisect.bisect_right(self.items, (lo, _TOP)) if lo_excl else bisect.bisect_left(self.items, (lo,))
+        j = bisect.bisect_left(self.items, (hi,)) if hi_excl else bisect.bisect_right(self.items, (hi, _TOP))
+        return i, max(i, j)
+
+    def remove_range(self, lo, hi) -> int:
+        """Removes the items in the score range ``lo`` to ``hi``."""
+        i, j = self.index(lo, hi)
+        for _, member in self.items[i:j]:
+            del self.scores[member]
+        del self.items[i:j]
+        return j - i
+
+
+class _HyperLogLog(set):
+    """HyperLogLog stand-in, the values are counted exact."""
+
+
+def _key(name) -> bytes:
+    if isinstance(name, bytes):
+        return name
+    if isinstance(name, (bytearray, memoryview)):
+        return bytes(name)
+    return str(name).encode()
+
+
+def _value(value) -> bytes:
+    """Encodes a value like the encoder of redis-py."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, bool):
+        raise redis.DataError("Invalid input of type: 'bool'. Convert to a bytes, string, int or float first.")
+    if isinstance(value, (int, float)):
+        return repr(value).encode()
+    raise redis.DataError(f"Invalid input of type: '{type(value).__name__}'.")
+
+
+def _arg(value) -> str:
+    """An argument of a lua script (a lua string)."""
+    if isinstance(value, str):
+        return value
+    if type(value) is int:  # pylint: disable=unidiomatic-typecheck
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'surrogateescape')
+    return _value(value).decode()
+
+
+def _tonumber(value) -> float | None:
+    """Lua's ``tonumber``: the number of a string or ``None``."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _lua_number(value: float) -> bytes:
+    """A lua number as argument of a redis command, integral numbers have no
+    fraction."""
+    if value == int(value) and abs(value) < 2**53:
+        return str(int(value)).encode()
+    return repr(float(value)).encode()
+
+
+def _score_bound(value) -> Tuple[float, bool]:
+    """Score range argument of ZRANGEBYSCORE (``-inf``, ``+inf`` or ``(``
+    for an exclusive bound) as tuple ``(score, exclusive)``."""
+    value = _arg(value)
+    exclusive = value.startswith('(')
+    if exclusive:
+        value = value[1:]
+    try:
+        return float(value), exclusive
+    except ValueError as exc:
+        raise redis.ResponseError("min or max is not a float") from exc
+
+
+def _seconds(value) -> float:
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return int(value)
+
+
+def _command(func):
+    """Decorator of a command: runs the command with the lock of the
+    client."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:  # pylint: disable=protected-access
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class MemRedis:
+    """In-memory stand-in of the :py:obj:`redis.Redis` client.
+
+    :param clock: function that returns the current time (sec), default
+      :py:obj:`time.time`.
+    """
+
+    # the commands are documented in redis-py
+    # pylint: disable=too-many-public-methods, missing-function-docstring
+
+    SWEEP_INTERVAL = 300
+    """Interval (sec) of the clock in which the expired keys are dropped (an
+    expired key is also dropped when it is accessed)."""
+
+    def __init__(self, clock: Callable[[], float] | None = None):
+        self.clock = clock or time.time
+        self._data: Dict[bytes, Any] = {}
+        self._expire: Dict[bytes, float] = {}
+        self._subscribers: Dict[bytes, List[MemPubSub]] = {}
+        self._last_sweep = 0.0
+        self._now = 0.0
+        self._lock = threading.RLock()
+
+    # internals
+
+    def _time(self) -> float:
+        now = self._now = self.clock()
+        if now - self._last_sweep > self.SWEEP_INTERVAL:
+            for name in [n for n, exp in self._expire.items() if exp < now]:
+                self._drop(name)
+            self._last_sweep = now
+        return now
+
+    def _drop(self, name: bytes) -> bool:
+        self._expire.pop(name, None)
+        return self._data.pop(name, None) is not None
+
+    def _lookup(self, name: bytes, kind=None):
+        """Returns the value of key ``name`` (``None`` if the key does not exist
+        or has expired), the type of the value must be ``kind``."""
+        now = self._time()
+        exp = self._expire.get(name)
+        if exp is not None and exp < now:
+            self._drop(name)
+            return None
+        value = self._data.get(name)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise redis.ResponseError(_WRONGTYPE)
+        return value
+
+    def _create(self, name: bytes, kind):
+        value = self._lookup(name, kind)
+        if value is None:
+            value = self._data[name] = kind()
+        return value
+
+    def _set_expire(self, name: bytes, seconds: float) -> bool:
+        if self._lookup(name) is None:
+            return False
+        if seconds <= 0:
+            self._drop(name)
+        else:
+            self._expire[name] = self._now + seconds
+        return True
+
+    def _cleanup(self, name: bytes):
+        """Drops an empty hash, set or sorted set (like redis does)."""
+        if not self._data.get(name, True):
+            self._drop(name)
+
+    def _match(self, match) -> Callable[[bytes], bool]:
+        if match is None:
+            return lambda name: True
+        pattern = _key(match)
+        return lambda name: fnmatch.fnmatchcase(name, pattern)  # type: ignore
+
+    # connection
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+    def time(self) -> Tuple[int, int]:
+        return divmod(int(self.clock() * 1000000), 1000000)  # type: ignore
+
+    def register_script(self, script: str) -> MemScript:
+        """Returns the :py:obj:`MemScript` of a lua ``script`` from
+        :py:obj:`SCRIPTS`."""
+        func = SCRIPTS.get(script)
+        if func is None:
+            raise NotImplementedError("lua script is not implemented by the in-memory redis")
+        return MemScript(self, func)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> MemPipeline:
+        # pylint: disable=unused-argument
+        return MemPipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> MemPubSub:
+        return MemPubSub(self, ignore_subscribe_messages)
+
+    @_command
+    def publish(self, channel, message) -> int:
+        channel = _key(channel)
+        subscribers = list(self._subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.put({'type': 'message', 'pattern': None, 'channel': channel, 'data': _value(message)})
+        return len(subscribers)
+
+    # keys
+
+    @_command
+    def delete(self, *names) -> int:
+        return sum(self._lookup(_key(name)) is not None and self._drop(_key(name)) for name in names)
+
+    @_command
+    def exists(self, *names) -> int:
+        return sum(self._lookup(_key(name)) is not None for name in names)
+
+    @_command
+    def expire(self, name, time) -> bool:  # pylint: disable=redefined-outer-name
+        self._time()
+        return self._set_expire(_key(name), _seconds(time))
+
+    @_command
+    def pexpire(self, name, time) -> bool:  # pylint: disable=redefined-outer-name
+        self._time()
+        return self._set_expire(_key(name), _seconds(time) / 1000)
+
+    @_command
+    def pttl(self, name) -> int:
+        name = _key(name)
+        if self._lookup(name) is None:
+            return -2
+        exp = self._expire.get(name)
+        if exp is None:
+            return -1
+        return int(round((exp - self._now) * 1000))
+
+    def ttl(self, name) -> int:
+        ms = self.pttl(name)
+        return ms if ms < 0 else (ms + 500) // 1000
+
+    @_command
+    def type(self, name) -> bytes:
+        value = self._lookup(_key(name))
+        if value is None:
+            return b'none'
+        if isinstance(value, (bytes, _HyperLogLog)):
+            return b'string'
+        if isinstance(value, _ZSet):
+            return b'zset'
+        if isinstance(value, dict):
+            return b'hash'
+        return b'set'
+
+    @_command
+    def scan(self, cursor: int = 0, match=None, count: int | None = None, _type=None) -> Tuple[int, List[bytes]]:
+        """Like SCAN_, the cursor is the position in the (insertion ordered)
+        keys: keys that are deleted while scanning may shift other keys out of
+        the scan.
+
+        .. _SCAN: https://redis.io/commands/scan/
+        """
+        names = list(self._data)
+        count = count or 10
+        end = cursor + count
+        is_match = self._match(match)
+        keys = [n for n in names[cursor:end] if is_match(n) and self._lookup(n) is not None]
+        if _type is not None:
+            keys = [n for n in keys if self.type(n) == _key(_type)]
+        return (end if end < len(names) else 0), keys
+
+    def scan_iter(self, match=None, count: int | None = None, _type=None) -> Iterator[bytes]:
+        cursor = 0
+        while True:
+            cursor, keys = self.scan(cursor, match=match, count=count, _type=_type)
+            yield from keys
+            if not cursor:
+                break
+
+    @_command
+    def keys(self, pattern='*') -> List[bytes]:
+        is_match = self._match(pattern)
+        return [n for n in list(self._data) if is_match(n) and self._lookup(n) is not None]
+
+    @_command
+    def dbsize(self) -> int:
+        return len(self._data)
+
+    @_command
+    def randomkey(self) -> bytes | None:
+        if not self._data:
+            return None
+        return random.choice(list(self._data))
+
+    @_command
+    def flushdb(self) -> bool:
+        self._data.clear()
+        self._expire.clear()
+        return True
+
+    flushall = flushdb
+
+    @_command
+    def memory_usage(self, key, samples=None) -> int | None:
+        # pylint: disable=unused-argument
+        value = self._lookup(_key(key))
+        if value is None:
+            return None
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, _ZSet):
+            size += sum(sys.getsizeof(m) + 24 for m in value.scores)
+        elif isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        elif isinstance(value, set):
+            size += sum(sys.getsizeof(v) for v in value)
+        return size
+
+    # strings
+
+    @_command
+    def get(self, name) -> bytes | None:
+        value = self._lookup(_key(name), (bytes, _HyperLogLog))
+        if isinstance(value, _HyperLogLog):
+            return b'HYLL'
+        return value
+
+    @_command
+    def mget(self, keys, *args) -> List[bytes | None]:
+        names = [keys] if isinstance(keys, (bytes, str)) else list(keys)
+        values = [self._lookup(_key(name)) for name in names + list(args)]
+        return [v if isinstance(v, bytes) else None for v in values]
+
+    @_command
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False) -> bool | None:
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        name = _key(name)
+        exists = self._lookup(name) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        seconds = None
+        if ex is not None:
+            seconds = _seconds(ex)
+        elif px is not None:
+            seconds = _seconds(px) / 1000
+        if seconds is not None and seconds <= 0:
+            raise redis.ResponseError("invalid expire time in 'set' command")
+        self._data[name] = _value(value)
+        if seconds is not None:
+            self._expire[name] = self._now + seconds
+        elif not keepttl:
+            self._expire.pop(name, None)
+        return True
+
+    @_command
+    def incrby(self, name, amount: int = 1) -> int:
+        name = _key(name)
+        value = self._lookup(name, bytes)
+        try:
+            value = int(value or 0) + int(amount)
+        except ValueError as exc:
+            raise redis.ResponseError("value is not an integer or out of range") from exc
+        self._data[name] = str(value).encode()
+        return value
+
+    incr = incrby
+
+    # hashes
+
+    @_command
+    def hset(self, name, key=None, value=None, mapping=None) -> int:
+        name = _key(name)
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        hsh = self._create(name, dict)
+        added = 0
+        for k, v in items.items():
+            k = _key(k)
+            added += k not in hsh
+            hsh[k] = _value(v)
+        return added
+
+    @_command
+    def hget(self, name, key) -> bytes | None:
+        return (self._lookup(_key(name), dict) or {}).get(_key(key))
+
+    @_command
+    def hmget(self, name, keys, *args) -> List[bytes | None]:
+        hsh = self._lookup(_key(name), dict) or {}
+        keys = [keys] if isinstance(keys, (bytes, str)) else list(keys)
+        return [hsh.get(_key(k)) for k in keys + list(args)]
+
+    @_command
+    def hgetall(self, name) -> Dict[bytes, bytes]:
+        return dict(self._lookup(_key(name), dict) or {})
+
+    # sets
+
+    @_command
+    def sadd(self, name, *values) -> int:
+        members = self._create(_key(name), set)
+        size = len(members)
+        members.update(_value(v) for v in values)
+        return len(members) - size
+
+    @_command
+    def scard(self, name) -> int:
+        return len(self._lookup(_key(name), set) or ())
+
+    @_command
+    def smembers(self, name) -> set:
+        return set(self._lookup(_key(name), set) or ())
+
+    # HyperLogLogs
+
+    @_command
+    def pfadd(self, name, *values) -> int:
+        hll = self._create(_key(name), _HyperLogLog)
+        size = len(hll)
+        hll.update(_value(v) for v in values)
+        return int(len(hll) > size or not values)
+
+    @_command
+    def pfcount(self, *sources) -> int:
+        union: set = set()
+        for name in sources:
+            union.update(self._lookup(_key(name), _HyperLogLog) or ())
+        return len(union)
+
+    # sorted sets
+
+    @_command
+    def zadd(self, name, mapping, nx=False, xx=False, ch=False, incr=False, gt=False, lt=False) -> int | float | None:
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        if incr:
+            (member, score), = mapping.items()
+            return self.zincrby(name, score, member)
+        name = _key(name)
+        zset = self._lookup(name, _ZSet)
+        if zset is None and xx:
+            return 0
+        zset = zset if zset is not None else self._create(name, _ZSet)
+        added = changed = 0
+        for member, score in mapping.items():
+            member, score = _value(member), float(score)
+            old = zset.scores.get(member)
+            if (old is None and xx) or (old is not None and nx):
+                continue
+            if old is not None and ((gt and score <= old) or (lt and score >= old)):
+                continue
+            added += old is None
+            changed += old != score
+            zset.add(member, score)
+        self._cleanup(name)
+        return changed if ch else added
+
+    @_command
+    def zincrby(self, name, amount, value) -> float:
+        zset = self._create(_key(name), _ZSet)
+        member = _value(value)
+        score = zset.scores.get(member, 0.0) + float(amount)
+        zset.add(member, score)
+        return score
+
+    @_command
+    def zscore(self, name, value) -> float | None:
+        return (self._lookup(_key(name), _ZSet) or _ZSet()).scores.get(_value(value))
+
+    @_command
+    def zrem(self, name, *values) -> int:
+        name = _key(name)
+        zset = self._lookup(name, _ZSet)
+        if zset is None:
+            return 0
+        removed = sum(zset.remove(_value(v)) for v in values)
+        self._cleanup(name)
+        return removed
+
+    @_command
+    def zcard(self, name) -> int:
+        return len(self._lookup(_key(name), _ZSet) or ())
+
+    @_command
+    def zcount(self, name, min, max) -> int:  # pylint: disable=redefined-builtin
+        zset = self._lookup(_key(name), _ZSet)
+        if zset is None:
+            return 0
+        i, j = zset.index(_score_bound(min), _score_bound(max))
+        return j - i
+
+    @_command
+    def zrangebyscore(self, name, min, max, start=None, num=None, withscores=False, score_cast_func=float) -> list:
+        # pylint: disable=too-many-arguments, too-many-positional-arguments, redefined-builtin
+        zset = self._lookup(_key(name), _ZSet)
+        if zset is None:
+            return []
+        i, j = zset.index(_score_bound(min), _score_bound(max))
+        items = zset.items[i:j]
+        if start is not None and num is not None:
+            items = items[start:] if num < 0 else items[start : start + num]
+        if withscores:
+            return [(m, score_cast_func(s)) for s, m in items]
+        return [m for _, m in items]
+
+    @_command
+    def zremrangebyscore(self, name, min, max) -> int:  # pylint: disable=redefined-builtin
+        name = _key(name)
+        zset = self._lookup(name, _ZSet)
+        if zset is None:
+            return 0
+        removed = zset.remove_range(_score_bound(min), _score_bound(max))
+        self._cleanup(name)
+        return removed
+
+    @_command
+    def zunion(self, keys, aggregate=None, withscores=False) -> list:
+        agg = {None: sum, 'SUM': sum, 'MIN': min, 'MAX': max}[aggregate and aggregate.upper()]
+        scores: Dict[bytes, List[float]] = {}
+        for name in keys:
+            for member, score in (self._lookup(_key(name), _ZSet) or _ZSet()).scores.items():
+                scores.setdefault(member, []).append(score)
+        items = sorted((agg(s), m) for m, s in scores.items())
+        if withscores:
+            return [(m, s) for s, m in items]
+        return [m for _, m in items]
+
+
+class MemScript:
+    """A lua script of a :py:obj:`MemRedis` client (see
+    :py:obj:`redis.commands.core.Script`), the script is implemented by the
+    python function ``func(client, keys, args)``."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, client: MemRedis, func: Callable):
+        self.registered_client = client
+        self.func = func
+
+    def __call__(self, keys=None, args=None, client=None):
+        keys = [_key(k) for k in keys or ()]
+        args = [_arg(a) for a in args or ()]
+        if isinstance(client, MemPipeline):
+            client.queue(self._run, keys, args)
+            return client
+        return self._run(keys, args)
+
+    def _run(self, keys, args):
+        client = self.registered_client
+        with client._lock:  # pylint: disable=protected-access
+            return self.func(client, keys, args)
+
+
+class MemPipeline:
+    """A pipeline of a :py:obj:`MemRedis` client, the commands are queued and
+    executed by :py:obj:`MemPipeline.execute`."""
+
+    # pylint: disable=missing-function-docstring
+
+    def __init__(self, client: MemRedis):
+        self.client = client
+        self._queue: List[Callable] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __bool__(self):
+        # like redis-py: an (empty) pipeline is always true
+        return True
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def queue_command(*args, **kwargs):
+            return self.queue(command, *args, **kwargs)
+
+        return queue_command
+
+    def queue(self, func: Callable, *args, **kwargs) -> MemPipeline:
+        self._queue.append(functools.partial(func, *args, **kwargs))
+        return self
+
+    def reset(self):
+        self._queue = []
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        """Executes the queued commands and returns the list of the results,
+        like in redis-py the first error is raised after all commands have
+        been executed."""
+        commands, self._queue = self._queue, []
+        results: list = []
+        with self.client._lock:  # pylint: disable=protected-access
+            for command in commands:
+                try:
+                    results.append(command())
+                except redis.ResponseError as exc:
+                    results.append(exc)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, redis.ResponseError):
+                    raise result
+        return results
+
+
+class MemPubSub:
+    """PUBLISH / SUBSCRIBE of a :py:obj:`MemRedis` client, the messages
+    are delivered to the subscribers in the process."""
+
+    # pylint: disable=missing-function-docstring
+
+    def __init__(self, client: MemRedis, ignore_subscribe_messages: bool = False):
+        self.client = client
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels: List[bytes] = []
+        self._messages: queue.Queue = queue.Queue()
+
+    def put(self, message: dict):
+        self._messages.put(message)
+
+    def subscribe(self, *channels):
+        with self.client._lock:  # pylint: disable=protected-access
+            for channel in (_key(c) for c in channels):
+                if channel in self.channels:
+                    continue
+                self.channels.append(channel)
+                self.client._subscribers.setdefault(channel, []).append(self)  # pylint: disable=protected-access
+                if not self.ignore_subscribe_messages:
+                    self.put({'type': 'subscribe', 'pattern': None, 'channel': channel, 'data': len(self.channels)})
+
+    def unsubscribe(self, *channels):
+        with self.client._lock:  # pylint: disable=protected-access
+            for channel in [_key(c) for c in channels] or list(self.channels):
+                subscribers = self.client._subscribers.get(channel, [])  # pylint: disable=protected-access
+                if self in subscribers:
+                    subscribers.remove(self)
+                if channel in self.channels:
+                    self.channels.remove(channel)
+
+    def get_message(self, ignore_subscribe_messages: bool = False, timeout: float | None = 0.0) -> dict | None:
+        try:
+            if timeout is not None and timeout <= 0:
+                message = self._messages.get_nowait()
+            else:
+                message = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if message['type'] != 'message' and (ignore_subscribe_messages or self.ignore_subscribe_messages):
+            return None
+        return message
+
+    def close(self):
+        self.unsubscribe()
+
+    reset = close
+
+
+# lua scripts of the redislib
+
+# pylint: disable=protected-access
+
+
+def _redis_time(client: MemRedis) -> Tuple[int, int]:
+    now = client._time()
+    return divmod(int(now * 1000000), 1000000)  # type: ignore
+
+
+def _sliding_window(client: MemRedis, name: bytes, expire: float, weight: float, member: str | None) -> int:
+    # pylint: disable=too-many-arguments, too-many-locals
+    sec, usec = _redis_time(client)
+    zset = client._create(name, _ZSet)
+    extra_name = name + redislib.EXTRA_WEIGHTS
+    extra = _tonumber(client._lookup(extra_name, bytes))
+    if extra is not None:
+        i, j = zset.index((0, False), (sec - expire, False))
+        for _, item in zset.items[i:j]:
+            weighted = _WEIGHT.search(item)
+            if weighted:
+                extra -= int(weighted.group(1)) - 1
+        extra = max(0, extra)
+    zset.remove_range((0, False), (sec - expire, False))
+    suffix = b''
+    if weight > 1:
+        suffix = b':%d' % weight
+        extra = (extra or 0) + weight - 1
+    if member == '':
+        m = sec * 1000000 + usec
+        # ZADD NX: an item which already exists is incremented
+        while b'%d' % m + suffix in zset.scores:
+            m += 1
+        zset.add(b'%d' % m + suffix, sec)
+    else:
+        zset.add(f"{sec}{usec}{member or ''}".encode() + suffix, sec)
+    client._set_expire(name, expire)
+    if extra is not None:
+        client._data[extra_name] = _lua_number(extra)
+        client._expire[extra_name] = client._now + expire
+    i, j = zset.index((0, False), (sec + 1, False))
+    return j - i + int(extra or 0)
+
+
+def _token_bucket(
+    client: MemRedis, name: bytes, duration: float, maximum: float, weight: float, force: bool = False
+) -> int:
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    duration = duration * 1000
+    sec, usec = _redis_time(client)
+    now = sec * 1000 + usec // 1000
+    bucket = client._lookup(name, dict) or {}
+    tokens = _tonumber(bucket.get(b'tokens'))
+    tokens = maximum if tokens is None else tokens
+    ts = _tonumber(bucket.get(b'ts'))
+    ts = now if ts is None else ts
+    tokens = min(maximum, tokens + (now - ts) * maximum / duration)
+
+    result = math.ceil(maximum - tokens) + weight
+    if force or tokens >= weight:
+        tokens = tokens - weight
+        result = math.ceil(maximum - tokens)
+    bucket = client._create(name, dict)
+    bucket[b'tokens'] = _lua_number(tokens)
+    bucket[b'ts'] = _lua_number(now)
+    client._set_expire(name, max(duration, math.ceil((maximum - tokens) * duration / maximum)) / 1000)
+    return int(result)
+
+
+def _gcra(
+    client: MemRedis, name: bytes, duration: float, maximum: float, weight: float, force: bool = False
+) -> int:
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    duration = duration * 1000000
+    sec, usec = _redis_time(client)
+    now = sec * 1000000 + usec
+    interval = duration / maximum
+
+    tat = _tonumber(client._lookup(name, bytes))
+    if tat is None or tat < now:
+        tat = now
+    tat = math.floor(tat + weight * interval)
+
+    result = math.ceil((tat - now) / interval)
+    if force or result <= maximum:
+        px = math.ceil((tat - now) / 1000)
+        if px <= 0:
+            raise redis.ResponseError("invalid expire time in 'set' command")
+        client._data[name] = _lua_number(tat)
+        client._expire[name] = client._now + px / 1000
+    return int(result)
+
+
+def _incr_counter(client: MemRedis, keys, args) -> int:
+    limit, expire = _tonumber(args[0]), _tonumber(args[1])
+    name = keys[0]
+    c = client._lookup(name, bytes)
+    if c is None:
+        c = client.incrby(name)
+        if expire > 0:  # type: ignore
+            client._set_expire(name, expire)  # type: ignore
+    else:
+        c = int(c)
+        if limit == 0 or c < limit:  # type: ignore
+            c = client.incrby(name)
+    return c
+
+
+def _incr_sliding_window(client: MemRedis, keys, args) -> int:
+    weight = _tonumber(args[1]) if len(args) > 1 else None
+    return _sliding_window(client, keys[0], _tonumber(args[0]), weight or 1, args[2] if len(args) > 2 else None)  # type: ignore
+
+
+def _incr_token_bucket(client: MemRedis, keys, args) -> int:
+    weight = _tonumber(args[2]) if len(args) > 2 else None
+    return _token_bucket(client, keys[0], _tonumber(args[0]), _tonumber(args[1]), weight or 1)  # type: ignore
+
+
+def _incr_gcra(client: MemRedis, keys, args) -> int:
+    weight = _tonumber(args[2]) if len(args) > 2 else None
+    return _gcra(client, keys[0], _tonumber(args[0]), _tonumber(args[1]), weight or 1)  # type: ignore
+
+
+def _incr_windows(client: MemRedis, keys, args) -> List[int]:
+    strategy, member = args[0], args[1]
+    result = []
+    for i, name in enumerate(keys):
+        mode, duration, maximum, weight = (_tonumber(x) for x in args[2 + i * 4 : 6 + i * 4])
+        c = 0
+        if mode == redislib.WINDOW_DROP:
+            client.delete(name, name + redislib.EXTRA_WEIGHTS)
+        elif mode == redislib.WINDOW_EXPIRE:
+            client._set_expire(name, duration)  # type: ignore
+        elif strategy == 'sliding_log':
+            c = _sliding_window(client, name, duration, weight, member)  # type: ignore
+        elif strategy == 'token_bucket':
+            c = _token_bucket(client, name, duration, maximum, weight, mode == redislib.WINDOW_CHARGE)  # type: ignore
+        elif strategy == 'gcra':
+            c = _gcra(client, name, duration, maximum, weight, mode == redislib.WINDOW_CHARGE)  # type: ignore
+        else:
+            raise redis.ResponseError("Error running script: attempt to call a nil value (local 'incr')")
+        result.append(c)
+        if mode == redislib.WINDOW_BLOCK and c > maximum:  # type: ignore
+            break
+    return result
+
+
+def _incr_distinct(client: MemRedis, keys, args) -> int:
+    client.pfadd(keys[0], args[0])
+    client._set_expire(keys[0], _tonumber(args[1]))  # type: ignore
+    return client.pfcount(*keys[:2])
+
+
+def _append_log(client: MemRedis, keys, args) -> int:
+    version = client.incrby(keys[0])
+    client.zadd(keys[1], {f"{version}:{args[0]}": version})
+    return version
+
+
+def _purge_by_prefix(client: MemRedis, keys, args) -> None:
+    # pylint: disable=unused-argument
+    for name in client.keys(args[0] + '*'):
+        client._drop(name)
+
+
+SCRIPTS: Dict[str, Callable] = {
+    redislib.INCR_COUNTER: _incr_counter,
+    redislib.INCR_SLIDING_WINDOW: _incr_sliding_window,
+    redislib.INCR_TOKEN_BUCKET: _incr_token_bucket,
+    redislib.INCR_GCRA: _incr_gcra,
+    redislib.INCR_WINDOWS: _incr_windows,
+    redislib.INCR_DISTINCT: _incr_distinct,
+    redislib.APPEND_LOG: _append_log,
+    redislib.PURGE_BY_PREFIX: _purge_by_prefix,
+}
+"""The lua scripts of the :py:obj:`.redislib` and their implementations in
+python."""
@@ -0,0 +1,152 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.policies:
+
+Route policies
+--------------
+
+Not all requests cost the same, a search request may cost a hundred times more
+than a static page.  With route *policies* the :py:obj:`.ip_limit` method
+counts the requests to a route with a ``weight`` and/or in its own windows:
+
+``name``
+  Name of the policy.
+
+``routes``
+  List of paths, a path that ends with ``*`` is a prefix (e.g. ``/static/*``).
+
+``weight``
+  A request to the route is counted ``weight`` times (default: ``1``).
+
+``BURST_WINDOW``, ``BURST_MAX``, ``BURST_MAX_SUSPICIOUS``, ``LONG_WINDOW``, ``LONG_MAX``, ``LONG_MAX_SUSPICIOUS``
+  Own windows of the policy (defaults: the values from
+  ``[botdetection.ip_limit]``).  If a policy has no own windows, the requests
+  are counted in the windows of the default policy (the budget is shared with
+  all routes, the expensive routes use it up faster).
+
+.. code:: toml
+
+   [botdetection.ip_limit]
+   policies = [
+     { name = 'search', routes = ['/search'], weight = 10 },
+     { name = 'static', routes = ['/static/*', '/favicon.ico'], weight = 0 },
+     { name = 'autocompleter', routes = ['/autocompleter'], BURST_WINDOW = 10, BURST_MAX = 50 },
+   ]
+
+A ``weight = 0`` excludes a route from the windows.  The policies are compiled
+once into a :py:obj:`PolicyTable` (exact paths in a dictionary, prefixes
+longest first), the policy of a path is cached.
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+
+from . import ctx
+from . import config
+from ._helpers import logger
+
+logger = logger.getChild('policies')
+
+LIMITS = (
+    'BURST_WINDOW',
+    'BURST_MAX',
+    'BURST_MAX_SUSPICIOUS',
+    'LONG_WINDOW',
+    'LONG_MAX',
+    'LONG_MAX_SUSPICIOUS',
+)
+"""Names of the windows and maxima a policy can set."""
+
+PATH_CACHE_MAX = 4096
+"""Maximum number of paths in the cache of a :py:obj:`PolicyTable`."""
+
+
+@dataclass
+class Policy:
+    """Weight and windows of the requests to a route."""
+
+    name: str
+    weight: int = 1
+    counter: bytes = b'ip_limit.'
+    """Prefix of the counter names, policies with own windows have their own
+    counters (``ip_limit.<name>.``)."""
+    limits: Dict[str, int] = field(default_factory=dict)
+    """Values of the :py:obj:`LIMITS`"""
+
+
+class PolicyTable:
+    """Route to policy lookup, compiled from the ``policies`` config."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, policies: List[dict], defaults: Dict[str, int]):
+        self.default = Policy('default', limits=dict(defaults))
+        self.exact: Dict[str, Policy] = {}
+        self.prefixes: List[Tuple[str, Policy]] = []
+        self._cache: Dict[str, Policy] = {}
+
+        for item in policies:
+            policy = self._compile(item, defaults)
+            if policy is None:
+                continue
+            for route in item.get('routes', []):
+                if route.endswith('*'):
+                    self.prefixes.append((route[:-1], policy))
+                else:
+                    self.exact[route] = policy
+        self.prefixes.sort(key=lambda x: len(x[0]), reverse=True)
+
+    @staticmethod
+    def _compile(item: dict, defaults: Dict[str, int]) -> Policy | None:
+        name = item.get('name')
+        if not name:
+            logger.error("policy without a name is ignored: %s", item)
+            return None
+        unknown = set(item) - {'name', 'routes', 'weight'} - set(LIMITS)
+        if unknown:
+            logger.error("policy %s: unknown fields %s are ignored", name, sorted(unknown))
+        own = {k: int(item[k]) for k in LIMITS if k in item}
+        return Policy(
+            name=name,
+            weight=int(item.get('weight', 1)),
+            counter=f'ip_limit.{name}.'.encode() if own else b'ip_limit.',
+            limits={**defaults, **own},
+        )
+
+    def lookup(self, path: str) -> Policy:
+        """Returns the policy of the ``path`` (the default policy if no route
+        matches)."""
+        policy = self._cache.get(path)
+        if policy is not None:
+            return policy
+        policy = self.exact.get(path)
+        if policy is None:
+            policy = next((p for prefix, p in self.prefixes if path.startswith(prefix)), self.default)
+        if len(self._cache) >= PATH_CACHE_MAX:
+            self._cache.clear()
+        self._cache[path] = policy
+        return policy
+
+
+def get_policy_table(cfg: config.Config) -> PolicyTable:
+    """Returns the :py:obj:`PolicyTable` of the configuration, the table is
+    compiled again if the configuration has been changed (see
+    :py:obj:`.config.Config.version`, a table is cached per context)."""
+    lcfg = cfg['botdetection.ip_limit']
+    policies = lcfg['policies']
+    # the length: a policy appended to the list of the configuration
+    cache_key = (cfg.version, len(policies))
+    table: List[Tuple[tuple, PolicyTable] | None] = ctx.state('policies.table', lambda: [None])
+    cached = table[0]
+    if cached is None or cached[0] != cache_key:
+        cached = table[0] = (cache_key, PolicyTable(policies, {k: lcfg[k] for k in LIMITS}))
+    return cached[1]
+
+
+def get_policy(path: str, cfg: config.Config) -> Policy:
+    """Returns the policy of the request ``path``."""
+    return get_policy_table(cfg).lookup(path)
@@ -0,0 +1,208 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.propagation:
+
+Verdict propagation
+-------------------
+
+In a multi-node setup, each node detects the same abusive network
+independently and counts its requests in the redis DB.  With the propagation
+of the verdicts, a block of the :py:obj:`.ip_limit` method is announced on a
+redis channel (PUBLISH_) and a background thread in each worker
+(:py:obj:`Subscriber`) fills a local :py:obj:`VerdictCache`.  The requests
+from a network with a cached block are blocked by the workers of all nodes for
+``block_time`` seconds, without a roundtrip to the redis DB.
+
+The subscriber is started in a worker on the first lookup (after a fork of the
+worker processes a new subscriber is started).  If the connection to the redis
+DB is lost, the subscriber reconnects after :py:obj:`RECONNECT_DELAY`
+seconds.
+
+.. note::
+
+   A blocked request from a cached network is not counted in the windows of
+   the :py:obj:`.ip_limit` method.  In a :ref:`batch <botdetection.batch>`
+   the cache is looked up before the requests are counted, a block in the
+   batch is applied from the next batch on.
+
+.. _PUBLISH: https://redis.io/commands/publish/
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.propagation]
+
+   # announce the blocks on a redis channel and cache the blocks of all nodes
+   # in the workers
+   enabled = false
+
+   # time (sec) a block is cached by the workers
+   block_time = 20
+
+   # maximum number of blocked networks in the cache of a worker
+   cache_size = 65536
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Dict, Tuple
+
+import json
+import threading
+import time
+
+from . import ctx
+from .redislib import key_prefix
+from ._helpers import logger, NetworkKey
+
+logger = logger.getChild('propagation')
+
+RECONNECT_DELAY = 5
+"""Time (sec) the subscriber waits before it reconnects to the redis DB."""
+
+
+class VerdictCache:
+    """Local cache of the blocked networks, the items expire after their
+    block time.  If the cache is full, the expired items are dropped and if
+    there is still no space, the oldest item is dropped."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: Dict[str, Tuple[float, int, str]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, duration: float, status: int, reason: str):
+        """Caches the verdict ``(status, reason)`` of network ``key`` for
+        ``duration`` seconds."""
+        now = time.time()
+        with self._lock:
+            if key not in self._items and len(self._items) >= self.maxsize:
+                for k in [k for k, item in self._items.items() if item[0] <= now]:
+                    del self._items[k]
+                if len(self._items) >= self.maxsize:
+                    del self._items[next(iter(self._items))]
+            self._items[key] = (now + duration, status, reason)
+
+    def get(self, key: str) -> Tuple[int, str] | None:
+        """Returns the cached verdict ``(status, reason)`` of network ``key``
+        or ``None``."""
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.time():
+            self._items.pop(key, None)
+            return None
+        return item[1], item[2]
+
+    def pop(self, key: str):
+        """Drops the verdict of network ``key`` from the cache."""
+        self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Subscriber(threading.Thread):
+    """Background thread which receives the verdicts from the ``channel`` and
+    puts them in the ``cache``."""
+
+    def __init__(self, client, channel: str, cache: VerdictCache):
+        super().__init__(name='botdetection.propagation', daemon=True)
+        self.client = client
+        self.channel = channel
+        self.cache = cache
+        self._stop_event = threading.Event()
+
+    def run(self):
+        import redis  # pylint: disable=import-outside-toplevel
+
+        while not self._stop_event.is_set():
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                try:
+                    while not self._stop_event.is_set():
+                        msg = pubsub.get_message(timeout=1.0)
+                        if msg is not None:
+                            self.receive(msg['data'])
+                finally:
+                    pubsub.close()
+            except redis.RedisError as exc:
+                logger.warning("subscriber lost connection to redis DB (%s), reconnect", exc)
+                self._stop_event.wait(RECONNECT_DELAY)
+
+    def receive(self, data: bytes | str):
+        """Puts a verdict from a message of the channel in the cache."""
+        try:
+            msg = json.loads(data)
+            if float(msg['duration']) <= 0:
+                self.cache.pop(msg['network'])
+                return
+            self.cache.put(msg['network'], float(msg['duration']), int(msg['status']), msg['reason'])
+        except (ValueError, KeyError, TypeError) as exc:
+            logger.error("invalid message on channel %s: %s (%s)", self.channel, data, exc)
+
+    def stop(self):
+        """Stops the thread (after max. one second)."""
+        self._stop_event.set()
+
+
+def _channel() -> str:
+    return key_prefix() + "propagation.verdicts"
+
+
+def _cfg(name):
+    return ctx.cfg.get(f'botdetection.propagation.{name}')
+
+
+def _start() -> Tuple[VerdictCache, Subscriber]:
+    cache = VerdictCache(_cfg('cache_size'))
+    subscriber = Subscriber(ctx.redis_client, _channel(), cache)
+    subscriber.start()
+    return cache, subscriber
+
+
+def get_cache() -> VerdictCache | None:
+    """Returns the :py:obj:`VerdictCache` of this worker in the current context
+    (``None`` if the propagation is not enabled), the :py:obj:`Subscriber` is
+    started on first use."""
+
+    if not ctx.redis_client or not _cfg('enabled'):
+        return None
+    return ctx.worker_state('propagation', _start)[0]
+
+
+def lookup(network: NetworkKey) -> Tuple[int, str] | None:
+    """Returns the cached verdict ``(status, reason)`` of a blocked
+    ``network`` or ``None``."""
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(network.name)
+
+
+def publish(network: NetworkKey, status: int, reason: str):
+    """Announces the block of a ``network`` to the workers of all nodes (the
+    block is cached immediately in this worker)."""
+    cache = get_cache()
+    if cache is None:
+        return
+    duration = _cfg('block_time')
+    cache.put(network.name, duration, status, reason)
+    msg = json.dumps({'network': network.name, 'duration': duration, 'status': status, 'reason': reason})
+    ctx.redis_client.publish(_channel(), msg)
+
+
+def revoke(network: NetworkKey):
+    """Revokes the block of a ``network`` in the caches of all workers."""
+    if not ctx.redis_client or not _cfg('enabled'):
+        return
+    state = ctx.worker_state('propagation')
+    if state is not None:
+        state[0].pop(network.name)
+    msg = json.dumps({'network': network.name, 'duration': 0, 'status': 200, 'reason': ''})
+    ctx.redis_client.publish(_channel(), msg)
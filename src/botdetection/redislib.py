@@ -22,12 +22,35 @@ Config
    # A prefix to all keys store by the botdetection in the redis DB
    REDIS_KEY_PREFIX = 'botdetection_'
 
+   # compact (binary) keys and integer members of the sliding windows (<int>:<weight>
+   # for a weighted request)
+   compact_keys = false
+
+With ``compact_keys`` the keys are :py:obj:`REDIS_KEY_PREFIX` + a one
+character tag of the key type (:py:obj:`KEY_TAGS`) + a binary digest of the
+(*secret hashed*) name (:py:obj:`DIGEST_SIZE` bytes), see :py:func:`redis_key`.
+The items of a sliding window are integers (timestamp in µs), which are stored
+as integers by redis (the item of a weighted request is ``<int>:<weight>``,
+see :py:func:`incr_sliding_window`).  A key like::
+
+  botdetection_counter_ip_limit.SUSPICIOUS_IP_WINDOW2001:db8::/48
+
+needs 64 bytes, the compact key needs 26 bytes (with the default prefix) and a
+sliding window item needs 8 bytes instead of ~16 (~24 in a pipeline).  The
+names of compact keys can't be decoded, e.g. by the :ref:`command line
+<botdetection.cli>`.  Switching ``compact_keys`` resets the counters.
+
 
 Implementations
 ~~~~~~~~~~~~~~~
 """
 
 from __future__ import annotations
+from typing import Callable, List, NamedTuple, Tuple
+
+import hashlib
+import os
+import time
 
 from . import ctx
 
@@ -42,18 +65,82 @@ LUA_SCRIPT_STORAGE = {}
 def secret_hash(name: str) -> str:
     """Returns a annonymized name if ``secret_hash`` is configured, otherwise
     the ``name`` is returned unchanged."""
-    func = ctx.cfg.pyobj('botdetection.redis.secret_hash', default=None)  # type: ignore
-    if not func:
+    if not ctx.cfg.get('botdetection.redis.secret_hash', default=None):
         return name
+    func = ctx.cfg.pyobj('botdetection.redis.secret_hash')  # type: ignore
     return func(name)
 
 
-def _prefix(val: str | None = None) -> str:
+def key_prefix(val: str | None = None) -> str:
+    """Returns the prefix ``val`` of the redis keys, if ``val`` is ``None`` the
+    configured :py:obj:`REDIS_KEY_PREFIX` is returned."""
     if val is None:
         val = ctx.cfg.get('botdetection.redis.REDIS_KEY_PREFIX', default=REDIS_KEY_PREFIX)  # type: ignore
     return str(val)
 
 
+KEY_TAGS = {
+    'counter': 'c',
+    'bucket': 'b',
+    'gcra': 'g',
+    'distinct': 'd',
+    'ping': 'p',
+}
+"""Tags of the key types in compact keys."""
+
+DIGEST_SIZE = 12
+"""Size (bytes) of the digest of a name in compact keys."""
+
+
+def compact_keys() -> bool:
+    """Returns ``True`` if ``compact_keys`` are configured."""
+    return bool(ctx.cfg.get('botdetection.redis.compact_keys', default=False))
+
+
+class KeyFormat(NamedTuple):
+    """The settings of the redis keys from the configuration, see
+    :py:obj:`key_format`."""
+
+    prefix: bytes
+    """The :py:obj:`REDIS_KEY_PREFIX` (encoded)."""
+
+    compact: bool
+    """``True`` if ``compact_keys`` are configured."""
+
+    secret_hash: Callable[[str], str] | None
+    """The function of the ``secret_hash`` (``None`` if not configured)."""
+
+
+def key_format() -> KeyFormat:
+    """Returns the settings of the redis keys.  A function that builds more
+    than one key reads the settings once and passes them to
+    :py:obj:`redis_key`."""
+    func = None
+    if ctx.cfg.get('botdetection.redis.secret_hash', default=None):
+        func = ctx.cfg.pyobj('botdetection.redis.secret_hash')  # type: ignore
+    return KeyFormat(key_prefix().encode(), compact_keys(), func)
+
+
+def redis_key(key_type: str, name: str | bytes, suffix: str = '', fmt: KeyFormat | None = None) -> bytes:
+    """Returns the redis key :py:obj:`REDIS_KEY_PREFIX` + ``<key_type>_<name>``
+    where ``<name>`` is the *secret hash* of ``name`` (see
+    :py:func:`secret_hash`).  With ``compact_keys`` the key is
+    :py:obj:`REDIS_KEY_PREFIX` + ``<tag><digest>``, the tag is from
+    :py:obj:`KEY_TAGS` and the digest is a BLAKE2b digest of the *secret hash*.
+    The ``suffix`` is appended to the key.  The settings of the keys are read
+    from the configuration if no ``fmt`` is given (see :py:obj:`key_format`)."""
+    if fmt is None:
+        fmt = key_format()
+    if fmt.secret_hash is not None:
+        name = fmt.secret_hash(name.decode() if isinstance(name, bytes) else name)
+    if isinstance(name, str):
+        name = name.encode()
+    if not fmt.compact:
+        return fmt.prefix + key_type.encode() + b"_" + name + suffix.encode()
+    digest = hashlib.blake2b(name, digest_size=DIGEST_SIZE).digest()
+    return fmt.prefix + KEY_TAGS[key_type].encode() + digest + suffix.encode()
+
+
 def lua_script_storage(client, script):
     """Returns a redis :py:obj:`Script
     <redis.commands.core.CoreCommands.register_script>` instance.
@@ -105,7 +192,7 @@ def purge_by_prefix(client, prefix: str | None):
 
     """
     script = lua_script_storage(client, PURGE_BY_PREFIX)
-    script(args=[_prefix(prefix)])
+    script(args=[key_prefix(prefix)])
 
 
 INCR_COUNTER = """
@@ -130,7 +217,7 @@ return c
 """
 
 
-def incr_counter(client, name: str, limit: int = 0, expire: int = 0):
+def incr_counter(client, name: str | bytes, limit: int = 0, expire: int = 0):
     """Increment a counter and return the new value.
 
     If counter with redis key :py:obj:`REDIS_KEY_PREFIX` + ``counter_<name>``
@@ -172,37 +259,88 @@ def incr_counter(client, name: str, limit: int = 0, expire: int = 0):
 
     """
     script = lua_script_storage(client, INCR_COUNTER)
-    name = _prefix() + "counter_" + secret_hash(name)
+    name = redis_key('counter', name)
     c = script(args=[limit, expire], keys=[name])
     return c
 
 
-def drop_counter(client, name):
+def get_counter(client, name: str | bytes) -> int:
+    """Returns the value of the counter with redis key
+    :py:obj:`REDIS_KEY_PREFIX` + ``counter_<name>`` (see
+    :py:func:`incr_counter`), ``0`` if the counter does not exists."""
+    return int(client.get(redis_key('counter', name)) or 0)
+
+
+def drop_counter(client, name, key_type: str = 'counter'):
     """Drop counter with redis key :py:obj:`REDIS_KEY_PREFIX` +
-    ``counter_<name>``
+    ``<key_type>_<name>``
 
     The replacement ``<name>`` is a *secret hash* of the value from argument
     ``name`` (see :py:func:`incr_counter` and :py:func:`incr_sliding_window`).
+    The ``key_type`` of the token bucket is ``bucket`` (see
+    :py:func:`incr_token_bucket`) and ``gcra`` of the GCRA (see
+    :py:func:`incr_gcra`).  The companion counter of the extra weights of a
+    sliding window is dropped with the counter.
 
     """
-    name = _prefix() + "counter_" + secret_hash(name)
-    client.delete(name)
-
-
-INCR_SLIDING_WINDOW = """
-local expire = tonumber(ARGV[1])
-local name = KEYS[1]
-local current_time = redis.call('TIME')
+    key = redis_key(key_type, name)
+    client.delete(key, key + EXTRA_WEIGHTS)
+
+
+EXTRA_WEIGHTS = b':w'
+"""Suffix of the redis key of a sliding window's companion counter with the sum
+of the extra weights of the items in the window, see
+:py:func:`incr_sliding_window`."""
+
+LUA_SLIDING_WINDOW = """
+local function sliding_window(name, expire, maximum, weight, member)
+    local current_time = redis.call('TIME')
+    -- the extra weights (weight - 1) of the items in the window are summed up in
+    -- a companion counter, which only exists if a weighted item has been added
+    local extra_name = name .. ':w'
+    local extra = tonumber(redis.call('GET', extra_name))
+    if extra then
+        -- only the expired items are read (each item once)
+        for _, item in ipairs(redis.call('ZRANGEBYSCORE', name, 0, current_time[1] - expire)) do
+            extra = extra - (tonumber(string.match(item, ':(%d+)$')) or 1) + 1
+        end
+        extra = math.max(0, extra)
+    end
+    redis.call('ZREMRANGEBYSCORE', name, 0, current_time[1] - expire)
+    -- one item per request, a weight > 1 is appended to the item (':<weight>')
+    local suffix = ''
+    if weight > 1 then
+        suffix = ':' .. weight
+        extra = (extra or 0) + weight - 1
+    end
+    if member == '' then
+        -- integer items (µs), an item which already exists is incremented
+        local m = current_time[1] * 1000000 + current_time[2]
+        while redis.call('ZADD', name, 'NX', current_time[1], string.format('%.0f', m) .. suffix) == 0 do
+            m = m + 1
+        end
+    else
+        member = current_time[1] .. current_time[2] .. (member or '')
+        redis.call('ZADD', name, current_time[1], member .. suffix)
+    end
+    redis.call('EXPIRE', name, expire)
+    if extra then
+        redis.call('SET', extra_name, extra, 'EX', expire)
+    end
+    return redis.call('ZCOUNT', name, 0, current_time[1] + 1) + (extra or 0)
+end
+"""
+"""Lua function of the sliding window, see :py:obj:`INCR_SLIDING_WINDOW`."""
 
-redis.call('ZREMRANGEBYSCORE', name, 0, current_time[1] - expire)
-redis.call('ZADD', name, current_time[1], current_time[1] .. current_time[2])
-local result = redis.call('ZCOUNT', name, 0, current_time[1] + 1)
-redis.call('EXPIRE', name, expire)
-return result
+INCR_SLIDING_WINDOW = (
+    LUA_SLIDING_WINDOW
+    + """
+return sliding_window(KEYS[1], tonumber(ARGV[1]), 0, tonumber(ARGV[2]) or 1, ARGV[3])
 """
+)
 
 
-def incr_sliding_window(client, name: str, duration: int):
+def incr_sliding_window(client, name: str | bytes, duration: int, weight: int = 1):
     """Increment a sliding-window counter and return the new value.
 
     If counter with redis key :py:obj:`REDIS_KEY_PREFIX` + ``counter_<name>``
@@ -216,6 +354,10 @@ def incr_sliding_window(client, name: str, duration: int):
     :param duration: live-time of the sliding window in seconds
     :typeduration: int
 
+    :param weight: the request is counted ``weight`` times (one item with the
+      weight appended, ``<item>:<weight>``)
+    :type weight: int
+
     :return: value of the incremented counter
     :type return: int
 
@@ -230,8 +372,14 @@ def incr_sliding_window(client, name: str, duration: int):
     call (increment) and if there is no call in this duration, the sorted
     set expires from the redis DB.
 
-    The return value is the amount of items in the sorted set (ZCOUNT_), what
-    means the number of calls in the sliding window.
+    The return value is the number of items in the sorted set (ZCOUNT_) plus
+    the extra weights (``weight - 1``) of the weighted items, what means the
+    number of calls in the sliding window (weighted).  The extra weights are
+    summed up in a companion counter (redis key + :py:obj:`EXTRA_WEIGHTS`),
+    which exists only if a weighted item has been added: when the items of a
+    weighted request expire, their extra weights are subtracted.  A window
+    without weighted items costs O(log N), the items of a window with weighted
+    items are read once (when they expire).
 
     .. _Sorted sets in Redis:
        https://redis.com/ebook/part-1-getting-started/chapter-1-getting-to-know-redis/1-2-what-redis-data-structures-look-like/1-2-5-sorted-sets-in-redis/
@@ -258,6 +406,317 @@ def incr_sliding_window(client, name: str, duration: int):
 
     """
     script = lua_script_storage(client, INCR_SLIDING_WINDOW)
-    name = _prefix() + "counter_" + secret_hash(name)
-    c = script(args=[duration], keys=[name])
+    args = [duration, weight, ''] if compact_keys() else [duration, weight]
+    c = script(args=args, keys=[redis_key('counter', name)])
+    return c
+
+
+LUA_TOKEN_BUCKET = """
+local function token_bucket(name, duration, maximum, weight, _, force)
+    duration = duration * 1000
+    local current_time = redis.call('TIME')
+    local now = current_time[1] * 1000 + math.floor(current_time[2] / 1000)
+
+    local bucket = redis.call('HMGET', name, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or maximum
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(maximum, tokens + (now - ts) * maximum / duration)
+
+    local result = math.ceil(maximum - tokens) + weight
+    if force or tokens >= weight then
+        -- a forced request takes the tokens on credit (tokens < 0)
+        tokens = tokens - weight
+        result = math.ceil(maximum - tokens)
+    end
+    redis.call('HSET', name, 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', name, math.max(duration, math.ceil((maximum - tokens) * duration / maximum)))
+    return result
+end
+"""
+"""Lua function of the token bucket, see :py:obj:`INCR_TOKEN_BUCKET`."""
+
+INCR_TOKEN_BUCKET = (
+    LUA_TOKEN_BUCKET
+    + """
+return token_bucket(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]) or 1)
+"""
+)
+
+
+def incr_token_bucket(client, name: str | bytes, duration: int, maximum: int, weight: int = 1) -> int:
+    """Take ``weight`` tokens from a `token bucket`_ and return the number of
+    used tokens.
+
+    The bucket with redis key :py:obj:`REDIS_KEY_PREFIX` + ``bucket_<name>``
+    holds up to ``maximum`` tokens and is refilled with ``maximum`` tokens in
+    ``duration`` seconds.  The replacement ``<name>`` is a *secret hash* of the
+    value from argument ``name`` (see :py:func:`secret_hash`).
+
+    The return value is the number of used tokens (``maximum`` minus the tokens
+    left in the bucket), which is comparable to the count of
+    :py:func:`incr_sliding_window`.  If there are not enough tokens in the
+    bucket, no token is taken and the number of used tokens plus ``weight``
+    (greater than ``maximum``) is returned.
+
+    The implementation is the lua script from string
+    :py:obj:`INCR_TOKEN_BUCKET`, the bucket is a hash with two fields (tokens
+    and timestamp of the last refill).
+
+    .. _token bucket: https://en.wikipedia.org/wiki/Token_bucket
+
+    """
+    script = lua_script_storage(client, INCR_TOKEN_BUCKET)
+    c = script(args=[duration, maximum, weight], keys=[redis_key('bucket', name)])
+    return c
+
+
+LUA_GCRA = """
+local function gcra(name, duration, maximum, weight, _, force)
+    duration = duration * 1000000
+    local current_time = redis.call('TIME')
+    local now = current_time[1] * 1000000 + current_time[2]
+    local interval = duration / maximum
+
+    local tat = tonumber(redis.call('GET', name)) or now
+    if tat < now then
+        tat = now
+    end
+    tat = math.floor(tat + weight * interval)
+
+    local result = math.ceil((tat - now) / interval)
+    if force or result <= maximum then
+        redis.call('SET', name, tat, 'PX', math.ceil((tat - now) / 1000))
+    end
+    return result
+end
+"""
+"""Lua function of the GCRA, see :py:obj:`INCR_GCRA`."""
+
+INCR_GCRA = (
+    LUA_GCRA
+    + """
+return gcra(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]) or 1)
+"""
+)
+
+
+def incr_gcra(client, name: str | bytes, duration: int, maximum: int, weight: int = 1) -> int:
+    """Count a request (``weight`` times) in a GCRA_ (*generic cell rate
+    algorithm*) and return the number of requests in the window.
+
+    A rate of ``maximum`` requests in ``duration`` seconds is allowed, with a
+    burst of ``maximum`` requests.  The state of the GCRA is a single integer
+    (the *theoretical arrival time* in µs) in redis key
+    :py:obj:`REDIS_KEY_PREFIX` + ``gcra_<name>``.  The replacement ``<name>``
+    is a *secret hash* of the value from argument ``name`` (see
+    :py:func:`secret_hash`).
+
+    The return value is the number of requests that are *in the window*, which
+    is comparable to the count of :py:func:`incr_sliding_window`.  If the value
+    is greater than ``maximum`` the request is not conforming and is not
+    counted.
+
+    The implementation is the lua script from string :py:obj:`INCR_GCRA`.
+
+    .. _GCRA: https://en.wikipedia.org/wiki/Generic_cell_rate_algorithm
+
+    """
+    script = lua_script_storage(client, INCR_GCRA)
+    c = script(args=[duration, maximum, weight], keys=[redis_key('gcra', name)])
     return c
+
+
+WINDOW_COUNT = 0
+"""Mode of a window in :py:func:`incr_windows`: count the request."""
+
+WINDOW_BLOCK = 1
+"""Mode of a window in :py:func:`incr_windows`: count the request and stop the
+evaluation if the count exceeds the maximum."""
+
+WINDOW_DROP = 2
+"""Mode of a window in :py:func:`incr_windows`: drop the window."""
+
+WINDOW_EXPIRE = 3
+"""Mode of a window in :py:func:`incr_windows`: reset the expire time of a
+(not prefixed) key, e.g. the key of a ping."""
+
+WINDOW_CHARGE = 4
+"""Mode of a window in :py:func:`incr_windows`: count the ``weight`` also if
+the window is exceeded, the token bucket and the GCRA take the tokens on
+credit.  E.g. the requests that have already been passed by a :ref:`local
+tier <botdetection.local_tier>`."""
+
+INCR_WINDOWS = (
+    LUA_SLIDING_WINDOW
+    + LUA_TOKEN_BUCKET
+    + LUA_GCRA
+    + """
+local incr = ({sliding_log = sliding_window, token_bucket = token_bucket, gcra = gcra})[ARGV[1]]
+local member = ARGV[2]
+local result = {}
+
+for i, name in ipairs(KEYS) do
+    local o = 2 + (i - 1) * 4
+    local mode = tonumber(ARGV[o + 1])
+    local duration = tonumber(ARGV[o + 2])
+    local maximum = tonumber(ARGV[o + 3])
+    local weight = tonumber(ARGV[o + 4])
+    local c = 0
+    if mode == 2 then
+        redis.call('DEL', name, name .. ':w')
+    elseif mode == 3 then
+        redis.call('EXPIRE', name, duration)
+    else
+        c = incr(name, duration, maximum, weight, member, mode == 4)
+    end
+    result[i] = c
+    if mode == 1 and c > maximum then
+        break
+    end
+end
+return result
+"""
+)
+
+
+def incr_windows(client, strategy: str, key_type: str, windows, pipe=None):
+    """Evaluate a chain of windows in one roundtrip and return the list of the
+    counts.
+
+    The ``windows`` are tuples ``(mode, name, duration, maximum, weight, ..)``, the
+    counters are incremented by the ``strategy`` (``sliding_log``,
+    ``token_bucket`` or ``gcra``) in the order of the list.  The evaluation
+    stops after the first window in mode :py:obj:`WINDOW_BLOCK` whose count
+    exceeds its ``maximum``, the returned list has one item for each evaluated
+    window (``0`` for the modes :py:obj:`WINDOW_DROP` and
+    :py:obj:`WINDOW_EXPIRE`).  A window in mode :py:obj:`WINDOW_CHARGE` is
+    counted unconditionally and never stops the evaluation.
+
+    The redis key of a window is :py:obj:`REDIS_KEY_PREFIX` +
+    ``<key_type>_<name>`` (see :py:func:`incr_sliding_window`,
+    :py:func:`incr_token_bucket` and :py:func:`incr_gcra`), except for windows
+    in mode :py:obj:`WINDOW_EXPIRE` where ``name`` is the key.
+
+    If a ``pipe`` (a pipeline of the ``client``) is given, the evaluation is
+    queued in the pipeline and the counts are in the result of
+    ``pipe.execute()``.  The items of a sliding log get a random suffix (or
+    are integers with ``compact_keys``), so that requests which are evaluated
+    in the same microsecond are counted.
+
+    The implementation is the lua script from string :py:obj:`INCR_WINDOWS`,
+    which is composed from the lua functions of the strategies.
+
+    """
+    script = lua_script_storage(client, INCR_WINDOWS)
+    fmt = key_format()
+    keys = []
+    args = [strategy, '' if fmt.compact else os.urandom(4).hex()]
+    for mode, name, duration, maximum, weight in (window[:5] for window in windows):
+        if mode != WINDOW_EXPIRE:
+            name = redis_key(key_type, name, fmt=fmt)
+        keys.append(name)
+        args.extend((mode, duration, maximum, weight))
+    return script(keys=keys, args=args, client=pipe or client)
+
+
+INCR_DISTINCT = """
+local value = ARGV[1]
+local expire = tonumber(ARGV[2])
+
+redis.call('PFADD', KEYS[1], value)
+redis.call('EXPIRE', KEYS[1], expire)
+return redis.call('PFCOUNT', KEYS[1], KEYS[2])
+"""
+
+
+def distinct_keys(name: str | bytes, duration: int) -> List[bytes]:
+    """Returns the redis keys of the current and the previous bucket of the
+    distinct-counter ``name`` (see :py:func:`incr_distinct`)."""
+    bucket = int(time.time() // duration)
+    fmt = key_format()
+    return [redis_key('distinct', name, f":{bucket}", fmt), redis_key('distinct', name, f":{bucket - 1}", fmt)]
+
+
+def incr_distinct(client, name: str | bytes, value: str | bytes, duration: int) -> int:
+    """Add ``value`` to a distinct-counter and return the (estimated) number of
+    distinct values in the counter.
+
+    The counter is a HyperLogLog_ in the redis DB, which uses a constant amount
+    of memory (max 12 KiB) independent of the number of values.  A HyperLogLog
+    can not slide, the counter is split into buckets of ``duration`` seconds
+    (redis key :py:obj:`REDIS_KEY_PREFIX` + ``distinct_<name>:<bucket>``) and
+    the values of the current and the previous bucket are counted (PFCOUNT_).
+    The replacement ``<name>`` is a *secret hash* of the value from argument
+    ``name`` (see :py:func:`secret_hash`).
+
+    :param name: name of the counter
+    :type name: str
+
+    :param value: value to count
+    :type value: str
+
+    :param duration: duration of a bucket in seconds
+    :type duration: int
+
+    :return: number of distinct values in the last ``duration`` (up to
+      ``2 * duration``) seconds
+    :type return: int
+
+    The implementation of the redis counter is the lua script from string
+    :py:obj:`INCR_DISTINCT`.
+
+    .. _HyperLogLog: https://redis.io/docs/data-types/probabilistic/hyperloglogs/
+    .. _PFCOUNT: https://redis.io/commands/pfcount/
+
+    """
+    script = lua_script_storage(client, INCR_DISTINCT)
+    c = script(args=[value, 2 * duration], keys=distinct_keys(name, duration))
+    return c
+
+
+def count_distinct(client, name: str, duration: int) -> int:
+    """Returns the number of distinct values in a counter from
+    :py:func:`incr_distinct` (without adding a value)."""
+    return client.pfcount(*distinct_keys(name, duration))
+
+
+APPEND_LOG = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], version, version .. ':' .. ARGV[1])
+return version
+"""
+
+
+def log_keys(name: str) -> List[str]:
+    """Returns the redis keys of the versioned log ``name``: the counter of the
+    last version and the sorted set of the values (see :py:func:`append_log`)."""
+    return [f"{key_prefix()}{name}:version", f"{key_prefix()}{name}"]
+
+
+def append_log(client, name: str, value: str) -> int:
+    """Appends ``value`` to a versioned log and returns the version of the
+    value.
+
+    The log is a sorted set (redis key :py:obj:`REDIS_KEY_PREFIX` + ``<name>``)
+    of the values scored by their version, the last version is a counter
+    (``<name>:version``).  The version is assigned and the value is added in
+    one atomic step: the versions in the log have no gaps and a reader that
+    has read up to a version never misses an older value (see
+    :py:func:`read_log`).  The log does not expire.
+
+    The implementation is the lua script from string :py:obj:`APPEND_LOG`.
+    """
+    script = lua_script_storage(client, APPEND_LOG)
+    return int(script(args=[value], keys=log_keys(name)))
+
+
+def read_log(client, name: str, version: int = 0) -> List[Tuple[int, str]]:
+    """Returns the ``(version, value)`` items of a log from
+    :py:func:`append_log` that are newer than ``version``, the oldest first."""
+    items = []
+    for item in client.zrangebyscore(log_keys(name)[1], f"({version}", '+inf'):
+        if isinstance(item, bytes):
+            item = item.decode()
+        v, _, value = item.partition(':')
+        items.append((int(v), value))
+    return items
@@ -0,0 +1,450 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.replay:
+
+Replay of access logs
+---------------------
+
+The ``replay`` module streams the lines of (nginx) access logs through the
+detection methods to see which requests would have been blocked by a
+configuration.  It is a tool to tune the limits of the :ref:`ip_limit
+<botdetection.ip_limit>` method (e.g. ``BURST_MAX``, ``LONG_MAX`` and the
+``SUSPICIOUS_*`` values in the ``[botdetection.ip_limit]`` config).
+
+.. code:: sh
+
+   $ python -m botdetection.replay --config botdetection.toml --jobs 8 \\
+         /var/log/nginx/access.log.1 /var/log/nginx/access.log
+
+The lines of the logs are processed in a generator pipeline:
+
+1. :py:obj:`read_lines`: lines of the (gzip-) files in the given order
+2. :py:obj:`parse_lines`: match :py:obj:`LOG_FORMAT`
+3. :py:obj:`LogRequest`: a lightweight request object build from the match
+4. :py:obj:`evaluate`: run the methods on the request
+
+The counters of the methods are not stored in a redis DB, they are kept in
+memory (:py:obj:`.memredis.MemRedis`) and the clock of the counters is the
+time of the log line.  To scale across CPU cores, the replay is split into
+``jobs`` shards which are evaluated in worker processes.  The lines are parsed
+once in the main process, the requests are sharded by the (client) network
+(:py:obj:`.get_network`) and sent in chunks of :py:obj:`CHUNK_SIZE` requests
+to the worker of the shard: all requests from one network are evaluated in the
+same process.
+
+Only the HTTP headers that are logged can be evaluated: with the default
+:py:obj:`LOG_FORMAT` (nginx ``combined``) the ``User-Agent`` is available.  To
+evaluate more methods, log the headers and pass a regular expression with the
+named groups ``accept``, ``accept_language``, ``accept_encoding``,
+``connection`` or ``x_forwarded_for`` in the ``--log-format`` option.
+
+Requests to ``/client<token>.css`` are treated as a valid ping of the
+:py:obj:`.link_token` method.
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Iterable, Iterator, Tuple, Dict, List
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from ipaddress import ip_address
+from queue import Empty, Full
+from urllib.parse import urlsplit, parse_qsl
+
+import argparse
+import gzip
+import logging
+import multiprocessing
+import pathlib
+import re
+import sys
+import zlib
+
+import flask
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from . import ctx
+from . import config
+from . import (
+    http_accept,
+    http_accept_encoding,
+    http_accept_language,
+    http_connection,
+    http_user_agent,
+    ip_limit,
+    ip_lists,
+    link_token,
+)
+from ._helpers import logger, get_network, NetworkKey
+from .memredis import ManualClock, MemRedis
+
+logger = logger.getChild('replay')
+
+LOG_FORMAT = (
+    r'(?P<remote_addr>\S+) - \S+ \[(?P<time_local>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<uri>\S+) [^"]*" (?P<status>\d{3}) \S+ '
+    r'"[^"]*" "(?P<user_agent>[^"]*)"'
+)
+"""Regular expression of nginx' ``combined`` log format.  Required groups are
+``remote_addr``, ``time_local``, ``method`` and ``uri``."""
+
+TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+"""Format of the ``time_local`` group (nginx ``$time_local``)."""
+
+LIMIT_PATHS = ('/search',)
+"""Paths on which the HTTP header methods and :py:obj:`.ip_limit` are applied,
+the :py:obj:`.http_user_agent` method is applied on all paths."""
+
+HEADER_GROUPS = {
+    'user_agent': 'User-Agent',
+    'accept': 'Accept',
+    'accept_language': 'Accept-Language',
+    'accept_encoding': 'Accept-Encoding',
+    'connection': 'Connection',
+    'x_forwarded_for': 'X-Forwarded-For',
+}
+"""Named groups of the log format that are mapped to HTTP headers."""
+
+HEADER_METHODS = [
+    ('accept', http_accept),
+    ('accept_encoding', http_accept_encoding),
+    ('accept_language', http_accept_language),
+    ('connection', http_connection),
+]
+"""HTTP header methods applied on :py:obj:`LIMIT_PATHS` (if the header is in
+the log format)."""
+
+CHUNK_SIZE = 1000
+"""Number of requests sent to the worker of a shard in one message."""
+
+POLL_INTERVAL = 1.0
+"""Seconds to wait on a queue of the workers before checking whether the
+workers are still alive."""
+
+_PING_PATH = re.compile(r'^/client[^/]+\.css$')
+
+
+class LogRequest:
+    """A lightweight request object, the attributes used by the methods are
+    duck-typed to :py:obj:`flask.Request`."""
+
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('time', 'remote_addr', 'method', 'path', 'args', 'headers')
+
+    def __init__(self, match: re.Match, timestamp: float):
+        groups = match.groupdict()
+        self.time = timestamp
+        self.remote_addr = groups['remote_addr']
+        self.method = groups['method']
+        url = urlsplit(groups['uri'])
+        self.path = url.path
+        self.args = dict(parse_qsl(url.query)) if url.query else {}
+        self.headers = {
+            hdr: groups[group] for group, hdr in HEADER_GROUPS.items() if groups.get(group) not in (None, '-')
+        }
+
+    @property
+    def accept_mimetypes(self) -> MIMEAccept:
+        """The parsed ``Accept`` header."""
+        return parse_accept_header(self.headers.get('Accept'), MIMEAccept)
+
+    @property
+    def real_ip(self) -> str:
+        """The (real) IP of the client, see :py:obj:`_real_ip`."""
+        return _real_ip(self.remote_addr, self.headers.get('X-Forwarded-For'))
+
+
+def _real_ip(remote_addr: str, forwarded_for: str | None) -> str:
+    """The right most IP from X-Forwarded-For (if logged) or the
+    ``remote_addr``."""
+    if forwarded_for and forwarded_for != '-':
+        return forwarded_for.rsplit(',', 1)[-1].strip()
+    return remote_addr
+
+
+@dataclass
+class ReplayStats:
+    """Result of a replay (or of one shard of a replay)."""
+
+    lines: int = 0
+    unparsed: int = 0
+    requests: int = 0
+    blocked: int = 0
+    blocked_by: Counter = field(default_factory=Counter)
+    blocked_networks: Counter = field(default_factory=Counter)
+
+    def merge(self, other: ReplayStats):
+        """Adds the counts of an ``other`` statistic."""
+        self.lines += other.lines
+        self.unparsed += other.unparsed
+        self.requests += other.requests
+        self.blocked += other.blocked
+        self.blocked_by.update(other.blocked_by)
+        self.blocked_networks.update(other.blocked_networks)
+
+    def report(self, top: int = 20) -> str:
+        """Returns the text of the statistic with the ``top`` blocked
+        networks."""
+        lines = [
+            f"lines: {self.lines} / unparsed: {self.unparsed} / requests: {self.requests}",
+            f"blocked: {self.blocked} ({100 * self.blocked / max(self.requests, 1):.2f}%)",
+            "",
+            "blocked by method:",
+        ]
+        lines += [f"  {count:10d}  {name}" for name, count in self.blocked_by.most_common()]
+        lines += ["", f"top {top} blocked networks:"]
+        lines += [f"  {count:10d}  {name}" for name, count in self.blocked_networks.most_common(top)]
+        return "\n".join(lines)
+
+
+def read_lines(files: Iterable[pathlib.Path]) -> Iterator[str]:
+    """Yields the lines of the ``files``, gzip compressed files (``*.gz``) are
+    decompressed."""
+    for fname in files:
+        opener = gzip.open if fname.suffix == '.gz' else open
+        with opener(fname, 'rt', encoding='utf-8', errors='replace') as f:
+            yield from f
+
+
+def parse_lines(
+    lines: Iterable[str],
+    log_format: re.Pattern,
+    stats: ReplayStats | None = None,
+) -> Iterator[Tuple[NetworkKey, LogRequest]]:
+    """Yields the (client) network and a :py:obj:`LogRequest` for each line
+    that matches the ``log_format``."""
+
+    cfg = ctx.cfg
+    last_time: Tuple[str, float] = ('', 0.0)
+    stats = stats or ReplayStats()
+
+    for line in lines:
+        stats.lines += 1
+        match = log_format.match(line)
+        if match is None:
+            stats.unparsed += 1
+            continue
+        request = LogRequest(match, 0.0)
+        try:
+            network = get_network(request.real_ip, cfg)
+        except ValueError:
+            stats.unparsed += 1
+            continue
+
+        # many lines share the same second, parse time string only once
+        time_local = match['time_local']
+        if time_local != last_time[0]:
+            last_time = (time_local, datetime.strptime(time_local, TIME_FORMAT).timestamp())
+        request.time = last_time[1]
+        yield network, request
+
+
+def evaluate(
+    network: NetworkKey, request: LogRequest, cfg: config.Config, header_methods: List
+) -> str | None:
+    """Evaluates the ``request`` in the order of the SearXNG limiter and returns
+    the name of the method that blocks the request (or ``None``)."""
+
+    # pylint: disable=too-many-return-statements
+
+    real_ip = ip_address(request.real_ip)
+    if network.is_link_local and not cfg['botdetection.ip_limit.filter_link_local']:
+        return None
+    if ip_lists.pass_ip(real_ip, cfg)[0]:
+        return None
+    if ip_lists.block_ip(real_ip, cfg)[0]:
+        return 'ip_lists.block_ip'
+
+    if _PING_PATH.match(request.path):
+        ctx.redis_client.set(
+            link_token.get_ping_key(network, request), 1, ex=ctx.cfg['botdetection.link_token.PING_LIVE_TIME']
+        )
+        return None
+
+    if 'User-Agent' in request.headers and http_user_agent.filter_request(network, request, cfg) is not None:
+        return 'http_user_agent'
+
+    if request.path not in LIMIT_PATHS:
+        return None
+
+    for method in header_methods:
+        if method.filter_request(network, request, cfg) is not None:
+            return method.__name__.rsplit('.', 1)[-1]
+
+    if ip_limit.filter_request(network, request, cfg) is not None:
+        return 'ip_limit'
+    return None
+
+
+def _init(cfg_file: pathlib.Path | None) -> ManualClock:
+    # the context of a replay: the counters in a MemRedis, the clock is set to
+    # the time of the requests
+    clock = ManualClock()
+    client = MemRedis(clock=clock)
+    if cfg_file is not None:
+        ctx.init(cfg_file, client)  # type: ignore
+    else:
+        ctx.redis_client = client  # type: ignore
+    return clock
+
+
+def replay_requests(
+    requests: Iterable[Tuple[NetworkKey, LogRequest]], clock: ManualClock, log_format: re.Pattern
+) -> ReplayStats:
+    """Evaluates the ``requests`` (see :py:obj:`parse_lines`) and returns the
+    statistic of the requests."""
+
+    cfg = ctx.cfg
+    header_methods = [method for group, method in HEADER_METHODS if group in log_format.groupindex]
+
+    app = flask.Flask(__name__)
+    app.add_url_rule('/', 'index', lambda: '')
+
+    stats = ReplayStats()
+    with app.test_request_context():
+        for network, request in requests:
+            stats.requests += 1
+            clock.set(request.time)
+            method = evaluate(network, request, cfg, header_methods)
+            if method is not None:
+                stats.blocked += 1
+                stats.blocked_by[method] += 1
+                stats.blocked_networks[network.name] += 1
+    return stats
+
+
+def _received(queue: multiprocessing.Queue) -> Iterator[Tuple[NetworkKey, LogRequest]]:
+    for chunk in iter(queue.get, None):
+        yield from chunk
+
+
+def replay_shard(
+    queue: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    cfg_file: pathlib.Path | None,
+    log_format: str,
+    log_level: int,
+):
+    """Worker of a shard: replays the chunks of requests from the ``queue``
+    (until ``None`` is received) and puts the statistic of the shard in the
+    ``results``."""
+
+    logging.getLogger('botdetection').setLevel(log_level)
+    clock = _init(cfg_file)
+    results.put(replay_requests(_received(queue), clock, re.compile(log_format)))
+
+
+def replay(
+    files: List[pathlib.Path], cfg_file: pathlib.Path | None = None, log_format: str = LOG_FORMAT, jobs: int = 1
+) -> ReplayStats:
+    """Replays the requests from the ``files`` in ``jobs`` processes and
+    returns the merged statistic."""
+
+    clock = _init(cfg_file)
+    fmt = re.compile(log_format)
+    stats = ReplayStats()
+    requests = parse_lines(read_lines(files), fmt, stats)
+    if jobs <= 1:
+        stats.merge(replay_requests(requests, clock, fmt))
+        return stats
+
+    log_level = logging.getLogger('botdetection').level
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    queues: List[multiprocessing.Queue] = [multiprocessing.Queue(maxsize=16) for _ in range(jobs)]
+    workers = [
+        multiprocessing.Process(target=replay_shard, args=(queue, results, cfg_file, log_format, log_level))
+        for queue in queues
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        _dispatch(requests, queues, workers)
+        for _ in workers:
+            stats.merge(_get(results, workers))
+    except BaseException:
+        # the chunks in the queues of the terminated workers are dropped
+        for queue, worker in zip(queues, workers):
+            queue.cancel_join_thread()
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+    return stats
+
+
+def _check_workers(workers: List[multiprocessing.Process]):
+    # a worker that exits without error has put its statistic in the results
+    for worker in workers:
+        if worker.exitcode not in (None, 0):
+            raise RuntimeError(f"replay worker {worker.name} died (exit code {worker.exitcode})")
+
+
+def _get(results: multiprocessing.Queue, workers: List[multiprocessing.Process]) -> ReplayStats:
+    while True:
+        try:
+            return results.get(timeout=POLL_INTERVAL)
+        except Empty:
+            _check_workers(workers)
+
+
+def _put(queue: multiprocessing.Queue, item, workers: List[multiprocessing.Process]):
+    while True:
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return
+        except Full:
+            _check_workers(workers)
+
+
+def _dispatch(
+    requests: Iterable[Tuple[NetworkKey, LogRequest]],
+    queues: List[multiprocessing.Queue],
+    workers: List[multiprocessing.Process],
+):
+    # sends the requests in chunks to the queue of the shard, a None in the
+    # queue ends the worker of a shard
+    jobs = len(queues)
+    chunks: List[List[Tuple[NetworkKey, LogRequest]]] = [[] for _ in range(jobs)]
+    shard_of_network: Dict[bytes, int] = {}
+    for network, request in requests:
+        shard = shard_of_network.get(network.key)
+        if shard is None:
+            shard = shard_of_network[network.key] = zlib.crc32(network.key) % jobs
+        chunk = chunks[shard]
+        chunk.append((network, request))
+        if len(chunk) >= CHUNK_SIZE:
+            _put(queues[shard], chunk, workers)
+            chunks[shard] = []
+    for queue, chunk in zip(queues, chunks):
+        if chunk:
+            _put(queue, chunk, workers)
+        _put(queue, None, workers)
+
+
+def main(argv=None):
+    """Command line of the replay, prints the report of the statistic (see
+    :py:obj:`ReplayStats.report`)."""
+    parser = argparse.ArgumentParser(prog='python -m botdetection.replay', description="Replay of access logs")
+    parser.add_argument('files', nargs='+', type=pathlib.Path, help="access logs (oldest first)")
+    parser.add_argument('--config', type=pathlib.Path, default=None, help="botdetection TOML config")
+    parser.add_argument('--jobs', type=int, default=1, help="number of processes (default: 1)")
+    parser.add_argument('--log-format', default=LOG_FORMAT, help="regular expression of the log lines")
+    parser.add_argument('--top', type=int, default=20, help="number of blocked networks listed (default: 20)")
+    parser.add_argument('--verbose', action='store_true', help="don't mute the botdetection logger")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.getLogger('botdetection').setLevel(logging.CRITICAL)
+    stats = replay(args.files, cfg_file=args.config, log_format=args.log_format, jobs=args.jobs)
+    print(stats.report(top=args.top))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
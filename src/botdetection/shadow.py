@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+""".. _botdetection.shadow:
+
+Shadow evaluation
+-----------------
+
+Before a method is replaced (e.g. the ``sliding_log`` strategy of the
+:py:obj:`.ip_limit` method by the cheaper ``gcra`` strategy or the regular
+expression of the :py:obj:`.http_user_agent` method by a new engine), the
+verdicts of the *candidate* can be compared with the verdicts of the *active*
+method on real traffic.  The candidate is evaluated in a background thread of
+the worker (off the response path) for a sample of the (client) networks
+(``sample``), its verdict never affects the response.  The networks are
+sampled by a stable hash, all requests of a sampled network are evaluated by
+the candidate (a rate limit needs all requests of a network).
+
+For each candidate the agreement of the verdicts (pass or block) and the mean
+latency of the active method and of the candidate are recorded in the worker,
+see :py:obj:`stats`:
+
+.. code:: python
+
+   >>> shadow.stats()
+   {'ip_limit:gcra': {'samples': 5310, 'agreement': 0.998, 'active_only': 8,
+    'candidate_only': 3, 'dropped': 0, 'active_latency': 0.00041,
+    'candidate_latency': 0.00029, 'latency_diff': -0.00012}}
+
+Limiter strategies
+  The ``strategies`` are evaluated next to the strategy of the
+  :py:obj:`.ip_limit` method.  The windows of a candidate are counted in own
+  keys in the redis DB (names with the prefix ``shadow.<strategy>.``), the
+  renewal of a ping is not shadowed.
+
+Methods
+  A filter method (see :py:obj:`wrap`) is shadowed by a candidate with the
+  same signature, e.g. in the WEB application:
+
+  .. code:: python
+
+     user_agent_filter = shadow.wrap('http_user_agent', http_user_agent.filter_request, my_ua.filter_request)
+     ...
+     response = user_agent_filter(network, request, cfg)
+
+Config
+~~~~~~
+
+.. code:: toml
+
+   [botdetection.shadow]
+
+   # activate the shadow evaluation
+   enabled = false
+
+   # fraction of the (client) networks that are evaluated by the candidates
+   sample = 0.01
+
+   # candidate limiter strategies of the ip_limit method (e.g. ['gcra'])
+   strategies = []
+
+   # maximum number of pending evaluations (further evaluations are dropped)
+   queue_size = 1024
+
+Implementations
+~~~~~~~~~~~~~~~
+
+"""
+from __future__ import annotations
+from typing import Callable, Dict, TYPE_CHECKING
+
+import contextvars
+import os
+import queue
+import threading
+import time
+import zlib
+
+from . import ctx
+from ._helpers import logger, NetworkKey
+
+if TYPE_CHECKING:
+    import flask
+    import werkzeug
+    from . import config
+
+logger = logger.getChild('shadow')
+
+
+class ShadowStats:
+    """Counts of the verdicts and the latencies of a candidate."""
+
+    # pylint: disable=too-many-instance-attributes, too-few-public-methods
+
+    def __init__(self):
+        self.samples = 0
+        self.agree = 0
+        self.active_only = 0
+        self.candidate_only = 0
+        self.dropped = 0
+        self.active_time = 0.0
+        self.candidate_time = 0.0
+
+    def add(self, active_blocked: bool, candidate_blocked: bool, active_latency: float, candidate_latency: float):
+        """Counts the verdicts and the latencies of a sampled request."""
+        self.samples += 1
+        if active_blocked == candidate_blocked:
+            self.agree += 1
+        elif active_blocked:
+            self.active_only += 1
+        else:
+            self.candidate_only += 1
+        self.active_time += active_latency
+        self.candidate_time += candidate_latency
+
+    def as_dict(self) -> dict:
+        """Returns the agreement rate and the mean latencies."""
+        n = self.samples or 1
+        return {
+            'samples': self.samples,
+            'agreement': self.agree / n,
+            'active_only': self.active_only,
+            'candidate_only': self.candidate_only,
+            'dropped': self.dropped,
+            'active_latency': self.active_time / n,
+            'candidate_latency': self.candidate_time / n,
+            'latency_diff': (self.candidate_time - self.active_time) / n,
+        }
+
+
+class Shadow:
+    """Evaluates the candidates in a background thread of the worker."""
+
+    def __init__(self, sample: float, queue_size: int):
+        self.sample = sample
+        self._threshold = int(sample * 0x100000000)
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._stats: Dict[str, ShadowStats] = {}
+        self._lock = threading.Lock()
+        self._pid = 0
+
+    def sampled(self, network: NetworkKey) -> bool:
+        """``True`` if the requests of ``network`` are evaluated by the
+        candidates (the sample is identical in all workers)."""
+        return zlib.crc32(network.key) < self._threshold
+
+    def submit(self, name: str, active_blocked: bool, active_latency: float, candidate: Callable[[], bool]):
+        """Queues the evaluation of a ``candidate`` (returns ``True`` if the
+        request is blocked) in the context of the caller."""
+        if self._pid != os.getpid():
+            self._start()
+        job = (name, active_blocked, active_latency, candidate, contextvars.copy_context())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._get_stats(name).dropped += 1
+
+    def stats(self) -> Dict[str, dict]:
+        """Returns the statistics of the candidates (see
+        :py:obj:`ShadowStats.as_dict`)."""
+        with self._lock:
+            return {name: s.as_dict() for name, s in self._stats.items()}
+
+    def _get_stats(self, name: str) -> ShadowStats:
+        candidate = self._stats.get(name)
+        if candidate is None:
+            candidate = self._stats[name] = ShadowStats()
+        return candidate
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a forked worker needs its own thread
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='botdetection-shadow', daemon=True).start()
+
+    def _run(self):
+        while True:
+            name, active_blocked, active_latency, candidate, context = self._queue.get()
+            start = time.perf_counter()
+            try:
+                blocked = context.run(candidate)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.error("shadow %s failed: %s", name, exc)
+                continue
+            latency = time.perf_counter() - start
+            with self._lock:
+                self._get_stats(name).add(active_blocked, bool(blocked), active_latency, latency)
+
+
+def _cfg(name):
+    return ctx.cfg.get(f'botdetection.shadow.{name}')
+
+
+def get_shadow() -> Shadow | None:
+    """Returns the :py:obj:`Shadow` of this worker in the current context
+    (``None`` if the shadow evaluation is not enabled)."""
+    if not _cfg('enabled'):
+        return None
+    return ctx.state('shadow', lambda: Shadow(_cfg('sample'), _cfg('queue_size')))
+
+
+def stats() -> Dict[str, dict]:
+    """Returns the statistics of the candidates in this worker."""
+    shadow = get_shadow()
+    if shadow is None:
+        return {}
+    return shadow.stats()
+
+
+def wrap(
+    name: str,
+    active: Callable[[NetworkKey, flask.Request, config.Config], werkzeug.Response | None],
+    candidate: Callable[[NetworkKey, flask.Request, config.Config], werkzeug.Response | None],
+) -> Callable[[NetworkKey, flask.Request, config.Config], werkzeug.Response | None]:
+    """Returns a filter method that returns the response of the ``active``
+    method and evaluates the ``candidate`` method in the shadow."""
+
+    def filter_request(network: NetworkKey, request: flask.Request, cfg: config.Config) -> werkzeug.Response | None:
+        shadow = get_shadow()
+        if shadow is None or not shadow.sampled(network):
+            return active(network, request, cfg)
+        start = time.perf_counter()
+        response = active(network, request, cfg)
+        latency = time.perf_counter() - start
+        # the request object of the context local proxy can be passed to the thread
+        real_request = getattr(request, '_get_current_object', lambda: request)()
+        shadow.submit(
+            name, response is not None, latency, lambda: candidate(network, real_request, cfg) is not None
+        )
+        return response
+
+    return filter_request
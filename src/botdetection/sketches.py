@@ -0,0 +1,145 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+"""Probabilistic data structures with a constant memory footprint, used to
+count the requests of a large number of (client) networks.
+
+The hash functions of the sketches are seeded by the hash of Python's ``str``,
+which is randomized per process: the sketches are local to a worker, to merge
+counts across workers the counted keys are merged (e.g. in the redis DB).
+
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple
+from array import array
+
+import heapq
+import math
+import random
+
+__all__ = ['CountMinSketch', 'TopK', 'HyperLogLog']
+
+_PRIME = (1 << 61) - 1
+_MASK64 = (1 << 64) - 1
+
+
+class CountMinSketch:
+    """A `Count-Min Sketch`_ with ``depth`` rows of ``width`` counters.  The
+    estimated count of a key is never less than the true count, the error is at
+    most ``2 * N / width`` (``N`` total count) with probability ``1 - 2^-depth``.
+
+    .. _Count-Min Sketch: https://en.wikipedia.org/wiki/Count%E2%80%93min_sketch
+    """
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        rnd = random.Random(width * depth)
+        # pairwise independent hash functions: ((a * h + b) mod p) mod width
+        self._hashes = [(rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME)) for _ in range(depth)]
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _columns(self, key: str):
+        h = hash(key)
+        return [((a * h + b) % _PRIME) % self.width for a, b in self._hashes]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Adds ``count`` to ``key`` and returns the estimated count of ``key``."""
+        est = None
+        for row, col in zip(self.rows, self._columns(key)):
+            row[col] += count
+            est = row[col] if est is None else min(est, row[col])
+        return est or 0
+
+    def estimate(self, key: str) -> int:
+        """Returns the estimated count of ``key`` (never less than the true
+        count)."""
+        return min(row[col] for row, col in zip(self.rows, self._columns(key)))
+
+    def clear(self):
+        """Resets all counters."""
+        for row in self.rows:
+            row[:] = array('Q', bytes(8 * self.width))
+
+
+class TopK:
+    """Keeps the ``k`` keys with the highest counts.  As in the `Space-Saving`_
+    algorithm a new key replaces the key with the minimal count, the count of a
+    key is the estimate from the :py:obj:`CountMinSketch`.
+
+    .. _Space-Saving: https://www.cs.ucsb.edu/sites/default/files/documents/2005-23.pdf
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def _min(self) -> Tuple[int, str]:
+        # drop outdated entries from the (lazy) heap
+        while self._heap[0][0] != self.counts.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+    def offer(self, key: str, count: int):
+        """Sets the ``count`` of ``key`` if the key is tracked or if the count is
+        higher than the minimal count in the top-K."""
+        if key not in self.counts:
+            if len(self.counts) >= self.k:
+                min_count, min_key = self._min()
+                if count <= min_count:
+                    return
+                del self.counts[min_key]
+                heapq.heappop(self._heap)
+        self.counts[key] = count
+        heapq.heappush(self._heap, (count, key))
+        if len(self._heap) > 8 * self.k:
+            self._heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def items(self) -> List[Tuple[str, int]]:
+        """Returns the tracked keys and counts, highest count first."""
+        return sorted(self.counts.items(), key=lambda x: x[1], reverse=True)
+
+    def clear(self):
+        """Drops all tracked keys."""
+        self.counts.clear()
+        self._heap.clear()
+
+
+class HyperLogLog:
+    """A HyperLogLog_ with ``2^precision`` registers of one byte, the memory is
+    constant and the standard error of the count is ``1.04 / sqrt(2^precision)``
+    (``precision = 10``: 1 KiB, 3.25%).
+
+    .. _HyperLogLog: https://en.wikipedia.org/wiki/HyperLogLog
+    """
+
+    def __init__(self, precision: int = 10):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self._alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def add(self, key: str) -> bool:
+        """Adds ``key`` and returns ``True`` if a register has been changed
+        (``False`` means: the key has most likely been counted before)."""
+        h = hash(key) & _MASK64
+        idx = h >> (64 - self.precision)
+        rank = 64 - self.precision - (h & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+            return True
+        return False
+
+    def count(self) -> int:
+        """Returns the estimated number of distinct keys."""
+        est = self._alpha * self.m * self.m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * self.m and zeros:
+            # small range correction (linear counting)
+            est = self.m * math.log(self.m / zeros)
+        return int(est)
+
+    def clear(self):
+        """Resets all registers."""
+        self.registers[:] = bytes(self.m)
@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+# pylint: disable=missing-module-docstring, missing-class-docstring, missing-function-docstring
+from __future__ import annotations
+
+import pathlib
+import random
+import tempfile
+import unittest
+
+import botdetection
+from botdetection import batch, ip_limit, link_token
+from botdetection.limiter import STRATEGIES
+from botdetection.memredis import MemRedis, ManualClock
+
+CFG = """
+[botdetection.ip_limit]
+link_token = true
+strategy = '%s'
+policies = [
+  { name = 'search', routes = ['/search'], weight = 3 },
+  { name = 'static', routes = ['/static/*'], weight = 0 },
+]
+
+[botdetection.propagation]
+enabled = %s
+"""
+
+IPS = [f'192.0.2.{i}' for i in range(8)] + ['2001:db8::1', '2001:db8:1::1', 'fe80::1']
+PATHS = ['/', '/search', '/search', '/static/app.js', '/preferences']
+BATCH_SIZE = 50
+
+
+def _requests(count: int):
+    rnd = random.Random(42)
+    return [
+        batch.RequestInfo(
+            rnd.choice(IPS),
+            rnd.choice(PATHS),
+            args={'format': 'json'} if rnd.random() < 0.1 else {},
+            headers={'User-Agent': rnd.choice(['a', 'b']), 'Accept-Language': 'en'},
+        )
+        for _ in range(count)
+    ]
+
+
+class _Node:
+    """A context with its own redis DB, the requests with the user agent ``a``
+    of the first networks have a ping."""
+
+    def __init__(self, cfg_file: pathlib.Path, requests):
+        self.clock = ManualClock(1_700_000_000.0)
+        self.client = MemRedis(clock=self.clock)
+        self.context = botdetection.Context()
+        self.context.init(cfg_file, self.client)  # type: ignore
+        with self.context.use():
+            for req in requests:
+                network = botdetection.get_network(req.real_ip, self.context.cfg)
+                if req.real_ip in IPS[:4] and req.headers['User-Agent'] == 'a':
+                    self.client.set(link_token.get_ping_key(network, req), 1, ex=3600)
+
+    def snapshot(self):
+        counters = {}
+        for key in self.client.keys():
+            key_type = self.client.type(key)
+            if key_type == b'zset':
+                counters[key] = self.client.zcard(key)
+            elif key_type == b'hash':
+                counters[key] = self.client.hgetall(key)
+            elif key_type == b'string':
+                counters[key] = self.client.get(key)
+        return counters
+
+    def stop(self):
+        state = self.context.worker_state('propagation')
+        if state is not None:
+            state[1].stop()
+            state[1].join()
+
+
+class BatchTests(unittest.TestCase):
+    """The verdicts of a batch are the verdicts of :py:func:`ip_limit.evaluate`
+    for the requests one by one."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.requests = _requests(20 * BATCH_SIZE)
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+        self._tmp.cleanup()
+
+    def evaluate(self, strategy: str, propagated: bool):
+        """Evaluates the requests one by one and in batches (in two nodes),
+        returns the nodes."""
+        cfg_file = pathlib.Path(self._tmp.name) / f'{strategy}-{propagated}.toml'
+        cfg_file.write_text(CFG % (strategy, str(propagated).lower()), encoding='utf-8')
+        one_by_one, batched = self.nodes = [_Node(cfg_file, self.requests), _Node(cfg_file, self.requests)]
+        expected, verdicts = [], []
+        for start in range(0, len(self.requests), BATCH_SIZE):
+            requests = self.requests[start : start + BATCH_SIZE]
+            with one_by_one.context.use():
+                cfg = one_by_one.context.cfg
+                expected += [
+                    ip_limit.evaluate(botdetection.get_network(req.real_ip, cfg), req, cfg)  # type: ignore
+                    for req in requests
+                ]
+            with batched.context.use():
+                verdicts += batch.evaluate(requests)
+            one_by_one.clock.advance(1)
+            batched.clock.advance(1)
+        mismatches = [(i, v, e) for i, (v, e) in enumerate(zip(verdicts, expected)) if v != e]
+        self.assertEqual(mismatches[:3], [])
+        self.assertTrue(any(v.status == 429 for v in verdicts))
+        self.assertTrue(any(v.status == 302 for v in verdicts))
+        return one_by_one, batched
+
+    def test_verdicts_and_counters(self):
+        for strategy in STRATEGIES:
+            with self.subTest(strategy=strategy):
+                one_by_one, batched = self.evaluate(strategy, False)
+                self.assertEqual(batched.snapshot(), one_by_one.snapshot())
+
+    def test_propagated_verdicts(self):
+        # with the propagation the verdicts are the same, but a batch counts
+        # the requests of a network which has been blocked in the batch
+        for strategy in STRATEGIES:
+            with self.subTest(strategy=strategy):
+                self.evaluate(strategy, True)
+                for node in self.nodes:
+                    node.stop()
+                self.nodes = []
+
+if __name__ == '__main__':
+    unittest.main()
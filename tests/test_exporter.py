@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+# pylint: disable=missing-module-docstring, missing-class-docstring, missing-function-docstring
+from __future__ import annotations
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+import botdetection
+from botdetection import exporter
+from botdetection.memredis import MemRedis
+
+CFG = """
+[botdetection.ip_lists]
+block_ip = ['192.0.2.0/24', '198.51.100.7', '2001:db8::/32']
+pass_ip = ['192.0.2.128/25', '2001:db8:1::/48']
+
+[botdetection.exporter]
+record_blocks = true
+"""
+
+
+class ExporterTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.folder = pathlib.Path(self._tmp.name)
+        cfg_file = self.folder / 'botdetection.toml'
+        cfg_file.write_text(CFG, encoding='utf-8')
+        self.client = MemRedis()
+        self.context = botdetection.Context()
+        self.context.init(cfg_file, self.client)  # type: ignore
+        self._use = self.context.use()
+        self._use.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def tearDown(self):
+        self._use.__exit__(None, None, None)
+        self._tmp.cleanup()
+
+    def export(self, fmt: str) -> str:
+        output = self.folder / f'blocked.{fmt}'
+        exporter.export(self.client, fmt, output)
+        return output.read_text(encoding='utf-8')
+
+    def test_pass_ip_is_subtracted(self):
+        networks = [n.compressed for n in exporter.collapse(exporter.blocked_networks(self.client))]
+        self.assertIn('192.0.2.0/25', networks)
+        self.assertNotIn('192.0.2.0/24', networks)
+        self.assertFalse([n for n in networks if n.startswith('192.0.2.128')])
+        self.assertNotIn('2001:db8::/32', networks)
+        self.assertIn('2001:db8::/48', networks)
+
+    def test_nginx_geo(self):
+        content = self.export('nginx-geo')
+        self.assertTrue(content.startswith(exporter.HEADER))
+        self.assertIn('192.0.2.0/25 1;\n', content)
+        self.assertIn('198.51.100.7/32 1;\n', content)
+        self.assertIn('2001:db8::/48 1;\n', content)
+
+    def test_nginx_map(self):
+        content = self.export('nginx-map')
+        # a map can only match addresses
+        self.assertEqual(content, exporter.HEADER + '"198.51.100.7" 1;\n')
+
+    def test_ipset(self):
+        content = self.export('ipset')
+        self.assertIn('create botdetection hash:net family inet -exist\n', content)
+        self.assertIn('add botdetection-tmp 192.0.2.0/25\n', content)
+        self.assertIn('swap botdetection-tmp botdetection\n', content)
+        self.assertIn('add botdetection6-tmp 2001:db8::/48\n', content)
+        self.assertIn('swap botdetection6-tmp botdetection6\n', content)
+
+    def test_nft(self):
+        content = self.export('nft')
+        self.assertIn('table inet botdetection {\n', content)
+        self.assertIn('flush set inet botdetection botdetection4\n', content)
+        self.assertIn('add element inet botdetection botdetection4 { 192.0.2.0/25, 198.51.100.7/32 }\n', content)
+        self.assertIn('add element inet botdetection botdetection6 { 2001:db8::/48,', content)
+
+    def test_recorded_block(self):
+        network = botdetection.get_network('203.0.113.9', botdetection.ctx.cfg)
+        exporter.record_block(network, 60)
+        self.assertIn('203.0.113.9/32 1;\n', self.export('nginx-geo'))
+        # a blocked network of the pass_ip list is not exported
+        network = botdetection.get_network('192.0.2.200', botdetection.ctx.cfg)
+        exporter.record_block(network, 60)
+        self.assertNotIn('192.0.2.200', self.export('nginx-geo'))
+
+    def test_write_atomic(self):
+        path = self.folder / 'blocked.geo'
+        self.assertTrue(exporter.write_atomic(path, 'foo\n'))
+        inode = os.stat(path).st_ino
+
+        # unchanged content: the file is not touched
+        self.assertFalse(exporter.write_atomic(path, 'foo\n'))
+        self.assertEqual(os.stat(path).st_ino, inode)
+
+        # changed content: the file is replaced (rename of a new file)
+        self.assertTrue(exporter.write_atomic(path, 'bar\n'))
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(path.read_text(encoding='utf-8'), 'bar\n')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+        # no temporary files are left
+        self.assertEqual([p.name for p in self.folder.iterdir() if p.name.startswith('.')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
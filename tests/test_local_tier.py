@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+# pylint: disable=missing-module-docstring, missing-class-docstring, missing-function-docstring
+from __future__ import annotations
+
+import unittest
+
+import botdetection
+from botdetection.ip_limit import Window
+from botdetection.limiter import STRATEGIES, get_limiter
+from botdetection.local_tier import LocalTier
+from botdetection.memredis import MemRedis, ManualClock
+from botdetection.redislib import WINDOW_BLOCK
+
+MAXIMUM = 20
+SHARE = 0.25
+
+
+def _window(name: bytes = b'ip_limit.LONG_WINDOW192.0.2.1/32') -> Window:
+    return Window(WINDOW_BLOCK, name, 600, MAXIMUM)
+
+
+class LocalTierTests(unittest.TestCase):
+    """The clock of the redis DB is stopped: no request expires and no token
+    is refilled in a test."""
+
+    def setUp(self):
+        self.client = MemRedis(clock=ManualClock(1_700_000_000.0))
+        self.context = botdetection.Context()
+        self._use = self.context.use()
+        self._use.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def tearDown(self):
+        self._use.__exit__(None, None, None)
+
+    def passed(self, tier: LocalTier, strategy: str, window: Window) -> bool:
+        counts = tier.incr_windows(get_limiter(strategy), self.client, [window])
+        return counts[-1] <= window.maximum
+
+    def test_error_bound(self):
+        workers = 3
+        bound = MAXIMUM + (workers - 1) * SHARE * MAXIMUM
+        for strategy in STRATEGIES:
+            with self.subTest(strategy=strategy):
+                self.client.flushall()
+                tiers = [LocalTier(SHARE, 60, 1024) for _ in range(workers)]
+                passed = sum(self.passed(tiers[i % workers], strategy, _window()) for i in range(20 * MAXIMUM))
+                self.assertGreaterEqual(passed, MAXIMUM)
+                self.assertLessEqual(passed, bound)
+
+    def test_pending_is_charged(self):
+        # the requests passed by the local tier are charged to the window, also
+        # if the request which syncs the window is blocked
+        for strategy in STRATEGIES:
+            with self.subTest(strategy=strategy):
+                self.client.flushall()
+                limiter = get_limiter(strategy)
+                tier = LocalTier(0.5, 60, 1024)
+                window = _window()._replace(maximum=10)
+                passed = sum(self.passed(tier, strategy, window) for _ in range(6))
+                self.assertEqual(passed, 6)  # 1 in the redis DB, 5 local
+                # other nodes take 4 requests of the window
+                for _ in range(4):
+                    self.assertLessEqual(limiter.incr_windows(self.client, [window])[-1], 10)
+                self.assertFalse(self.passed(tier, strategy, window))
+                self.assertGreater(limiter.incr_windows(self.client, [window])[-1], 10)
+
+    def test_evicted_pending_is_charged(self):
+        for strategy in STRATEGIES:
+            with self.subTest(strategy=strategy):
+                self.client.flushall()
+                limiter = get_limiter(strategy)
+                tier = LocalTier(0.5, 60, 2)
+                windows = [_window(b'ip_limit.LONG_WINDOW192.0.2.%d/32' % i)._replace(maximum=10) for i in range(3)]
+                for _ in range(4):
+                    self.assertTrue(self.passed(tier, strategy, windows[0]))
+                # the third window overflows the cache of the local tier
+                self.assertTrue(self.passed(tier, strategy, windows[1]))
+                self.assertTrue(self.passed(tier, strategy, windows[2]))
+                self.assertEqual(limiter.incr_windows(self.client, [windows[0]]), [5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+# pylint: disable=missing-module-docstring, missing-class-docstring, missing-function-docstring
+from __future__ import annotations
+
+import pathlib
+import tempfile
+import unittest
+
+import botdetection
+from botdetection import redislib
+from botdetection.memredis import MemRedis, ManualClock
+from botdetection.redislib import WINDOW_BLOCK, WINDOW_CHARGE, WINDOW_COUNT, WINDOW_DROP, WINDOW_EXPIRE
+
+T0 = 1_700_000_000.0
+
+
+class _MemRedisTests(unittest.TestCase):
+    """The clock of the redis DB is a :py:obj:`ManualClock`."""
+
+    CFG = ''
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        cfg_file = pathlib.Path(self._tmp.name) / 'botdetection.toml'
+        cfg_file.write_text(self.CFG, encoding='utf-8')
+        self.clock = ManualClock(T0)
+        self.client = MemRedis(clock=self.clock)
+        self.context = botdetection.Context()
+        self.context.init(cfg_file, self.client)  # type: ignore
+        self._use = self.context.use()
+        self._use.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def tearDown(self):
+        self._use.__exit__(None, None, None)
+        self._tmp.cleanup()
+
+
+class SlidingWindowTests(_MemRedisTests):
+
+    def test_weights(self):
+        incr = redislib.incr_sliding_window
+        counts = []
+        for w in (1, 3, 1):
+            counts.append(incr(self.client, 'x', 10, w))
+            self.clock.advance(0.001)
+        self.assertEqual(counts, [1, 4, 5])
+        self.clock.advance(5)
+        self.assertEqual(incr(self.client, 'x', 10, 2), 7)
+        # the items of the first second expire, their weights are subtracted
+        self.clock.advance(6)
+        self.assertEqual(incr(self.client, 'x', 10), 3)
+        self.clock.advance(20)
+        self.assertEqual(incr(self.client, 'x', 10), 1)
+
+    def test_extra_weights(self):
+        key = redislib.redis_key('counter', 'x')
+        redislib.incr_sliding_window(self.client, 'x', 10)
+        # a window without weighted items has no companion counter
+        self.assertFalse(self.client.exists(key + redislib.EXTRA_WEIGHTS))
+        redislib.incr_sliding_window(self.client, 'x', 10, 4)
+        self.assertEqual(self.client.get(key + redislib.EXTRA_WEIGHTS), b'3')
+        self.assertEqual(self.client.ttl(key + redislib.EXTRA_WEIGHTS), 10)
+        self.assertEqual(self.client.zcard(key), 2)
+
+    def test_expire(self):
+        key = redislib.redis_key('counter', 'x')
+        redislib.incr_sliding_window(self.client, 'x', 10, 2)
+        self.clock.advance(9.9)
+        self.assertTrue(self.client.exists(key))
+        self.clock.advance(0.2)
+        self.assertFalse(self.client.exists(key, key + redislib.EXTRA_WEIGHTS))
+        self.assertEqual(redislib.incr_sliding_window(self.client, 'x', 10), 1)
+
+
+class CompactSlidingWindowTests(SlidingWindowTests):
+
+    CFG = """
+[botdetection.redis]
+compact_keys = true
+"""
+
+    def test_same_microsecond(self):
+        # the integer items of requests in the same µs are incremented (the
+        # item of a weighted request differs by its suffix)
+        counts = [redislib.incr_sliding_window(self.client, 'x', 10, w) for w in (1, 1, 2, 1)]
+        self.assertEqual(counts, [1, 2, 4, 5])
+        members = self.client.zrangebyscore(redislib.redis_key('counter', 'x'), '-inf', '+inf')
+        self.assertEqual(
+            members, [b'1700000000000000', b'1700000000000000:2', b'1700000000000001', b'1700000000000002']
+        )
+
+
+class TokenBucketTests(_MemRedisTests):
+
+    def test_tokens(self):
+        incr = redislib.incr_token_bucket
+        # 10 tokens, one token is refilled per second
+        self.assertEqual(incr(self.client, 'x', 10, 10, 3), 3)
+        self.assertEqual(incr(self.client, 'x', 10, 10, 7), 10)
+        # not enough tokens: no token is taken
+        self.assertEqual(incr(self.client, 'x', 10, 10), 11)
+        self.clock.advance(1)
+        self.assertEqual(incr(self.client, 'x', 10, 10), 10)
+        self.assertEqual(incr(self.client, 'x', 10, 10, 2), 12)
+        self.clock.advance(10)
+        self.assertEqual(incr(self.client, 'x', 10, 10), 1)
+
+    def test_expire(self):
+        key = redislib.redis_key('bucket', 'x')
+        redislib.incr_token_bucket(self.client, 'x', 10, 10)
+        self.assertEqual(self.client.pttl(key), 10000)
+        self.clock.advance(10.001)
+        self.assertFalse(self.client.exists(key))
+
+
+class GCRATests(_MemRedisTests):
+
+    def test_conforming(self):
+        incr = redislib.incr_gcra
+        # a burst of 10 requests, one request per second
+        self.assertEqual(incr(self.client, 'x', 10, 10, 3), 3)
+        self.assertEqual(incr(self.client, 'x', 10, 10, 7), 10)
+        # not conforming: the request is not counted
+        self.assertEqual(incr(self.client, 'x', 10, 10), 11)
+        self.clock.advance(1)
+        self.assertEqual(incr(self.client, 'x', 10, 10), 10)
+        self.clock.advance(4.5)
+        self.assertEqual(incr(self.client, 'x', 10, 10), 7)
+
+    def test_expire(self):
+        key = redislib.redis_key('gcra', 'x')
+        redislib.incr_gcra(self.client, 'x', 10, 10, 3)
+        # the key expires at the theoretical arrival time
+        self.assertEqual(self.client.pttl(key), 3000)
+        self.clock.advance(3.001)
+        self.assertFalse(self.client.exists(key))
+
+
+class IncrWindowsTests(_MemRedisTests):
+
+    def test_block(self):
+        windows = [(WINDOW_COUNT, 'a', 10, 1, 1), (WINDOW_BLOCK, 'b', 10, 2, 1), (WINDOW_COUNT, 'c', 10, 5, 1)]
+        for strategy in ('sliding_log', 'token_bucket', 'gcra'):
+            with self.subTest(strategy=strategy):
+                self.client.flushall()
+                incr = [redislib.incr_windows(self.client, strategy, 'counter', windows) for _ in range(3)]
+                # the evaluation stops at the window that blocks
+                self.assertEqual(incr[:2], [[1, 1, 1], [2, 2, 2]])
+                self.assertEqual(len(incr[2]), 2)
+                self.assertGreater(incr[2][1], 2)
+
+    def test_drop(self):
+        redislib.incr_sliding_window(self.client, 'a', 10, 3)
+        key = redislib.redis_key('counter', 'a')
+        windows = [(WINDOW_DROP, 'a', 10, 1, 1)]
+        self.assertEqual(redislib.incr_windows(self.client, 'sliding_log', 'counter', windows), [0])
+        self.assertFalse(self.client.exists(key, key + redislib.EXTRA_WEIGHTS))
+
+    def test_expire(self):
+        self.client.set('ping', 1, ex=5)
+        windows = [(WINDOW_EXPIRE, 'ping', 100, 0, 0)]
+        self.assertEqual(redislib.incr_windows(self.client, 'sliding_log', 'counter', windows), [0])
+        self.assertEqual(self.client.ttl('ping'), 100)
+
+    def test_charge(self):
+        windows = [(WINDOW_CHARGE, 'a', 10, 2, 5), (WINDOW_BLOCK, 'a', 10, 2, 1), (WINDOW_COUNT, 'b', 10, 2, 1)]
+        counts = {
+            # a sliding log counts each request
+            'sliding_log': [5, 6],
+            # the tokens are taken on credit, the request is not counted
+            'token_bucket': [5, 6],
+            'gcra': [5, 6],
+        }
+        for strategy, expected in counts.items():
+            with self.subTest(strategy=strategy):
+                self.client.flushall()
+                self.assertEqual(redislib.incr_windows(self.client, strategy, 'counter', windows), expected)
+                # the debt of the charge is paid after 5 * 10 / 2 sec
+                self.clock.advance(25)
+                if strategy != 'sliding_log':
+                    self.assertEqual(redislib.incr_windows(self.client, strategy, 'counter', windows[1:]), [1, 1])
+
+
+class ManualClockTests(_MemRedisTests):
+
+    def test_expire(self):
+        self.client.set('a', 1, ex=5)
+        self.client.set('b', 1, px=1500)
+        self.clock.advance(1.4)
+        self.assertEqual(self.client.pttl('b'), 100)
+        self.clock.advance(0.2)
+        self.assertIsNone(self.client.get('b'))
+        self.assertEqual(self.client.ttl('a'), 3)
+        self.clock.advance(3.3)
+        self.assertEqual(self.client.get('a'), b'1')
+        self.clock.set(T0 + 5.1)
+        self.assertIsNone(self.client.get('a'))
+        self.assertEqual(self.client.keys(), [])
+
+    def test_time(self):
+        self.clock.set(T0 + 0.25)
+        self.assertEqual(self.client.time(), (1700000000, 250000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# lint: pylint
+# pylint: disable=missing-module-docstring, missing-class-docstring, missing-function-docstring
+from __future__ import annotations
+
+import pathlib
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import redis
+
+import botdetection
+from botdetection import propagation
+from botdetection.memredis import MemRedis
+
+CFG = """
+[botdetection.propagation]
+enabled = true
+block_time = 20
+"""
+
+TIMEOUT = 5.0
+
+
+def _wait(func, timeout=TIMEOUT):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        result = func()
+        if result:
+            return result
+        time.sleep(0.01)
+    return func()
+
+
+class PropagationTests(unittest.TestCase):
+    """Two nodes with their own context (and subscriber) share one redis DB."""
+
+    def make_client(self):
+        return MemRedis()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        cfg_file = pathlib.Path(self._tmp.name) / 'botdetection.toml'
+        cfg_file.write_text(CFG, encoding='utf-8')
+        self.client = self.make_client()
+        self.node_a = botdetection.Context()
+        self.node_a.init(cfg_file, self.client)  # type: ignore
+        self.node_b = botdetection.Context()
+        self.node_b.init(cfg_file, self.client)  # type: ignore
+        self.network = botdetection.get_network('203.0.113.9', self.node_a.cfg)
+        # start the subscriber of node B
+        with self.node_b.use():
+            self.assertIsNotNone(propagation.get_cache())
+
+    def tearDown(self):
+        subscribers = []
+        for node in (self.node_a, self.node_b):
+            state = node.worker_state('propagation')
+            if state is not None:
+                state[1].stop()
+                subscribers.append(state[1])
+        for subscriber in subscribers:
+            subscriber.join()
+        self._tmp.cleanup()
+
+    def lookup(self, node: botdetection.Context):
+        with node.use():
+            return propagation.lookup(self.network)
+
+    def publish(self):
+        # the subscriber of node B is started asynchronous, the block is
+        # published until node B has received it
+        def published():
+            with self.node_a.use():
+                propagation.publish(self.network, 429, 'too many requests')
+            return self.lookup(self.node_b)
+
+        return _wait(published)
+
+    def test_publish(self):
+        self.assertIsNone(self.lookup(self.node_b))
+        self.assertEqual(self.publish(), (429, 'too many requests'))
+        # the block is cached immediately on the publishing node
+        self.assertEqual(self.lookup(self.node_a), (429, 'too many requests'))
+        other = botdetection.get_network('198.51.100.7', self.node_a.cfg)
+        with self.node_b.use():
+            self.assertIsNone(propagation.lookup(other))
+
+    def test_revoke(self):
+        self.assertIsNotNone(self.publish())
+        with self.node_a.use():
+            propagation.revoke(self.network)
+        self.assertIsNone(self.lookup(self.node_a))
+        self.assertTrue(_wait(lambda: self.lookup(self.node_b) is None))
+
+    def test_expiry(self):
+        self.assertIsNotNone(self.publish())
+        expired = time.time() + 20
+        with mock.patch.object(propagation.time, 'time', return_value=expired):
+            self.assertIsNone(self.lookup(self.node_a))
+            self.assertIsNone(self.lookup(self.node_b))
+        with self.node_b.use():
+            self.assertEqual(len(propagation.get_cache()), 0)  # type: ignore
+
+    def test_invalid_message(self):
+        with self.node_b.use():
+            cache = propagation.get_cache()
+        subscriber = propagation.Subscriber(self.client, 'test', cache)  # type: ignore
+        with self.assertLogs(propagation.logger, 'ERROR'):
+            subscriber.receive(b'{"network": "203.0.113.9/32"}')
+        self.assertIsNone(self.lookup(self.node_b))
+
+
+class RedisPropagationTests(PropagationTests):
+    """The tests of :py:obj:`PropagationTests` with a local redis-server
+    (skipped if there is no redis-server on localhost)."""
+
+    @classmethod
+    def setUpClass(cls):
+        client = redis.Redis(socket_connect_timeout=1)
+        try:
+            client.ping()
+        except redis.ConnectionError as exc:
+            raise unittest.SkipTest("no redis-server on localhost") from exc
+        finally:
+            client.close()
+
+    def make_client(self):
+        return redis.Redis()
+
+
+if __name__ == '__main__':
+    unittest.main()